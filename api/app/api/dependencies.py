@@ -1,26 +1,27 @@
 import uuid
+from datetime import UTC, datetime
 from typing import Annotated
 
 import jwt
-from confluent_kafka import Producer
 from fastapi import Cookie, Depends, HTTPException, Query, WebSocketException, status
 from jwt.exceptions import InvalidTokenError
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app.core.auth_cache import cache_local_auth_session, get_local_auth_session
 from app.core.config import Settings, get_settings
-from app.core.database import get_session
+from app.core.database import get_async_session
 from app.core.security import oauth2_scheme
-from app.core.stream import get_producer
+from app.core.stream import ManagedProducer, get_producer
 from app.models.user import AuthSession, User
 from app.services.user_service import user_service
 
 SettingsDep = Annotated[Settings, Depends(get_settings)]
 
 # dependency to get DB sessions
-SessionDep = Annotated[Session, Depends(get_session)]
+SessionDep = Annotated[AsyncSession, Depends(get_async_session)]
 
 # dependency to get Kafka producers
-ProducerDep = Annotated[Producer, Depends(get_producer)]
+ProducerDep = Annotated[ManagedProducer, Depends(get_producer)]
 
 # this dependency only ensures that a token exists in the request
 TokenDep = Annotated[str, Depends(oauth2_scheme)]
@@ -38,6 +39,11 @@ async def get_current_user(
         detail='Could not validate credentials',
         headers={'WWW-Authenticate': 'Bearer'},
     )
+    # The same token was already verified by this process
+    user_auth_session = get_local_auth_session(token)
+    if user_auth_session is not None:
+        return user_auth_session
+
     try:
         # expiration time is automatically verified in jwt.decode()
         payload = jwt.decode(
@@ -52,12 +58,15 @@ async def get_current_user(
     except InvalidTokenError as err:
         raise credentials_exception from err
 
-    user_auth_session = user_service.get_user_with_auth_session(
+    user_auth_session = await user_service.get_user_with_auth_session(
         db=session, username=username, auth_session_id=uuid.UUID(auth_session_id)
     )
     if user_auth_session is None:
         raise credentials_exception
 
+    cache_local_auth_session(
+        token, *user_auth_session, token_expires_date=datetime.fromtimestamp(payload['exp'], UTC)
+    )
     return user_auth_session
 
 
@@ -95,7 +104,7 @@ async def get_current_user_from_refresh_token(
     except InvalidTokenError as err:
         raise credentials_exception from err
 
-    user_auth_session = user_service.get_user_with_auth_session(
+    user_auth_session = await user_service.get_user_with_auth_session(
         db=session, username=username, auth_session_id=uuid.UUID(auth_session_id)
     )
     if user_auth_session is None or str(user_auth_session[1].token_version) != token_version:
@@ -3,21 +3,18 @@ from typing import Annotated
 from fastapi import APIRouter, BackgroundTasks, File, HTTPException, Path, Query, UploadFile, status
 
 from app.api.dependencies import CurrentUserDep, ProducerDep, SessionDep, SettingsDep
-from app.schemas.file import FileResponse, ListFilesQueries, ListFilesResponse
+from app.schemas.file import (
+    FileResponse,
+    ListFilesQueries,
+    ListFilesResponse,
+    UploadBatchResponse,
+)
 from app.services.file_service import file_service
 
 router = APIRouter()
 
 
-@router.post('/upload', response_model=FileResponse)
-async def upload_file(
-    current_user: CurrentUserDep,
-    settings: SettingsDep,
-    session: SessionDep,
-    producer: ProducerDep,
-    background_tasks: BackgroundTasks,
-    file: Annotated[UploadFile, File()],
-):
+def check_upload(file: UploadFile):
     if file.filename is None or file.filename == '':
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -42,17 +39,65 @@ async def upload_file(
             detail='File too large (Max 5MB)',
         )
 
+
+@router.post('/upload', response_model=FileResponse)
+async def upload_file(
+    current_user: CurrentUserDep,
+    settings: SettingsDep,
+    session: SessionDep,
+    background_tasks: BackgroundTasks,
+    file: Annotated[UploadFile, File()],
+):
+    check_upload(file)
+
     new_file = await file_service.upload_file(
         user_id=current_user.id,
         settings=settings,
         db=session,
-        producer=producer,
         background_tasks=background_tasks,
         file=file,
     )
     return new_file
 
 
+@router.post('/upload-batch', response_model=UploadBatchResponse)
+async def upload_files(
+    current_user: CurrentUserDep,
+    settings: SettingsDep,
+    session: SessionDep,
+    background_tasks: BackgroundTasks,
+    files: Annotated[list[UploadFile], File()],
+):
+    if len(files) > settings.upload_batch_max_files:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Too many files (Max {settings.upload_batch_max_files})',
+        )
+
+    # Invalid files are reported without rejecting the others
+    results = [{'filename': file.filename} for file in files]
+    accepted = []
+    for result, file in zip(results, files, strict=True):
+        try:
+            check_upload(file)
+            accepted.append((result, file))
+        except HTTPException as e:
+            result['error'] = e.detail
+
+    if accepted:
+        new_files = await file_service.upload_files(
+            user_id=current_user.id,
+            settings=settings,
+            db=session,
+            background_tasks=background_tasks,
+            files=[file for _, file in accepted],
+        )
+        for (result, _), new_file in zip(accepted, new_files, strict=True):
+            result['file'] = new_file
+
+    return {'results': results}
+
+
 @router.get('/', response_model=ListFilesResponse)
 async def list_files(
     session: SessionDep,
@@ -60,21 +105,26 @@ async def list_files(
     current_user: CurrentUserDep,
     queries: Annotated[ListFilesQueries, Query()],
 ):
-    files, count, used_credit, credit_timestamp = file_service.list_files(
+    files, count, next_cursor, used_credit, credit_timestamp = await file_service.list_files(
         db=session,
         user_id=current_user.id,
         page=queries.page,
         page_size=queries.page_size,
         sort_by=queries.sort_by,
         sort_order=queries.order,
+        cursor=queries.cursor,
+        include_count=queries.count,
     )
-    page_count = ((count - 1) // queries.page_size) + 1
+    page_count = None
+    if count is not None:
+        page_count = ((count - 1) // queries.page_size) + 1
 
     return {
         'result_count': count,
         'page_count': page_count,
         'page_size': queries.page_size,
-        'page': queries.page,
+        'page': queries.page if queries.cursor is None else None,
+        'next_cursor': next_cursor,
         'credit': settings.credit_limit - used_credit,
         'credit_count': settings.credit_limit,
         'credit_timestamp': credit_timestamp,
@@ -90,7 +140,7 @@ async def delete_file(
     current_user: CurrentUserDep,
     file_id: Annotated[int, Path(gt=0)],
 ):
-    file_service.delete_file(
+    await file_service.delete_file(
         db=session,
         settings=settings,
         background_tasks=background_tasks,
@@ -110,7 +160,7 @@ async def retry_file(
     current_user: CurrentUserDep,
     file_id: Annotated[int, Path(gt=0)],
 ):
-    file = file_service.retry_file(
+    file = await file_service.retry_file(
         db=session,
         settings=settings,
         producer=producer,
@@ -126,7 +176,7 @@ async def cancel_file(
     current_user: CurrentUserDep,
     file_id: Annotated[int, Path(gt=0)],
 ):
-    file = file_service.cancel_file(
+    file = await file_service.cancel_file(
         db=session,
         file_id=file_id,
         user_id=current_user.id,
@@ -80,7 +80,9 @@ def set_refresh_token_cookie(response: Response, refresh_token: str, expires_at:
 
 @router.post('/register', response_model=UserResponse)
 async def register_new_user(user: Annotated[CreateUserForm, Form()], session: SessionDep):
-    response_user = user_service.create_user(session, user=CreateUserData(**user.model_dump()))
+    response_user = await user_service.create_user(
+        session, user=CreateUserData(**user.model_dump())
+    )
     return response_user
 
 
@@ -91,7 +93,7 @@ async def login_for_access_token(
     settings: SettingsDep,
     response: Response,
 ) -> Token:
-    user = user_service.authenticate_user(session, form_data.username, form_data.password)
+    user = await user_service.authenticate_user(session, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -101,7 +103,7 @@ async def login_for_access_token(
     now = datetime.now(UTC)
 
     refresh_token_expires = timedelta(days=settings.refresh_token_expire_days)
-    auth_session = user_service.create_session(
+    auth_session = await user_service.create_session(
         user=user, expires_date=now + refresh_token_expires, db=session
     )
 
@@ -114,7 +116,7 @@ async def login_for_access_token(
 
 
 @router.post('/refresh')
-def refresh_access_token(
+async def refresh_access_token(
     user_auth_session: CurrentRefreshTokenUserDep,
     response: Response,
     settings: SettingsDep,
@@ -126,7 +128,9 @@ def refresh_access_token(
     now = datetime.now(UTC)
 
     refresh_token_expires = timedelta(days=settings.refresh_token_expire_days)
-    user_service.update_session(auth_session, expires_date=now + refresh_token_expires, db=session)
+    await user_service.update_session(
+        auth_session, expires_date=now + refresh_token_expires, db=session
+    )
 
     access_token, refresh_token, refresh_expires_at = generate_tokens(
         user, auth_session, settings, now
@@ -137,14 +141,14 @@ def refresh_access_token(
 
 
 @router.delete('/logout')
-def logout(
+async def logout(
     user_auth_session: Annotated[tuple[User, AuthSession], Depends(get_current_user)],
     session: SessionDep,
     response: Response,
 ):
     auth_session = user_auth_session[1]
 
-    user_service.update_session(auth_session, is_ended=True, db=session)
+    await user_service.update_session(auth_session, is_ended=True, db=session)
 
     response.delete_cookie(
         key='refresh_token',
@@ -167,7 +171,7 @@ async def update_user_info(
     current_user: CurrentUserDep,
     session: SessionDep,
 ):
-    user_service.update_user(
+    await user_service.update_user(
         session, user=UpdateUserData(**user.model_dump()), current_user=current_user
     )
     return current_user
@@ -178,7 +182,7 @@ async def verify_email(
     token: UUID4,
     session: SessionDep,
 ):
-    user = user_service.verify_email(token=str(token), db=session)
+    user = await user_service.verify_email(token=str(token), db=session)
 
     return user
 
@@ -190,7 +194,7 @@ async def send_verification_email(
     settings: SettingsDep,
     background_tasks: BackgroundTasks,
 ):
-    user_service.send_verification_email(
+    await user_service.send_verification_email(
         session,
         settings=settings,
         current_user=current_user,
@@ -207,7 +211,7 @@ async def send_reset_password_email(
     settings: SettingsDep,
     background_tasks: BackgroundTasks,
 ):
-    user_service.send_reset_password_email(
+    await user_service.send_reset_password_email(
         email=body.email,
         db=session,
         settings=settings,
@@ -223,6 +227,8 @@ async def reset_passwosd(
     form_data: Annotated[PasswordResetForm, Form()],
     session: SessionDep,
 ):
-    user = user_service.reset_password(token=str(token), password=form_data.password, db=session)
+    user = await user_service.reset_password(
+        token=str(token), password=form_data.password, db=session
+    )
 
     return user
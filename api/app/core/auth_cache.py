@@ -0,0 +1,198 @@
+import asyncio
+import json
+import uuid
+from datetime import UTC, datetime
+
+from cachetools import TLRUCache
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.core.cache import get_client
+from app.core.config import get_settings
+from app.core.logging import logger
+from app.models.user import AuthSession, User
+
+settings = get_settings()
+
+invalidation_channel = 'auth:invalidations'
+
+# Never written to Redis, they're loaded from the database once a cached user is added to a session
+private_user_fields = {'hashed_password', 'email_verification_token', 'password_reset_token'}
+
+# Token -> (user, session, TTL), so repeated requests of a token skip jwt.decode and Redis
+local_cache = TLRUCache(
+    maxsize=settings.auth_local_cache_size, ttu=lambda _key, value, now: now + value[2]
+)
+
+
+def get_auth_session_key(auth_session_id: uuid.UUID):
+    return f'auth:session:{auth_session_id}'
+
+
+def get_user_sessions_key(user_id: int):
+    return f'auth:user:{user_id}:sessions'
+
+
+def as_utc(date: datetime):
+    return date if date.tzinfo is not None else date.replace(tzinfo=UTC)
+
+
+def to_detached(model: User | AuthSession):
+    # Cached rows are used like rows loaded by a session that has been closed,
+    # so they can be added to a new session to update them
+    make_transient_to_detached(model)
+    return model
+
+
+def dump_auth_session(user: User, auth_session: AuthSession):
+    user_data = user.model_dump(mode='json', exclude=private_user_fields)
+    return user_data, auth_session.model_dump(mode='json')
+
+
+def load_user(user_data: dict):
+    user = User.model_validate({**user_data, 'hashed_password': ''})
+    # Left unloaded instead of holding placeholders, like the expired attributes of a row
+    for field in private_user_fields:
+        user.__dict__.pop(field, None)
+    return to_detached(user)
+
+
+def load_auth_session(user_data: dict, auth_session_data: dict):
+    # New instances for every request, requests never share the same instances
+    user = load_user(user_data)
+    auth_session = AuthSession.model_validate(auth_session_data)
+    auth_session.expires_date = as_utc(auth_session.expires_date)
+    return user, to_detached(auth_session)
+
+
+def get_local_auth_session(token: str) -> tuple[User, AuthSession] | None:
+    cached = local_cache.get(token)
+    if cached is None:
+        return None
+
+    user_data, auth_session_data, _ = cached
+    return load_auth_session(user_data, auth_session_data)
+
+
+def cache_local_auth_session(
+    token: str, user: User, auth_session: AuthSession, token_expires_date: datetime
+):
+    # Bounded by the token and the session expiry, and short enough to recover from an
+    # invalidation missed while the listener was reconnecting
+    expires_date = min(as_utc(auth_session.expires_date), token_expires_date)
+    ttl = (expires_date - datetime.now(UTC)).total_seconds()
+    ttl = min(ttl, settings.auth_local_cache_ttl)
+    if ttl <= 0:
+        return
+
+    local_cache[token] = (*dump_auth_session(user, auth_session), ttl)
+
+
+def evict_local_auth_sessions(auth_session_id: str | None = None, user_id: int | None = None):
+    # Entries are keyed by token, invalidations are rare enough to scan the bounded cache
+    for token, (user_data, auth_session_data, _) in list(local_cache.items()):
+        if auth_session_data['id'] == auth_session_id or user_data['id'] == user_id:
+            local_cache.pop(token, None)
+
+
+def handle_invalidation(message: str):
+    data = json.loads(message)
+    evict_local_auth_sessions(data.get('auth_session_id'), data.get('user_id'))
+
+
+async def publish_invalidation(
+    auth_session_id: uuid.UUID | None = None, user_id: int | None = None
+):
+    data = {'user_id': user_id}
+    if auth_session_id is not None:
+        data['auth_session_id'] = str(auth_session_id)
+    message = json.dumps(data)
+
+    # This process doesn't wait for its own message
+    handle_invalidation(message)
+    try:
+        r = get_client()
+        await r.publish(invalidation_channel, message)
+    except Exception as e:
+        logger.error(f'Failed to publish auth session invalidation: {e}')
+
+
+async def listen_invalidations():
+    while True:
+        try:
+            r = get_client()
+            async with r.pubsub() as p:
+                await p.subscribe(invalidation_channel)
+                # Invalidations sent while not subscribed are lost, start from an empty cache
+                local_cache.clear()
+                async for message in p.listen():
+                    if message['type'] == 'message':
+                        handle_invalidation(message['data'])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f'Auth session invalidation listener failed: {e}')
+            local_cache.clear()
+            await asyncio.sleep(1)
+
+
+def start_invalidation_listener():
+    return asyncio.create_task(listen_invalidations())
+
+
+async def get_cached_auth_session(auth_session_id: uuid.UUID) -> tuple[User, AuthSession] | None:
+    try:
+        r = get_client()
+        cached = await r.get(get_auth_session_key(auth_session_id))
+        if cached is None:
+            return None
+
+        data = json.loads(cached)
+        return load_auth_session(data['user'], data['auth_session'])
+    except Exception as e:
+        logger.error(f'Failed to read cached auth session: {e}')
+        return None
+
+
+async def cache_auth_session(user: User, auth_session: AuthSession):
+    # The cache never outlives the session, and a short TTL bounds how long an entry written
+    # by a request racing with an invalidation can be served
+    ttl = int((as_utc(auth_session.expires_date) - datetime.now(UTC)).total_seconds())
+    ttl = min(ttl, settings.auth_session_cache_ttl)
+    if ttl <= 0:
+        return
+
+    user_data, auth_session_data = dump_auth_session(user, auth_session)
+    data = {'user': user_data, 'auth_session': auth_session_data}
+    user_sessions_key = get_user_sessions_key(user.id)
+    try:
+        r = get_client()
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.set(get_auth_session_key(auth_session.id), json.dumps(data), ex=ttl)
+            pipe.sadd(user_sessions_key, str(auth_session.id))
+            pipe.expire(user_sessions_key, settings.auth_session_cache_ttl)
+            await pipe.execute()
+    except Exception as e:
+        logger.error(f'Failed to cache auth session: {e}')
+
+
+async def invalidate_auth_session(auth_session_id: uuid.UUID):
+    try:
+        r = get_client()
+        await r.delete(get_auth_session_key(auth_session_id))
+    except Exception as e:
+        logger.error(f'Failed to invalidate cached auth session: {e}')
+
+    await publish_invalidation(auth_session_id=auth_session_id)
+
+
+async def invalidate_user_sessions(user_id: int):
+    try:
+        r = get_client()
+        user_sessions_key = get_user_sessions_key(user_id)
+        auth_session_ids = await r.smembers(user_sessions_key)
+        keys = [get_auth_session_key(auth_session_id) for auth_session_id in auth_session_ids]
+        await r.delete(user_sessions_key, *keys)
+    except Exception as e:
+        logger.error(f'Failed to invalidate cached auth sessions of user {user_id}: {e}')
+
+    await publish_invalidation(user_id=user_id)
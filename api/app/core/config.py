@@ -9,6 +9,17 @@ class ServerMode(str, Enum):
     api_server = 'api-server'
     file_worker = 'file-worker'
     notification_worker = 'notification-worker'
+    outbox_relay = 'outbox-relay'
+
+
+class UploadMode(str, Enum):
+    memory = 'memory'
+    stream = 'stream'
+
+
+class DownloadMode(str, Enum):
+    bucket = 'bucket'
+    cdn = 'cdn'
 
 
 class Settings(BaseSettings):
@@ -37,21 +48,69 @@ class Settings(BaseSettings):
     auth_token_algorithm: str = 'HS256'
     access_token_expire_minutes: int = 30
     refresh_token_expire_days: int = 3
+    auth_session_cache_ttl: int = 300
+    auth_local_cache_size: int = 10000
+    auth_local_cache_ttl: int = 60
+    password_hash_pool_size: int = 4
+    password_hash_queue_size: int = 16
+    password_hash_retry_after: int = 1
 
     cors_origins: list[str] = ['*']
 
     sendgrid_api_key: str
+    sendgrid_host: str = 'https://api.sendgrid.com'
     source_email: EmailStr
+    email_workers: int = 4
+    email_queue_size: int = 1000
+    email_batch_window_ms: int = 1000
+    email_max_retries: int = 3
+    email_retry_backoff_ms: int = 500
+    # One summary email per user per window instead of one per file, 0 to disable
+    email_digest_window_ms: int = 0
     frontend_url: HttpUrl
 
     cdn_url: HttpUrl
     bucket_name: str
+    upload_mode: UploadMode = UploadMode.stream
+    upload_chunk_size: int = 1048576  # = 1MB, must be a multiple of 256KB
+    upload_batch_max_files: int = 50
+    storage_pool_size: int = 10
+    # The file worker reads objects from the bucket, the CDN is kept as a fallback
+    download_mode: DownloadMode = DownloadMode.bucket
+    download_chunk_size: int = 1048576  # = 1MB
+    download_max_size: int = 20971520  # = 20MB, the largest file sent inline to Gemini
+    # Download buffers grown past it for a large file aren't kept by the worker threads
+    download_buffer_max_size: int = 4194304  # = 4MB
 
     kafka_servers: list[str]
+    # 1 = JSON, 2 = msgpack, switch once every consumer reads version 2
+    event_version: int = 1
+    producer_linger_ms: int = 5
+    producer_batch_size: int = 1000000
+    producer_compression_type: str = 'lz4'
+    # Time to wait for the local queue of the producer to free up before giving up
+    producer_queue_full_timeout: float = 1.0
+    consumer_concurrency: int = 1
+    consumer_batch_size: int = 500
+    consumer_commit_batch_size: int = 100
+    consumer_commit_interval_ms: int = 1000
+    # Api servers and file workers relay their own outbox events, disable it when
+    # dedicated outbox-relay servers are running
+    outbox_relay_in_process: bool = True
+    outbox_batch_size: int = 500
+    outbox_poll_interval_ms: int = 200
+    outbox_delivery_timeout: float = 10
     redis_host: str
     redis_port: int = 6379
+    notification_queue_size: int = 100
 
     gemini_api_key: str
+    gemini_timeout_ms: int = 60000
+    http_pool_size: int = 10
+    http_connect_timeout: float = 5
+    http_read_timeout: float = 30
+    describe_cache_size: int = 67108864  # = 64MB of descriptions in Redis
+    describe_cache_max_entry_size: int = 65536
 
     credit_limit: int = 5
     credit_period: int = 3600
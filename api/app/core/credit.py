@@ -0,0 +1,91 @@
+from datetime import UTC, datetime, timedelta
+
+from redis.commands.core import AsyncScript
+
+from app.core.cache import get_client
+from app.core.logging import logger
+
+# Takes the credits if the user has enough of them left, all of them or none, the count
+# resets after the period
+consume_credit_lua = """
+local count = redis.call('GET', KEYS[1])
+if not count then
+    redis.call('SET', KEYS[1], 0)
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+    count = "0"
+end
+
+if tonumber(count) + tonumber(ARGV[3]) <= tonumber(ARGV[1]) then
+    redis.call('INCRBY', KEYS[1], tonumber(ARGV[3]))
+    return 1
+else
+    return 0
+end
+"""
+
+# Reads the used credit and the seconds until it resets in one round-trip
+peek_credit_lua = """
+local count = redis.call('GET', KEYS[1])
+local ttl = redis.call('TTL', KEYS[1])
+return {tonumber(count) or 0, ttl}
+"""
+
+# Gives back credits reserved by a request that failed, nothing is given back once the count
+# has been reset
+release_credit_lua = """
+local count = redis.call('GET', KEYS[1])
+if count then
+    redis.call('DECRBY', KEYS[1], math.min(tonumber(ARGV[1]), tonumber(count)))
+end
+return 0
+"""
+
+consume_credit_script: AsyncScript | None = None
+peek_credit_script: AsyncScript | None = None
+release_credit_script: AsyncScript | None = None
+
+
+def get_credit_key(user_id: int):
+    return f'credit:file:{user_id}'
+
+
+def get_scripts():
+    global consume_credit_script, peek_credit_script, release_credit_script
+    if consume_credit_script is None or peek_credit_script is None or release_credit_script is None:
+        r = get_client()
+        consume_credit_script = r.register_script(consume_credit_lua)
+        peek_credit_script = r.register_script(peek_credit_lua)
+        release_credit_script = r.register_script(release_credit_lua)
+    return consume_credit_script, peek_credit_script, release_credit_script
+
+
+async def load_scripts():
+    # Scripts are called by their SHA, load them once so the first calls don't have to
+    try:
+        r = get_client()
+        for script in get_scripts():
+            script.sha = await r.script_load(script.script)
+    except Exception as e:
+        logger.error(f'Failed to load credit scripts: {e}')
+
+
+async def consume_credit(user_id: int, limit: int, period: int, amount: int = 1) -> bool:
+    consume_script, _, _ = get_scripts()
+    result = await consume_script(keys=[get_credit_key(user_id)], args=[limit, period, amount])
+    return result == 1
+
+
+async def peek_credit(user_id: int) -> tuple[int, datetime | None]:
+    _, peek_script, _ = get_scripts()
+    used_credit, ttl = await peek_script(keys=[get_credit_key(user_id)])
+
+    credit_timestamp = None
+    if used_credit > 0:
+        credit_timestamp = datetime.now(UTC) + timedelta(seconds=int(ttl))
+
+    return used_credit, credit_timestamp
+
+
+async def release_credit(user_id: int, amount: int = 1):
+    _, _, release_script = get_scripts()
+    await release_script(keys=[get_credit_key(user_id)], args=[amount])
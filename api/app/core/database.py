@@ -2,7 +2,9 @@ from os import path
 
 from alembic import command
 from alembic.config import Config
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlmodel import Session, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core.config import get_settings
 from app.core.logging import logger
@@ -10,6 +12,7 @@ from app.core.logging import logger
 settings = get_settings()
 
 db_url = f'postgresql://{settings.db_username}:{settings.db_password}@{settings.db_host}:{settings.db_port}/{settings.db_database}'
+async_db_url = f'postgresql+asyncpg://{settings.db_username}:{settings.db_password}@{settings.db_host}:{settings.db_port}/{settings.db_database}'
 # Create the engine
 print_queries = settings.env == 'dev'
 engine = create_engine(
@@ -18,6 +21,15 @@ engine = create_engine(
     max_overflow=settings.db_max_overflow,
     echo=print_queries,
 )
+# Create the async engine, used by the API server so queries don't block the event loop
+async_engine = create_async_engine(
+    async_db_url,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    echo=print_queries,
+)
+# Attributes can't be lazily reloaded in async code, so keep them loaded after commits
+async_session_maker = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
 
 
 def get_session():
@@ -25,6 +37,11 @@ def get_session():
         yield session
 
 
+async def get_async_session():
+    async with async_session_maker() as session:
+        yield session
+
+
 def run_migrations():
     try:
         script_path = path.abspath(path.join('app', 'migrations'))
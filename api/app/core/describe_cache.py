@@ -0,0 +1,120 @@
+import time
+
+from redis.commands.core import Script
+
+from app.core.cache import get_sync_client
+from app.core.config import get_settings
+from app.core.logging import logger
+
+settings = get_settings()
+
+lru_key = 'describe:lru'
+size_key = 'describe:size'
+stats_key = 'describe:stats'
+
+# Returns the description and marks it as recently used, hits and misses are counted
+# for every worker in the same hash
+get_description_lua = """
+local description = redis.call('GET', KEYS[1])
+if description then
+    redis.call('ZADD', KEYS[2], 'XX', ARGV[1], KEYS[1])
+    redis.call('HINCRBY', KEYS[3], 'hits', 1)
+else
+    redis.call('HINCRBY', KEYS[3], 'misses', 1)
+end
+return description
+"""
+
+# Stores the description, then evicts the least recently used ones until the total size
+# of the descriptions fits in the budget
+cache_description_lua = """
+local previous_size = redis.call('STRLEN', KEYS[1])
+redis.call('SET', KEYS[1], ARGV[1])
+redis.call('ZADD', KEYS[2], ARGV[2], KEYS[1])
+local size = redis.call('INCRBY', KEYS[3], string.len(ARGV[1]) - previous_size)
+
+local evicted = 0
+while size > tonumber(ARGV[3]) do
+    local oldest = redis.call('ZPOPMIN', KEYS[2])
+    if #oldest == 0 then
+        break
+    end
+    size = redis.call('DECRBY', KEYS[3], redis.call('STRLEN', oldest[1]))
+    redis.call('DEL', oldest[1])
+    evicted = evicted + 1
+end
+return evicted
+"""
+
+get_description_script: Script | None = None
+cache_description_script: Script | None = None
+
+
+def get_description_key(content_hash: str, model: str, prompt_version: int):
+    return f'describe:{model}:{prompt_version}:{content_hash}'
+
+
+def get_scripts():
+    global get_description_script, cache_description_script
+    if get_description_script is None or cache_description_script is None:
+        r = get_sync_client()
+        get_description_script = r.register_script(get_description_lua)
+        cache_description_script = r.register_script(cache_description_lua)
+    return get_description_script, cache_description_script
+
+
+def get_cached_description(content_hash: str | None, model: str, prompt_version: int) -> str | None:
+    if content_hash is None:
+        return None
+
+    try:
+        get_script, _ = get_scripts()
+        return get_script(
+            keys=[get_description_key(content_hash, model, prompt_version), lru_key, stats_key],
+            args=[time.time()],
+        )
+    except Exception as e:
+        logger.error(f'Failed to read cached description: {e}')
+        return None
+
+
+def cache_description(
+    content_hash: str | None, model: str, prompt_version: int, description: str | None
+):
+    # Blocked or empty responses aren't cached
+    if content_hash is None or description is None:
+        return
+
+    try:
+        # A single huge description would evict every other one
+        if len(description.encode()) > settings.describe_cache_max_entry_size:
+            return
+
+        _, cache_script = get_scripts()
+        evicted = cache_script(
+            keys=[get_description_key(content_hash, model, prompt_version), lru_key, size_key],
+            args=[description, time.time(), settings.describe_cache_size],
+        )
+        if evicted:
+            logger.debug(f'Evicted {evicted} cached descriptions')
+    except Exception as e:
+        logger.error(f'Failed to cache description: {e}')
+
+
+def get_describe_cache_stats():
+    r = get_sync_client()
+    pipeline = r.pipeline(transaction=False)
+    pipeline.hgetall(stats_key)
+    pipeline.get(size_key)
+    pipeline.zcard(lru_key)
+    stats, size, entries = pipeline.execute()
+
+    hits = int(stats.get('hits', 0))
+    misses = int(stats.get('misses', 0))
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else None,
+        'size': int(size or 0),
+        'entries': entries,
+    }
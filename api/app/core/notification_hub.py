@@ -0,0 +1,174 @@
+import asyncio
+import json
+from collections import deque
+from contextlib import suppress
+
+from fastapi import WebSocket, status
+
+from app.core.cache import get_client
+from app.core.config import get_settings
+from app.core.logging import logger
+
+settings = get_settings()
+
+notification_channel_pattern = 'noti:*'
+
+
+def get_file_id(message: str) -> int | None:
+    try:
+        return json.loads(message).get('file_id')
+    except Exception:
+        return None
+
+
+class Connection:
+    def __init__(self, websocket: WebSocket, user_id: int, max_queue_size: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        # Each socket is sent to from its own task, a slow client only fills its own queue
+        self.queue: deque[str] = deque()
+        self.max_queue_size = max_queue_size
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.dropped_count = 0
+        self.coalesced_count = 0
+        self.sender = asyncio.create_task(self._send())
+        self.closer: asyncio.Task | None = None
+
+    def push(self, message: str):
+        if self.closed:
+            self.dropped_count += 1
+            return
+
+        if len(self.queue) < self.max_queue_size:
+            self.queue.append(message)
+        elif not self._coalesce(message):
+            # Too slow even with coalescing, the client reconnects and lists its files again
+            logger.warning(f'Disconnecting slow notification client of user {self.user_id}')
+            self.dropped_count += len(self.queue) + 1
+            self.queue.clear()
+            self.closed = True
+            self.closer = asyncio.create_task(self._disconnect())
+            return
+
+        self.ready.set()
+
+    def _coalesce(self, message: str):
+        # Only the latest status of a file matters, it replaces the queued one
+        file_id = get_file_id(message)
+        if file_id is None:
+            return False
+
+        for i, queued_message in enumerate(self.queue):
+            if get_file_id(queued_message) == file_id:
+                del self.queue[i]
+                self.queue.append(message)
+                self.coalesced_count += 1
+                return True
+
+        return False
+
+    async def _send(self):
+        while True:
+            await self.ready.wait()
+            while self.queue:
+                message = self.queue.popleft()
+                try:
+                    await self.websocket.send_text(message)
+                except Exception as e:
+                    # The receiving side notices the disconnection and unregisters the socket
+                    logger.debug(f'Failed to send notification to user {self.user_id}: {e}')
+                    return
+            self.ready.clear()
+
+    async def _disconnect(self):
+        self.sender.cancel()
+        with suppress(Exception):
+            await self.websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+
+    async def close(self):
+        self.closed = True
+        self.sender.cancel()
+        with suppress(asyncio.CancelledError):
+            await self.sender
+        if self.closer is not None:
+            with suppress(asyncio.CancelledError):
+                await self.closer
+
+
+class NotificationHub:
+    """Delivers the notifications of every user from a single Redis subscription per process"""
+
+    def __init__(self):
+        self.connections: dict[int, set[Connection]] = {}
+        self.listener: asyncio.Task | None = None
+        # Counts of the connections that have been unregistered
+        self.dropped_count = 0
+        self.coalesced_count = 0
+
+    def start(self):
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.listener
+            self.listener = None
+
+    def register(self, websocket: WebSocket, user_id: int) -> Connection:
+        self.start()
+        connection = Connection(websocket, user_id, settings.notification_queue_size)
+        self.connections.setdefault(user_id, set()).add(connection)
+        return connection
+
+    async def unregister(self, connection: Connection):
+        user_connections = self.connections.get(connection.user_id)
+        if user_connections is not None:
+            user_connections.discard(connection)
+            if not user_connections:
+                del self.connections[connection.user_id]
+        await connection.close()
+
+        self.dropped_count += connection.dropped_count
+        self.coalesced_count += connection.coalesced_count
+
+    def stats(self):
+        connections = [
+            connection
+            for user_connections in self.connections.values()
+            for connection in user_connections
+        ]
+        return {
+            'connections': len(connections),
+            'dropped': self.dropped_count + sum(c.dropped_count for c in connections),
+            'coalesced': self.coalesced_count + sum(c.coalesced_count for c in connections),
+        }
+
+    def dispatch(self, channel: str, message: str):
+        try:
+            user_id = int(channel.split(':', 1)[1])
+        except (IndexError, ValueError):
+            return
+
+        for connection in self.connections.get(user_id, ()):
+            connection.push(message)
+
+    async def _listen(self):
+        while True:
+            try:
+                r = get_client()
+                async with r.pubsub() as p:
+                    await p.psubscribe(notification_channel_pattern)
+                    async for message in p.listen():
+                        if message['type'] == 'pmessage':
+                            self.dispatch(message['channel'], message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f'Notification listener failed: {e}')
+                await asyncio.sleep(1)
+
+
+notification_hub = NotificationHub()
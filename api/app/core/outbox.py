@@ -0,0 +1,145 @@
+import threading
+from datetime import UTC, datetime
+
+from confluent_kafka import KafkaError, Message
+from sqlalchemy import exists
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import get_settings
+from app.core.database import engine
+from app.core.logging import logger
+from app.core.stream import ManagedProducer, get_producer
+from app.models.outbox import OutboxEvent
+
+settings = get_settings()
+
+# Set once outbox events are committed, so the relay of the process sends them right away
+# instead of waiting for its next poll
+outbox_ready = threading.Event()
+
+
+def add_outbox_event(
+    db: Session | AsyncSession,
+    topic: str,
+    value: bytes,
+    key: str | None = None,
+    ordering_key: str | None = None,
+):
+    # Only added to the session, it's committed with the change it reports
+    db.add(
+        OutboxEvent(
+            topic=topic,
+            key=key,
+            value=value,
+            ordering_key=ordering_key,
+            created_at=datetime.now(UTC),
+        )
+    )
+
+
+def notify_outbox():
+    outbox_ready.set()
+
+
+def relay_outbox_batch(
+    session: Session,
+    producer: ManagedProducer,
+    batch_size: int,
+    timeout: float,
+) -> int:
+    """Sends a batch of outbox events to Kafka, then deletes the delivered ones.
+
+    Events locked by another relay are skipped, so relays drain the table in parallel.
+    Events that aren't delivered stay in the table and are sent again by a later batch.
+    Only the oldest event of each ordering key is sent, the next one waits until it has
+    been delivered, even when it's held by another relay.
+    """
+    older_event = aliased(OutboxEvent)
+    has_older_event = exists().where(
+        older_event.ordering_key == OutboxEvent.ordering_key,
+        older_event.id < OutboxEvent.id,
+    )
+    statement = (
+        select(OutboxEvent)
+        .where(~has_older_event)
+        .order_by(OutboxEvent.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    events = session.exec(statement).all()
+    if not events:
+        session.rollback()
+        return 0
+
+    # Filled from the polling thread of the producer
+    delivered_ids: set[int] = set()
+    reported_count = 0
+    all_reported = threading.Event()
+    lock = threading.Lock()
+
+    def on_delivery(event_id: int):
+        def callback(err: KafkaError | None, msg: Message):
+            nonlocal reported_count
+            with lock:
+                if err is None:
+                    delivered_ids.add(event_id)
+                reported_count += 1
+                if reported_count == len(events):
+                    all_reported.set()
+
+        return callback
+
+    for event in events:
+        producer.produce(
+            event.topic, value=event.value, key=event.key, on_delivery=on_delivery(event.id)
+        )
+    # The events stay locked until Kafka has acknowledged them, only this batch is waited
+    # for, not every message of the shared producer
+    all_reported.wait(timeout)
+
+    with lock:
+        delivered = list(delivered_ids)
+    if delivered:
+        session.exec(delete(OutboxEvent).where(OutboxEvent.id.in_(delivered)))
+    session.commit()
+
+    if len(delivered) < len(events):
+        logger.warning(f'Failed to relay {len(events) - len(delivered)} outbox events')
+
+    return len(delivered)
+
+
+def get_relay_thread(batch_size: int, poll_interval_ms: int, timeout: float):
+    stop_event = threading.Event()
+
+    def relay_loop():
+        producer = get_producer()
+        while not stop_event.is_set():
+            outbox_ready.clear()
+            try:
+                with Session(engine) as session:
+                    count = relay_outbox_batch(session, producer, batch_size, timeout)
+            except Exception as e:
+                logger.error(f'Failed to relay outbox events: {e}')
+                count = 0
+
+            # Delivered events may have been holding back the next events of their keys
+            if count == 0:
+                outbox_ready.wait(poll_interval_ms / 1000)
+
+    relay_thread = threading.Thread(target=relay_loop, daemon=True)
+
+    def start_relaying():
+        relay_thread.start()
+
+    def stop_relaying():
+        stop_event.set()
+        outbox_ready.set()
+        if relay_thread.is_alive():
+            relay_thread.join(timeout=timeout + 5)
+            if relay_thread.is_alive():
+                logger.warning('Outbox relay thread did not finish within timeout.')
+
+    return start_relaying, stop_relaying
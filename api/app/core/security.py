@@ -1,11 +1,24 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from uuid import uuid4
 
 import bcrypt
 import jwt
+from fastapi import HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 
+from app.core.config import get_settings
+
+settings = get_settings()
+
+password_executor: ThreadPoolExecutor | None = None
+# Hashes submitted to the executor and not finished yet, decremented from its threads
+password_tasks = 0
+password_tasks_lock = threading.Lock()
+
 
 class Token(BaseModel):
     access_token: str
@@ -36,6 +49,60 @@ def verify_password(plain_password: str, hashed_password: str):
     )
 
 
+def get_password_executor():
+    # bcrypt releases the GIL, threads hash in parallel without blocking the event loop
+    global password_executor
+    if password_executor is None:
+        password_executor = ThreadPoolExecutor(
+            max_workers=settings.password_hash_pool_size, thread_name_prefix='password'
+        )
+    return password_executor
+
+
+def close_password_executor():
+    global password_executor
+    if password_executor is not None:
+        password_executor.shutdown(wait=False, cancel_futures=True)
+        password_executor = None
+
+
+def release_password_task(_future: Future):
+    global password_tasks
+    with password_tasks_lock:
+        password_tasks -= 1
+
+
+async def run_password_task(func, *args):
+    global password_tasks
+    with password_tasks_lock:
+        # Reject instead of queuing hashes that would finish long after the client gave up
+        if password_tasks >= settings.password_hash_pool_size + settings.password_hash_queue_size:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='Server is busy, please try again later',
+                headers={'Retry-After': str(settings.password_hash_retry_after)},
+            )
+        password_tasks += 1
+
+    # Released once the hash is done, not when the request is, a cancelled request
+    # leaves its hash running in the executor
+    try:
+        future = get_password_executor().submit(func, *args)
+    except BaseException:
+        release_password_task(None)
+        raise
+    future.add_done_callback(release_password_task)
+    return await asyncio.wrap_future(future)
+
+
+async def hash_password(password: str) -> str:
+    return await run_password_task(get_password_hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    return await run_password_task(verify_password, plain_password, hashed_password)
+
+
 def create_jwt_token(
     data: dict,
     secret_key: str,
@@ -1,9 +1,13 @@
+import queue
 import socket
 import threading
 import time
+from collections import Counter, deque
 from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 
-from confluent_kafka import Consumer, KafkaError, KafkaException, Producer
+from confluent_kafka import Consumer, KafkaError, KafkaException, Message, Producer, TopicPartition
+from starlette.concurrency import run_in_threadpool
 
 from app.core.config import get_settings
 from app.core.logging import logger
@@ -14,83 +18,345 @@ bootstrap_servers = ','.join(settings.kafka_servers)
 producer_conf = {
     'bootstrap.servers': bootstrap_servers,
     'client.id': socket.gethostname(),
+    'linger.ms': settings.producer_linger_ms,
+    'batch.size': settings.producer_batch_size,
+    'compression.type': settings.producer_compression_type,
 }
+
+
+def on_commit(err: KafkaError | None, partitions: list[TopicPartition]):
+    # Results of asynchronous commits are only reported here
+    if err is not None:
+        logger.error(f'Failed to commit offsets: {err}')
+
+
 consumer_conf = {
     'bootstrap.servers': bootstrap_servers,
     'group.id': settings.server_mode.value,
     'enable.auto.commit': 'false',
     'auto.offset.reset': 'earliest',
+    'on_commit': on_commit,
 }
 
-producer: Producer | None = None
+
+class ManagedProducer:
+    """Kafka producer with a background thread that serves delivery reports."""
+
+    def __init__(self, conf: dict):
+        self._producer = Producer(conf)
+        self._lock = threading.Lock()
+        self.delivered_count: Counter[str] = Counter()
+        self.failed_count: Counter[str] = Counter()
+
+        self._stop_event = threading.Event()
+        self._poll_thread = threading.Thread(target=self._poll_loop, daemon=True)
+        self._poll_thread.start()
+
+    def _poll_loop(self):
+        # Delivery callbacks only fire from poll(), which also frees the local queue
+        while not self._stop_event.is_set():
+            self._producer.poll(0.1)
+
+    def _on_delivery(self, err: KafkaError | None, msg: Message):
+        with self._lock:
+            if err is not None:
+                self.failed_count[msg.topic()] += 1
+            else:
+                self.delivered_count[msg.topic()] += 1
+
+        if err is not None:
+            logger.error(f'Failed to deliver message to {msg.topic()}: {err}')
+
+    def _get_callback(self, on_delivery: Callable[[KafkaError | None, Message], None] | None):
+        if on_delivery is None:
+            return self._on_delivery
+
+        def callback(err: KafkaError | None, msg: Message):
+            self._on_delivery(err, msg)
+            on_delivery(err, msg)
+
+        return callback
+
+    def produce(
+        self,
+        topic: str,
+        value: str | bytes,
+        key: str | None = None,
+        on_delivery: Callable[[KafkaError | None, Message], None] | None = None,
+    ):
+        callback = self._get_callback(on_delivery)
+        try:
+            self._producer.produce(topic, value=value, key=key, on_delivery=callback)
+        except BufferError:
+            self._produce_when_ready(topic, value, key, callback)
+
+    def _produce_when_ready(
+        self,
+        topic: str,
+        value: str | bytes,
+        key: str | None,
+        callback: Callable[[KafkaError | None, Message], None],
+    ):
+        # The local queue is full, the poll thread frees it as messages are delivered
+        logger.warning(f'Kafka producer queue is full, waiting to produce to {topic}')
+        deadline = time.monotonic() + settings.producer_queue_full_timeout
+        backoff = 0.01
+        while True:
+            self._producer.poll(0)
+            try:
+                self._producer.produce(topic, value=value, key=key, on_delivery=callback)
+                return
+            except BufferError:
+                if time.monotonic() + backoff > deadline:
+                    raise
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 0.1)
+
+    async def produce_async(
+        self,
+        topic: str,
+        value: str | bytes,
+        key: str | None = None,
+        on_delivery: Callable[[KafkaError | None, Message], None] | None = None,
+    ):
+        """Produces from the event loop, waiting for a full queue in a thread instead."""
+        callback = self._get_callback(on_delivery)
+        try:
+            self._producer.produce(topic, value=value, key=key, on_delivery=callback)
+        except BufferError:
+            await run_in_threadpool(self._produce_when_ready, topic, value, key, callback)
+
+    def stats(self):
+        with self._lock:
+            topics = self.delivered_count.keys() | self.failed_count.keys()
+            return {
+                topic: {
+                    'delivered': self.delivered_count[topic],
+                    'failed': self.failed_count[topic],
+                }
+                for topic in topics
+            }
+
+    def flush(self, timeout: float = 10.0):
+        return self._producer.flush(timeout)
+
+    def close(self):
+        self._stop_event.set()
+        self._poll_thread.join()
+        self.flush()
+
+
+producer: ManagedProducer | None = None
 
 
 def get_producer():
     global producer
     if producer is None:
-        producer = Producer(producer_conf)
+        producer = ManagedProducer(producer_conf)
 
     return producer
 
 
-def flush_producer():
+def close_producer():
     global producer
     if producer is not None:
-        producer.flush()
+        producer.close()
+        producer = None
+
 
+def get_consume_thread(
+    topics: list[str],
+    process_message: Callable[[bytes], None] | None = None,
+    process_batch: Callable[[list[bytes]], None] | None = None,
+    concurrency: int = 1,
+    batch_size: int = 1,
+    commit_batch_size: int = 1,
+    commit_interval_ms: int = 0,
+):
+    if (process_message is None) == (process_batch is None):
+        raise ValueError('Either process_message or process_batch must be given')
 
-def get_consume_thread(topics: list[str], process_message: Callable[[str], None]):
     consumer = Consumer(consumer_conf)
     stop_event = threading.Event()
 
+    # Up to `concurrency` messages are handled at the same time by the worker pool,
+    # messages of the same partition are handled one after another to keep their order
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='consumer')
+    # Partitions with a message being processed, mapped to their messages waiting in line
+    busy_partitions: dict[tuple[str, int], deque[Message]] = {}
+    # Processed messages, handed back to the consume thread to commit their offsets
+    processed_messages: queue.Queue[Message] = queue.Queue()
+    in_flight = 0
+
+    # Next offsets of processed messages by partition, committed every `commit_batch_size`
+    # messages or every `commit_interval_ms`, whichever comes first
+    uncommitted_offsets: dict[tuple[str, int], int] = {}
+    uncommitted_count = 0
+    last_commit_time = time.monotonic()
+
+    def commit_offsets(asynchronous: bool = True):
+        nonlocal uncommitted_count, last_commit_time
+        if uncommitted_offsets:
+            offsets = [
+                TopicPartition(topic, partition, offset)
+                for (topic, partition), offset in uncommitted_offsets.items()
+            ]
+            try:
+                consumer.commit(offsets=offsets, asynchronous=asynchronous)
+            except KafkaException as e:
+                logger.error(f'Failed to commit offsets: {e}')
+
+        uncommitted_offsets.clear()
+        uncommitted_count = 0
+        last_commit_time = time.monotonic()
+
+    def commit_offsets_if_due():
+        if not uncommitted_offsets:
+            return
+
+        elapsed_ms = (time.monotonic() - last_commit_time) * 1000
+        if uncommitted_count >= commit_batch_size or elapsed_ms >= commit_interval_ms:
+            commit_offsets()
+
+    def record_offset(msg: Message):
+        nonlocal uncommitted_count
+        uncommitted_offsets[(msg.topic(), msg.partition())] = msg.offset() + 1
+        uncommitted_count += 1
+
+    def handle_batch(msgs: list[Message]):
+        try:
+            message_values = [msg.value() for msg in msgs]
+            logger.info(f'Received {len(msgs)} messages')
+            process_batch(message_values)
+        except Exception as e:
+            logger.error(f'Error processing messages: {e}')
+
+        # Manual commits, only once the batch is processed:
+        for msg in msgs:
+            record_offset(msg)
+
+    def handle_message(msg: Message):
+        try:
+            message_value = msg.value()
+            logger.info(
+                f'Received message: Topic={msg.topic()}, Partition={msg.partition()}, Offset={msg.offset()}, Key={msg.key()}, Value={message_value}'  # noqa: E501
+            )
+            process_message(message_value)
+        except Exception as e:
+            logger.error(f'Error processing message: {e}')
+        finally:
+            processed_messages.put(msg)
+
+    def dispatch_message(msg: Message):
+        nonlocal in_flight
+        in_flight += 1
+
+        partition = (msg.topic(), msg.partition())
+        if partition in busy_partitions:
+            busy_partitions[partition].append(msg)
+        else:
+            busy_partitions[partition] = deque()
+            executor.submit(handle_message, msg)
+
+    def complete_message(msg: Message):
+        nonlocal in_flight
+        in_flight -= 1
+
+        # Manual commits, only once the message is processed:
+        record_offset(msg)
+
+        # Start the next message of the partition
+        partition = (msg.topic(), msg.partition())
+        waiting_messages = busy_partitions.get(partition)
+        if waiting_messages:
+            executor.submit(handle_message, waiting_messages.popleft())
+        else:
+            busy_partitions.pop(partition, None)
+
+    def complete_processed_messages(timeout: float | None = None):
+        try:
+            # Wait for a message to be processed when no more message can be taken
+            if timeout is not None:
+                complete_message(processed_messages.get(timeout=timeout))
+
+            while True:
+                complete_message(processed_messages.get_nowait())
+        except queue.Empty:
+            pass
+
+    def on_revoke(_consumer: Consumer, partitions: list[TopicPartition]):
+        # Called from the consume thread, before the partitions are given to another consumer:
+        # their running messages are finished and every processed offset is committed, so the
+        # new owner neither processes them again nor races our commits
+        nonlocal in_flight
+        revoked = {(tp.topic, tp.partition) for tp in partitions}
+        # Messages waiting in line aren't started, the new owner consumes them again
+        for partition in revoked & busy_partitions.keys():
+            waiting_messages = busy_partitions[partition]
+            in_flight -= len(waiting_messages)
+            waiting_messages.clear()
+        # The partitions are no longer busy once their running message is completed
+        while revoked & busy_partitions.keys():
+            complete_message(processed_messages.get())
+        complete_processed_messages()
+        commit_offsets(asynchronous=False)
+
     def consume_loop():
         try:
-            consumer.subscribe(topics)
+            consumer.subscribe(topics, on_revoke=on_revoke)
             logger.info(f'Subscribed to topic: {topics}')
 
             while not stop_event.is_set():
-                # Poll for messages with a timeout (e.g., 1 second)
-                # Timeout is crucial to allow checking the shutdown_event
-                msg = consumer.poll(timeout=1.0)
-
-                if msg is None:
-                    # No message received within timeout, continue loop
+                if in_flight >= concurrency:
+                    complete_processed_messages(timeout=1.0)
+                    commit_offsets_if_due()
                     continue
 
-                if msg.error():
-                    if msg.error().code() == KafkaError._PARTITION_EOF:
+                complete_processed_messages()
+                commit_offsets_if_due()
+
+                # Consume a whole batch, or as many messages as there are free workers
+                # Timeout is crucial to allow checking the shutdown_event
+                num_messages = batch_size if process_batch is not None else concurrency - in_flight
+                msgs = consumer.consume(num_messages=num_messages, timeout=1.0)
+
+                valid_msgs: list[Message] = []
+                for msg in msgs:
+                    if not msg.error():
+                        # Proper message received
+                        valid_msgs.append(msg)
+                    elif msg.error().code() == KafkaError._PARTITION_EOF:
                         # End of partition event, not an error
                         logger.debug(
                             f'%% {msg.topic()} [{msg.partition()}] reached end at offset {msg.offset()}'  # noqa: E501
                         )
-                    elif msg.error():
+                    else:
                         # Actual error
                         logger.error(f'Kafka error: {msg.error()}')
-                else:
-                    # Proper message received
-                    try:
-                        message_value = msg.value().decode('utf-8')
-                        logger.info(
-                            f'Received message: Topic={msg.topic()}, Partition={msg.partition()}, Offset={msg.offset()}, Key={msg.key()}, Value={message_value}'  # noqa: E501
-                        )
-                        process_message(message_value)
-                    except Exception as e:
-                        logger.error(f'Error processing message: {e}')
 
-                    # Manual commits:
-                    try:
-                        consumer.commit(asynchronous=False)
-                    except KafkaException as e:
-                        logger.error(f'Failed to commit offset: {e}')
+                if process_batch is not None:
+                    if valid_msgs:
+                        handle_batch(valid_msgs)
+                else:
+                    for msg in valid_msgs:
+                        dispatch_message(msg)
 
-                # Short sleep to prevent high CPU usage if poll returns immediately (e.g., error)
-                time.sleep(0.01)
+                if len(valid_msgs) < len(msgs):
+                    # Short sleep to prevent high CPU usage if consume returns errors immediately
+                    time.sleep(0.01)
 
         except KafkaException as e:
             logger.error(f'Kafka subscription/polling error: {e}')
         except Exception as e:
             logger.error(f'Unexpected error in consumer loop: {e}', exc_info=True)
         finally:
+            # Let running messages finish, waiting ones are left uncommitted
+            # so they are consumed again later
+            busy_partitions.clear()
+            executor.shutdown(wait=True, cancel_futures=True)
+            complete_processed_messages()
+            commit_offsets(asynchronous=False)
+
             # Leave consumer group and clean up resources
             logger.info('Closing Kafka consumer...')
             consumer.close()
@@ -1,17 +1,26 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.routes import files, notifications, users
+from app.core.auth_cache import start_invalidation_listener
 from app.core.cache import close_clients
 from app.core.config import ServerMode, get_settings
-from app.core.database import run_migrations
-from app.core.stream import flush_producer, get_consume_thread
+from app.core.credit import load_scripts as load_credit_scripts
+from app.core.database import async_engine, run_migrations
+from app.core.notification_hub import notification_hub
+from app.core.outbox import get_relay_thread
+from app.core.security import close_password_executor
+from app.core.stream import close_producer, get_consume_thread
 from app.schemas.stream import Topic
 from app.services.file_service import file_service
 from app.services.notification_service import notification_service
+from app.utils.clients import close_worker_clients
+from app.utils.mail import close_email_outbox
+from app.utils.upload import close_storage_client
 
 settings = get_settings()
 
@@ -19,31 +28,83 @@ settings = get_settings()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     run_migrations()
+    # Start the outbox relay, status events are sent to Kafka from the outbox table
+    relay_outbox = settings.server_mode == ServerMode.outbox_relay or (
+        settings.outbox_relay_in_process
+        and settings.server_mode in [ServerMode.api_server, ServerMode.file_worker]
+    )
+    if relay_outbox:
+        start_relaying, stop_relaying = get_relay_thread(
+            batch_size=settings.outbox_batch_size,
+            poll_interval_ms=settings.outbox_poll_interval_ms,
+            timeout=settings.outbox_delivery_timeout,
+        )
+        start_relaying()
+
     # Start worker
     match settings.server_mode:
+        case ServerMode.api_server:
+            # Load Redis scripts of the credit checks
+            await load_credit_scripts()
+            # Evict locally cached auth sessions invalidated by any api server
+            invalidation_listener = start_invalidation_listener()
         case ServerMode.file_worker:
             start_consuming, stop_consuming = get_consume_thread(
-                [Topic.files.value], file_service.process_file
+                [Topic.files.value],
+                file_service.process_file,
+                concurrency=settings.consumer_concurrency,
+                commit_batch_size=settings.consumer_commit_batch_size,
+                commit_interval_ms=settings.consumer_commit_interval_ms,
             )
             start_consuming()
         case ServerMode.notification_worker:
             start_consuming, stop_consuming = get_consume_thread(
-                [Topic.notifications.value], notification_service.route_notifications
+                [Topic.notifications.value],
+                process_batch=notification_service.route_notifications_batch,
+                batch_size=settings.consumer_batch_size,
+                commit_batch_size=settings.consumer_commit_batch_size,
+                commit_interval_ms=settings.consumer_commit_interval_ms,
             )
             start_consuming()
 
     yield
 
+    # Stop relaying before the producer is closed
+    if relay_outbox:
+        stop_relaying()
+
     # Flush all pending Kafka messages
-    flush_producer()
+    close_producer()
 
     # Stop worker
     if settings.server_mode in [ServerMode.file_worker, ServerMode.notification_worker]:
         stop_consuming()
 
+    # Send the emails waiting for their digest and the ones queued by the notification worker
+    notification_service.close()
+    close_email_outbox()
+
+    if settings.server_mode == ServerMode.api_server:
+        invalidation_listener.cancel()
+        with suppress(asyncio.CancelledError):
+            await invalidation_listener
+        await notification_hub.stop()
+
+    # Stop the password hashing threads
+    close_password_executor()
+
     # Close all Redis clients
     await close_clients()
 
+    # Close the storage client and its pooled connections
+    close_storage_client()
+
+    # Close the Gemini client and the HTTP session of the file worker
+    close_worker_clients()
+
+    # Close all connections of the async database engine
+    await async_engine.dispose()
+
 
 app = FastAPI(root_path='/api/v1', lifespan=lifespan)
 
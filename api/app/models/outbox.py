@@ -0,0 +1,23 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlmodel import Field, SQLModel
+
+
+class OutboxEvent(SQLModel, table=True):
+    """Kafka message written in the transaction of the change it reports, sent by the relay"""
+
+    __tablename__ = 'outbox_events'
+    __table_args__ = (
+        # Finds whether an older event of the same ordering key is still waiting
+        sa.Index('ix_outbox_events_ordering_key_id', 'ordering_key', 'id'),
+        {'extend_existing': True},
+    )
+
+    id: int | None = Field(default=None, primary_key=True)
+    topic: str
+    key: str | None = None
+    # Events with the same ordering key are relayed one after another, in insertion order
+    ordering_key: str | None = None
+    value: bytes = Field(sa_column=sa.Column(sa.LargeBinary(), nullable=False))
+    created_at: datetime = Field(sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False))
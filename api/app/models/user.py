@@ -59,7 +59,13 @@ class AuthSession(SQLModel, table=True):
 
 class File(SQLModel, table=True):
     __tablename__ = 'files'
-    __table_args__ = ({'extend_existing': True},)
+    __table_args__ = (
+        # One index per list_files ordering, the id makes the (sort key, id) seek exact
+        sa.Index('ix_files_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+        sa.Index('ix_files_user_id_filename_id', 'user_id', 'filename', 'id'),
+        sa.Index('ix_files_user_id_status_id', 'user_id', 'status', 'id'),
+        {'extend_existing': True},
+    )
 
     id: int | None = Field(default=None, primary_key=True)
     filename: str
@@ -69,6 +75,8 @@ class File(SQLModel, table=True):
     url: str
     created_at: datetime = Field(sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False))
     object_path: str
+    # SHA-256 of the content, copies of a processed file reuse its blob and description
+    content_hash: str | None = Field(default=None, index=True)
 
     description: str | None = None
 
@@ -35,14 +35,31 @@ class ListFilesQueries(BaseModel):
     page_size: Annotated[int, Query(gt=0, le=50)] = 20
     sort_by: SortBy = SortBy.created_at
     order: SortOrder = SortOrder.asc
+    # Seeks past the last file of the previous page instead of skipping `page` pages
+    cursor: str | None = None
+    # The exact total has to count every file of the user, skip it when not needed
+    count: bool = True
 
 
 class ListFilesResponse(BaseModel):
-    result_count: int
-    page_count: int
+    result_count: int | None
+    page_count: int | None
     page_size: int
-    page: int
+    # Only set for offset pages, a cursor has no page number
+    page: int | None
+    next_cursor: str | None = None
     credit: int
     credit_count: int
     credit_timestamp: datetime | None
     results: list[FileResponse]
+
+
+class UploadBatchResult(BaseModel):
+    filename: str | None
+    # Either the created file or the reason it was rejected
+    file: FileResponse | None = None
+    error: str | None = None
+
+
+class UploadBatchResponse(BaseModel):
+    results: list[UploadBatchResult]
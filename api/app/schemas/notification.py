@@ -16,3 +16,4 @@ class Notification(BaseModel):
     type: NotificationType
     category: NotificationCategory
     message: str
+    file_id: int | None = None
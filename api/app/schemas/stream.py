@@ -1,7 +1,9 @@
-from datetime import datetime
+from datetime import UTC, datetime
 from enum import Enum
+from typing import Annotated, Literal
 
-from pydantic import BaseModel
+import msgpack
+from pydantic import BaseModel, Field, TypeAdapter
 
 from app.core.config import ServerMode
 from app.models.user import FileProcessingStatus
@@ -33,15 +35,84 @@ class FileUploadedPayload(BaseModel):
 
 
 class FileUploadedEvent(BaseEvent):
+    event_type: Literal[EventType.file_upload] = EventType.file_upload
     payload: FileUploadedPayload
 
 
 class StatusUpdatedPayload(BaseModel):
     user_id: int
+    file_id: int | None = None
     status: FileProcessingStatus
     message: str
     email: str | None
 
 
 class StatusUpdatedEvent(BaseEvent):
+    event_type: Literal[EventType.status_update] = EventType.status_update
     payload: StatusUpdatedPayload
+
+
+# Every event, the event_type of a message selects the model it's validated with
+Event = Annotated[FileUploadedEvent | StatusUpdatedEvent, Field(discriminator='event_type')]
+
+event_adapter: TypeAdapter[Event] = TypeAdapter(Event)
+
+
+def parse_event(msg: str | bytes) -> Event:
+    return event_adapter.validate_json(msg)
+
+
+# Encodings of the events by metadata.version:
+# 1: JSON object
+# 2: msgpack array [version, event_type, timestamp, source, [payload values]], the payload
+#    values in the order of the payload fields, new fields can only be appended
+json_version = 1
+compact_version = 2
+
+# Event model and payload field order of each event type in the compact encoding
+compact_layouts = {
+    event_model.model_fields['event_type'].default: (
+        event_model,
+        tuple(event_model.model_fields['payload'].annotation.model_fields),
+    )
+    for event_model in [FileUploadedEvent, StatusUpdatedEvent]
+}
+
+
+def encode_event(event: Event) -> bytes:
+    if event.metadata.version == json_version:
+        return event.model_dump_json().encode('utf-8')
+
+    timestamp = event.timestamp
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=UTC)
+
+    return msgpack.packb(
+        [
+            compact_version,
+            event.event_type.value,
+            msgpack.Timestamp.from_datetime(timestamp),
+            event.metadata.source.value,
+            list(event.payload.model_dump(mode='json').values()),
+        ]
+    )
+
+
+def decode_event(msg: str | bytes) -> Event:
+    # JSON is accepted from any producer that hasn't switched to the compact encoding yet
+    if isinstance(msg, str) or msg[:1] == b'{':
+        return parse_event(msg)
+
+    version, event_type, timestamp, source, payload_values = msgpack.unpackb(msg)
+    if version != compact_version:
+        raise ValueError(f'Unsupported event version: {version}')
+
+    event_model, payload_fields = compact_layouts[event_type]
+    return event_model.model_validate(
+        {
+            'event_type': event_type,
+            'timestamp': timestamp.to_datetime(),
+            'metadata': {'version': version, 'source': source},
+            'payload': dict(zip(payload_fields, payload_values, strict=False)),
+        }
+    )
@@ -1,212 +1,484 @@
 import asyncio
+import base64
 import contextlib
+import hashlib
+import io
+import json
 import time
 import urllib
-from datetime import UTC, datetime, timedelta
+from datetime import UTC, datetime
+from typing import BinaryIO
 from uuid import uuid4
 
-import requests
-from confluent_kafka import Producer
 from fastapi import BackgroundTasks, HTTPException, UploadFile, status
-from google import genai
 from google.genai import types
+from sqlalchemy import insert, tuple_
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlmodel import Session, asc, desc, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
-from app.core.cache import get_sync_client
-from app.core.config import Settings, get_settings
-from app.core.database import get_session
+from app.core.config import DownloadMode, Settings, UploadMode, get_settings
+from app.core.credit import consume_credit, peek_credit, release_credit
+from app.core.database import async_session_maker, get_session
+from app.core.describe_cache import cache_description, get_cached_description
 from app.core.logging import logger
-from app.core.stream import get_producer
+from app.core.outbox import add_outbox_event, notify_outbox
+from app.core.stream import ManagedProducer, get_producer
 from app.models.user import File as UserFile
-from app.models.user import FileProcessingStatus
+from app.models.user import FileProcessingStatus, User
 from app.schemas.file import SortBy, SortOrder
-from app.schemas.stream import EventType, FileUploadedEvent, StatusUpdatedEvent, Topic
-from app.utils.upload import delete_blob, upload_blob_from_memory
+from app.schemas.stream import (
+    EventType,
+    FileUploadedEvent,
+    StatusUpdatedEvent,
+    Topic,
+    decode_event,
+    encode_event,
+)
+from app.utils.clients import get_gemini_client, get_http_session, get_http_timeout
+from app.utils.upload import delete_blob, download_blob, upload_blob, upload_blob_from_memory
+
+describe_model = 'gemini-2.0-flash'
+describe_prompt = 'Please summarize and explain the contents of this file. What is it about and what is its purpose?'  # noqa: E501
+# Bump it with the prompt, descriptions cached for the previous prompt aren't used anymore
+describe_prompt_version = 1
 
 
 class FileService:
-    def _update_status(
+    def _add_status_event(
         self,
-        db: Session,
-        producer: Producer,
+        db: Session | AsyncSession,
         settings: Settings,
         file_data: UserFile,
         message: str,
-        status: FileProcessingStatus = FileProcessingStatus.unknown,
-        noti_only: bool = False,
     ):
-        if not noti_only:
-            file_data.status = status
-            db.add(file_data)
-            db.commit()
-            db.refresh(file_data)
-
         noti_event = StatusUpdatedEvent(
             event_type=EventType.status_update,
             timestamp=file_data.created_at,
-            metadata={'version': 1, 'source': settings.server_mode},
+            metadata={'version': settings.event_version, 'source': settings.server_mode},
             payload={
                 'user_id': file_data.user_id,
+                'file_id': file_data.id,
                 'status': file_data.status.value,
                 'message': message,
                 'email': file_data.user.email,
             },
         )
-        producer.produce(
+        # Sent by the outbox relay once committed, a crash can't lose it
+        add_outbox_event(
+            db,
             Topic.notifications.value,
             key=f'{file_data.user_id},{file_data.id},{file_data.status.value}',
-            value=noti_event.json(),
+            value=encode_event(noti_event),
+            # The statuses of a file are sent in the order they were set
+            ordering_key=f'file:{file_data.id}',
         )
 
-    async def _upload_file(
+    # Status updates from the API server, the user of the file must be loaded
+    async def _update_status(
         self,
-        file_id: int,
-        file_bytes: bytes,
+        db: AsyncSession,
+        settings: Settings,
+        file_data: UserFile,
+        message: str,
+        status: FileProcessingStatus = FileProcessingStatus.unknown,
+        noti_only: bool = False,
     ):
-        try:
-            # Simulate delay like a real system
-            await asyncio.sleep(5)
+        if not noti_only:
+            file_data.status = status
+            db.add(file_data)
 
-            db = next(get_session())
-            producer = get_producer()
-            settings = get_settings()
+        self._add_status_event(db, settings, file_data, message)
+        await db.commit()
+        notify_outbox()
 
-            statement = select(UserFile).where(UserFile.id == file_id)
-            result = db.exec(statement)
-            file_data = result.one()
+    # Status updates from the file worker
+    def _update_status_sync(
+        self,
+        db: Session,
+        settings: Settings,
+        file_data: UserFile,
+        message: str,
+        status: FileProcessingStatus = FileProcessingStatus.unknown,
+        noti_only: bool = False,
+    ):
+        if not noti_only:
+            file_data.status = status
+            db.add(file_data)
+
+        self._add_status_event(db, settings, file_data, message)
+        db.commit()
+        db.refresh(file_data)
+        notify_outbox()
+
+    async def _produce_file_event(
+        self,
+        producer: ManagedProducer,
+        settings: Settings,
+        file_data: UserFile,
+    ):
+        file_event = FileUploadedEvent(
+            event_type=EventType.file_upload,
+            timestamp=file_data.created_at,
+            metadata={'version': settings.event_version, 'source': settings.server_mode},
+            payload={'file_id': file_data.id},
+        )
+        await producer.produce_async(
+            Topic.files.value, key=str(file_data.id), value=encode_event(file_event)
+        )
 
-            upload_blob_from_memory(
+    async def _upload_blob(
+        self,
+        settings: Settings,
+        file_data: UserFile,
+        file_source: bytes | BinaryIO,
+    ):
+        # Uploads run in worker threads so the event loop isn't blocked
+        if isinstance(file_source, bytes):
+            await run_in_threadpool(
+                upload_blob_from_memory,
                 settings.bucket_name,
-                file_bytes,
+                file_source,
                 file_data.object_path,
                 file_data.type,
             )
-
-            file_event = FileUploadedEvent(
-                event_type=EventType.file_upload,
-                timestamp=file_data.created_at,
-                metadata={'version': 1, 'source': settings.server_mode},
-                payload={'file_id': file_data.id},
+        else:
+            # Stream the file chunk by chunk
+            await run_in_threadpool(
+                upload_blob,
+                settings.bucket_name,
+                file_source,
+                file_data.object_path,
+                file_data.type,
+                settings.upload_chunk_size,
             )
-            producer.produce(Topic.files.value, key=str(file_data.id), value=file_event.json())
 
-            db.refresh(file_data)
+    async def _upload_file(
+        self,
+        file_id: int,
+        file_source: bytes | BinaryIO,
+    ):
+        async with async_session_maker() as db:
+            try:
+                # Simulate delay like a real system
+                await asyncio.sleep(5)
+
+                producer = get_producer()
+                settings = get_settings()
+
+                statement = (
+                    select(UserFile)
+                    .where(UserFile.id == file_id)
+                    .options(selectinload(UserFile.user))
+                )
+                result = await db.exec(statement)
+                file_data = result.one()
 
-            # If the file processing was cancelled, exit
-            if file_data.status == FileProcessingStatus.cancelled:
-                return
+                await self._upload_blob(settings, file_data, file_source)
+                await self._produce_file_event(producer, settings, file_data)
 
-            self._update_status(
-                db=db,
-                producer=producer,
-                file_data=file_data,
-                message=f'File "{file_data.filename}" is queuing',
-                status=FileProcessingStatus.queuing,
-                settings=settings,
-            )
+                await db.refresh(file_data, ['status'])
 
-            logger.debug(f'File "{file_data.filename}" uploaded')
+                # If the file processing was cancelled, exit
+                if file_data.status == FileProcessingStatus.cancelled:
+                    return
 
-        except Exception as e:
-            with contextlib.suppress(Exception):
-                self._update_status(
+                await self._update_status(
                     db=db,
-                    producer=producer,
                     file_data=file_data,
-                    message=f'File "{file_data.filename}" was failed to push to queue',
-                    status=FileProcessingStatus.failed,
+                    message=f'File "{file_data.filename}" is queuing',
+                    status=FileProcessingStatus.queuing,
                     settings=settings,
                 )
-            logger.debug(e)
 
-    def _check_credit(self, settings: Settings, user_id: int):
-        r = get_sync_client()
-        count_key = f'credit:file:{user_id}'
-
-        lua_script = """
-        local count = redis.call('GET', KEYS[1])
-        if not count then
-            redis.call('SET', KEYS[1], 0)
-            redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
-            count = "0"
-        end
-
-        if tonumber(count) < tonumber(ARGV[1]) then
-            redis.call('INCR', KEYS[1])
-            return 1
-        else
-            return 0
-        end
-        """
-
-        increment_script = r.register_script(lua_script)
-        result = increment_script(
-            keys=[count_key],
-            args=[settings.credit_limit, settings.credit_period],
+                logger.debug(f'File "{file_data.filename}" uploaded')
+
+            except Exception as e:
+                with contextlib.suppress(Exception):
+                    await self._update_status(
+                        db=db,
+                        file_data=file_data,
+                        message=f'File "{file_data.filename}" was failed to push to queue',
+                        status=FileProcessingStatus.failed,
+                        settings=settings,
+                    )
+                logger.debug(e)
+            finally:
+                if not isinstance(file_source, bytes):
+                    file_source.close()
+
+    async def _upload_files(self, uploads: list[tuple[int, bytes | BinaryIO]]):
+        files_statement = (
+            select(UserFile)
+            .where(UserFile.id.in_([file_id for file_id, _ in uploads]))
+            .options(selectinload(UserFile.user))
+        )
+
+        async with async_session_maker() as db:
+            try:
+                # Simulate delay like a real system
+                await asyncio.sleep(5)
+
+                producer = get_producer()
+                settings = get_settings()
+
+                result = await db.exec(files_statement)
+                files_data = {file_data.id: file_data for file_data in result.all()}
+
+                # Files deleted since the request are skipped, the others are still uploaded
+                found_uploads = [
+                    (file_id, file_source)
+                    for file_id, file_source in uploads
+                    if file_id in files_data
+                ]
+                if len(found_uploads) < len(uploads):
+                    logger.debug(f'{len(uploads) - len(found_uploads)} files no longer exist')
+
+                # Uploaded concurrently, no more at once than the pooled connections of the
+                # storage client, each upload holds a worker thread of the threadpool
+                upload_slots = asyncio.Semaphore(settings.storage_pool_size)
+
+                async def upload_blob(file_data: UserFile, file_source: bytes | BinaryIO):
+                    async with upload_slots:
+                        await self._upload_blob(settings, file_data, file_source)
+
+                upload_results = await asyncio.gather(
+                    *[
+                        upload_blob(files_data[file_id], file_source)
+                        for file_id, file_source in found_uploads
+                    ],
+                    return_exceptions=True,
+                )
+
+                # Produced back to back, the producer sends them to Kafka as one batch
+                uploaded_ids: list[int] = []
+                for (file_id, _), upload_result in zip(found_uploads, upload_results, strict=True):
+                    if isinstance(upload_result, Exception):
+                        logger.debug(upload_result)
+                        continue
+                    await self._produce_file_event(producer, settings, files_data[file_id])
+                    uploaded_ids.append(file_id)
+
+                # Reload the statuses of every file at once, some may have been cancelled
+                # or deleted
+                result = await db.exec(files_statement.execution_options(populate_existing=True))
+
+                for file_data in result.all():
+                    file_id = file_data.id
+                    if file_data.status == FileProcessingStatus.cancelled:
+                        continue
+
+                    if file_id in uploaded_ids:
+                        file_data.status = FileProcessingStatus.queuing
+                        message = f'File "{file_data.filename}" is queuing'
+                    else:
+                        file_data.status = FileProcessingStatus.failed
+                        message = f'File "{file_data.filename}" was failed to push to queue'
+                    db.add(file_data)
+                    self._add_status_event(db, settings, file_data, message)
+
+                # Every status is updated by a single commit
+                await db.commit()
+                notify_outbox()
+
+                logger.debug(f'{len(uploaded_ids)} of {len(uploads)} files uploaded')
+
+            except Exception as e:
+                with contextlib.suppress(Exception):
+                    await db.rollback()
+                    result = await db.exec(files_statement)
+                    for file_data in result.all():
+                        if file_data.status == FileProcessingStatus.cancelled:
+                            continue
+                        file_data.status = FileProcessingStatus.failed
+                        db.add(file_data)
+                        self._add_status_event(
+                            db,
+                            settings,
+                            file_data,
+                            f'File "{file_data.filename}" was failed to push to queue',
+                        )
+                    await db.commit()
+                    notify_outbox()
+                logger.debug(e)
+            finally:
+                self._close_upload_sources([file_source for _, file_source in uploads])
+
+    def _hash_file(self, file: BinaryIO) -> str:
+        # Read in chunks, the content of the form file isn't loaded in memory at once
+        file.seek(0)
+        content_hash = hashlib.file_digest(file, 'sha256').hexdigest()
+        file.seek(0)
+        return content_hash
+
+    async def _find_processed_duplicates(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        content_hashes: list[str],
+    ) -> dict[tuple[str, str], UserFile]:
+        # Blobs are only shared between the files of the same user
+        statement = select(UserFile).where(
+            UserFile.content_hash.in_(content_hashes),
+            UserFile.user_id == user_id,
+            UserFile.status == FileProcessingStatus.success,
+            UserFile.description.is_not(None),
+        )
+        result = await db.exec(statement)
+        return {(file.content_hash, file.type): file for file in result.all()}
+
+    def _create_file_data(
+        self,
+        settings: Settings,
+        user_id: int,
+        file: UploadFile,
+        content_hash: str,
+        duplicate: UserFile | None,
+        now: datetime,
+    ) -> UserFile:
+        rand_str = str(uuid4())
+        object_path = f'{user_id}/{rand_str}/{file.filename}'
+        file_url = f'{settings.cdn_url}/{user_id}/{rand_str}/{urllib.parse.quote(file.filename)}'
+
+        file_data = UserFile(
+            filename=file.filename,
+            status=FileProcessingStatus.pending,
+            size=file.size,
+            type=file.content_type,
+            url=file_url,
+            created_at=now,
+            object_path=object_path,
+            content_hash=content_hash,
+            user_id=user_id,
         )
+        if duplicate is not None:
+            # Share the blob of the processed copy instead of uploading it again
+            file_data.status = FileProcessingStatus.success
+            file_data.url = duplicate.url
+            file_data.object_path = duplicate.object_path
+            file_data.description = duplicate.description
+        return file_data
 
-        if result == 0:
+    async def _take_upload_source(self, settings: Settings, file: UploadFile):
+        match settings.upload_mode:
+            case UploadMode.memory:
+                return await file.read()
+            case UploadMode.stream:
+                # Form files are closed once the response is returned, which is
+                # before background tasks run, so take over the spooled file here
+                file_source = file.file
+                file_source.seek(0)
+                file.file = io.BytesIO()
+                return file_source
+
+    def _close_upload_sources(self, upload_sources: list[bytes | BinaryIO | None]):
+        for upload_source in upload_sources:
+            if upload_source is not None and not isinstance(upload_source, bytes):
+                upload_source.close()
+
+    def _find_processed_description(self, db: Session, file_data: UserFile) -> str | None:
+        if file_data.content_hash is None:
+            return None
+
+        # The description only depends on the content, any processed copy can provide it
+        statement = (
+            select(UserFile.description)
+            .where(
+                UserFile.content_hash == file_data.content_hash,
+                UserFile.type == file_data.type,
+                UserFile.status == FileProcessingStatus.success,
+                UserFile.description.is_not(None),
+                UserFile.id != file_data.id,
+            )
+            .limit(1)
+        )
+        return db.exec(statement).first()
+
+    async def _check_credit(self, settings: Settings, user_id: int, amount: int = 1):
+        has_credit = await consume_credit(
+            user_id=user_id,
+            limit=settings.credit_limit,
+            period=settings.credit_period,
+            amount=amount,
+        )
+
+        if not has_credit:
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail='You’ve reached your credit limit for processing files.',
             )
 
+    async def _release_credit(self, user_id: int, amount: int):
+        try:
+            await release_credit(user_id=user_id, amount=amount)
+        except Exception as e:
+            logger.error(f'Failed to release {amount} credits of user {user_id}: {e}')
+
     async def upload_file(
         self,
         user_id: int,
         settings: Settings,
-        db: Session,
-        producer: Producer,
+        db: AsyncSession,
         background_tasks: BackgroundTasks,
         file: UploadFile,
     ) -> UserFile:
         try:
-            self._check_credit(settings=settings, user_id=user_id)
-
-            now = datetime.now(UTC)
-            rand_str = str(uuid4())
-            object_path = f'{user_id}/{rand_str}/{file.filename}'
-            file_url = (
-                f'{settings.cdn_url}/{user_id}/{rand_str}/{urllib.parse.quote(file.filename)}'
+            content_hash = await run_in_threadpool(self._hash_file, file.file)
+            duplicates = await self._find_processed_duplicates(
+                db=db, user_id=user_id, content_hashes=[content_hash]
             )
+            duplicate = duplicates.get((content_hash, file.content_type))
+
+            # A copy of a processed file isn't charged, it never reaches the model
+            if duplicate is None:
+                await self._check_credit(settings=settings, user_id=user_id)
 
-            file_data = UserFile(
-                filename=file.filename,
-                status=FileProcessingStatus.pending,
-                size=file.size,
-                type=file.content_type,
-                url=file_url,
-                created_at=now,
-                object_path=object_path,
+            file_data = self._create_file_data(
+                settings=settings,
                 user_id=user_id,
+                file=file,
+                content_hash=content_hash,
+                duplicate=duplicate,
+                now=datetime.now(UTC),
             )
             db.add(file_data)
-            db.commit()
-            db.refresh(file_data)
+            await db.commit()
+            await db.refresh(file_data, ['user'])
 
-            file_bytes = await file.read()
-            background_tasks.add_task(
-                self._upload_file,
-                file_data.id,
-                file_bytes,
-            )
+            if duplicate is not None:
+                await self._update_status(
+                    db=db,
+                    file_data=file_data,
+                    message=f'File "{file_data.filename}" is successfully processed',
+                    noti_only=True,
+                    settings=settings,
+                )
+                return file_data
 
-            self._update_status(
+            await self._update_status(
                 db=db,
-                producer=producer,
                 file_data=file_data,
                 message=f'File "{file_data.filename}" is waiting to be uploaded',
                 noti_only=True,
                 settings=settings,
             )
 
+            # Taken last, the form closes the file of a request that failed before
+            file_source = await self._take_upload_source(settings, file)
+            background_tasks.add_task(
+                self._upload_file,
+                file_data.id,
+                file_source,
+            )
+
         except HTTPException as e:
             raise e
         except Exception as e:
             with contextlib.suppress(Exception):
-                self._update_status(
+                await self._update_status(
                     db=db,
-                    producer=producer,
                     file_data=file_data,
                     message=f'File "{file_data.filename}" was failed to handle',
                     status=FileProcessingStatus.failed,
@@ -220,15 +492,152 @@ class FileService:
 
         return file_data
 
-    def list_files(
+    async def upload_files(
         self,
-        db: Session,
+        user_id: int,
+        settings: Settings,
+        db: AsyncSession,
+        background_tasks: BackgroundTasks,
+        files: list[UploadFile],
+    ) -> list[UserFile]:
+        reserved_credit = 0
+        upload_sources: list[bytes | BinaryIO | None] = []
+        try:
+            content_hashes = await run_in_threadpool(
+                lambda: [self._hash_file(file.file) for file in files]
+            )
+            duplicates = await self._find_processed_duplicates(
+                db=db, user_id=user_id, content_hashes=content_hashes
+            )
+            file_duplicates = [
+                duplicates.get((content_hash, file.content_type))
+                for file, content_hash in zip(files, content_hashes, strict=True)
+            ]
+
+            # The credits of the whole batch are reserved at once, either all files are
+            # accepted or none of them, copies of processed files aren't charged
+            new_count = file_duplicates.count(None)
+            if new_count > 0:
+                await self._check_credit(settings=settings, user_id=user_id, amount=new_count)
+                reserved_credit = new_count
+
+            # Taken before the rows are committed, so a committed file can always be uploaded
+            for file, duplicate in zip(files, file_duplicates, strict=True):
+                upload_sources.append(
+                    await self._take_upload_source(settings, file) if duplicate is None else None
+                )
+
+            now = datetime.now(UTC)
+            new_files = [
+                self._create_file_data(
+                    settings=settings,
+                    user_id=user_id,
+                    file=file,
+                    content_hash=content_hash,
+                    duplicate=duplicate,
+                    now=now,
+                ).model_dump(exclude={'id'})
+                for file, content_hash, duplicate in zip(
+                    files, content_hashes, file_duplicates, strict=True
+                )
+            ]
+
+            # The rows are inserted by a single INSERT .. RETURNING statement, the status
+            # events are committed with them
+            result = await db.exec(
+                insert(UserFile).returning(UserFile, sort_by_parameter_order=True),
+                params=new_files,
+            )
+            files_data = result.scalars().all()
+
+            # The user is loaded once for every file
+            user = await db.get(User, user_id)
+            for file_data in files_data:
+                set_committed_value(file_data, 'user', user)
+
+                if file_data.status == FileProcessingStatus.success:
+                    message = f'File "{file_data.filename}" is successfully processed'
+                else:
+                    message = f'File "{file_data.filename}" is waiting to be uploaded'
+                self._add_status_event(db, settings, file_data, message)
+            await db.commit()
+            # The files are accepted, their credits are spent
+            reserved_credit = 0
+            notify_outbox()
+
+            uploads = [
+                (file_data.id, upload_source)
+                for file_data, upload_source in zip(files_data, upload_sources, strict=True)
+                if upload_source is not None
+            ]
+            if uploads:
+                background_tasks.add_task(self._upload_files, uploads)
+
+        except HTTPException as e:
+            raise e
+        except Exception as e:
+            logger.debug(e)
+            self._close_upload_sources(upload_sources)
+            # None of the files has been accepted, the whole reservation is given back
+            if reserved_credit > 0:
+                await self._release_credit(user_id=user_id, amount=reserved_credit)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail='Error occured while uploading files',
+            ) from e
+
+        return files_data
+
+    def _encode_cursor(self, file_data: UserFile, sort_by: SortBy, sort_order: SortOrder) -> str:
+        match sort_by:
+            case SortBy.created_at:
+                value = file_data.created_at.isoformat()
+            case SortBy.name:
+                value = file_data.filename
+            case SortBy.status:
+                value = file_data.status.value
+
+        cursor = {'sort_by': sort_by, 'order': sort_order, 'value': value, 'id': file_data.id}
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+    def _decode_cursor(self, cursor: str, sort_by: SortBy, sort_order: SortOrder):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            # A cursor is only valid for the ordering it was created with
+            if data['sort_by'] != sort_by or data['order'] != sort_order:
+                raise ValueError('Cursor ordering mismatch')
+
+            match sort_by:
+                case SortBy.created_at:
+                    value = datetime.fromisoformat(data['value'])
+                case SortBy.name:
+                    value = str(data['value'])
+                case SortBy.status:
+                    value = FileProcessingStatus(data['value'])
+
+            return value, int(data['id'])
+        except Exception as e:
+            logger.debug(e)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='Invalid cursor',
+            ) from e
+
+    async def list_files(
+        self,
+        db: AsyncSession,
         user_id: int,
         page: int = 1,
         page_size: int = 20,
         sort_by: SortBy = SortBy.created_at,
         sort_order: SortOrder = SortOrder.asc,
-    ) -> tuple[UserFile, int, int, datetime | None]:
+        cursor: str | None = None,
+        include_count: bool = True,
+    ) -> tuple[list[UserFile], int | None, str | None, int, datetime | None]:
+        seek = None
+        if cursor is not None:
+            seek = self._decode_cursor(cursor, sort_by, sort_order)
+
         try:
             file_statement = select(UserFile).where(UserFile.user_id == user_id)
 
@@ -240,25 +649,38 @@ class FileService:
                 case SortBy.status:
                     sort = UserFile.status
 
-            if sort is not None:
-                sort = desc(sort) if sort_order == SortOrder.desc else asc(sort)
-                file_statement = file_statement.order_by(sort)
+            # The id breaks ties so every file has a stable position to seek from
+            if sort_order == SortOrder.desc:
+                file_statement = file_statement.order_by(desc(sort), desc(UserFile.id))
+            else:
+                file_statement = file_statement.order_by(asc(sort), asc(UserFile.id))
 
-            file_statement = file_statement.offset((page - 1) * page_size).limit(page_size)
+            if seek is not None:
+                key = tuple_(sort, UserFile.id)
+                file_statement = file_statement.where(
+                    key < seek if sort_order == SortOrder.desc else key > seek
+                )
+            else:
+                file_statement = file_statement.offset((page - 1) * page_size)
 
-            file_results = db.exec(file_statement)
+            # One extra row tells whether there is a next page without counting
+            file_statement = file_statement.limit(page_size + 1)
+
+            file_results = await db.exec(file_statement)
             files = file_results.all()
 
-            count_statement = select(func.count(UserFile.id)).where(UserFile.user_id == user_id)
-            count_result = db.exec(count_statement)
-            count = count_result.one()
+            next_cursor = None
+            if len(files) > page_size:
+                files = files[:page_size]
+                next_cursor = self._encode_cursor(files[-1], sort_by, sort_order)
+
+            count = None
+            if include_count:
+                count_statement = select(func.count(UserFile.id)).where(UserFile.user_id == user_id)
+                count_result = await db.exec(count_statement)
+                count = count_result.one()
 
-            r = get_sync_client()
-            count_key = f'credit:file:{user_id}'
-            used_credit = int(r.get(count_key) or 0)
-            credit_timestamp = None
-            if used_credit > 0:
-                credit_timestamp = datetime.now(UTC) + timedelta(seconds=int(r.ttl(count_key)))
+            used_credit, credit_timestamp = await peek_credit(user_id=user_id)
         except Exception as e:
             logger.debug(e)
             raise HTTPException(
@@ -266,11 +688,11 @@ class FileService:
                 detail='Error occured while listing files',
             ) from e
 
-        return files, count, used_credit, credit_timestamp
+        return files, count, next_cursor, used_credit, credit_timestamp
 
-    def delete_file(
+    async def delete_file(
         self,
-        db: Session,
+        db: AsyncSession,
         settings: Settings,
         background_tasks: BackgroundTasks,
         user_id: int,
@@ -278,7 +700,7 @@ class FileService:
     ):
         try:
             statement = select(UserFile).where(UserFile.user_id == user_id, UserFile.id == file_id)
-            result = db.exec(statement)
+            result = await db.exec(statement)
             file = result.first()
 
             if file is None:
@@ -297,10 +719,21 @@ class FileService:
                     detail='Unable to delete processing files',
                 )
 
-            db.delete(file)
-            db.commit()
+            await db.delete(file)
+            await db.commit()
+
+            # Copies of the file share its blob, it's deleted with the last of them
+            shared_count = 0
+            if file.content_hash is not None:
+                shared_statement = select(func.count(UserFile.id)).where(
+                    UserFile.content_hash == file.content_hash,
+                    UserFile.object_path == file.object_path,
+                )
+                shared_result = await db.exec(shared_statement)
+                shared_count = shared_result.one()
 
-            background_tasks.add_task(delete_blob, settings.bucket_name, file.object_path)
+            if shared_count == 0:
+                background_tasks.add_task(delete_blob, settings.bucket_name, file.object_path)
 
         except HTTPException as e:
             raise e
@@ -312,20 +745,17 @@ class FileService:
             ) from e
 
     # Method for processing files in the file worker
-    def process_file(self, msg: str):
+    def process_file(self, msg: bytes):
         try:
             # Simulate delay like a real system
             time.sleep(5)
 
             # Parse the FileUploadedEvent from the message
-            fileUploadedEvent = FileUploadedEvent.parse_raw(msg)
+            fileUploadedEvent = decode_event(msg)
 
             # Get a database session
             # Here is a method for a worker, so it's acceptable to get db like this
             db = next(get_session())
-            # Get Kafka producer
-            producer = get_producer()
-
             # Get settings
             settings = get_settings()
 
@@ -339,33 +769,58 @@ class FileService:
                 return
 
             # Update the file status to processing
-            self._update_status(
+            self._update_status_sync(
                 db=db,
-                producer=producer,
                 file_data=file_data,
                 message=f'File "{file_data.filename}" is being processed',
                 status=FileProcessingStatus.processing,
                 settings=settings,
             )
 
-            # Simulate delay like a real system
-            time.sleep(5)
-
-            # Download the file from the URL
-            file = requests.get(file_data.url)
-
-            # Get settings and initialize the Gemini client
-            settings = get_settings()
-            client = genai.Client(api_key=settings.gemini_api_key)
-
-            # Generate content using the Gemini model
-            res = client.models.generate_content(
-                model='gemini-2.0-flash',
-                contents=[
-                    'Please summarize and explain the contents of this file. What is it about and what is its purpose?',  # noqa: E501
-                    types.Part.from_bytes(data=file.content, mime_type=file_data.type),
-                ],
+            # The content may have been described already, by a retry or a copy of the file
+            description = get_cached_description(
+                file_data.content_hash, describe_model, describe_prompt_version
             )
+            if description is None:
+                description = self._find_processed_description(db, file_data)
+
+            if description is None:
+                # Simulate delay like a real system
+                time.sleep(5)
+
+                match settings.download_mode:
+                    case DownloadMode.bucket:
+                        # Read the object itself, without going through the CDN
+                        content = download_blob(
+                            settings.bucket_name,
+                            file_data.object_path,
+                            settings.download_max_size,
+                            settings.download_chunk_size,
+                            settings.download_buffer_max_size,
+                        )
+                    case DownloadMode.cdn:
+                        # Download the file from the URL, through the pooled connections
+                        file = get_http_session().get(file_data.url, timeout=get_http_timeout())
+                        file.raise_for_status()
+                        content = file.content
+
+                # The Gemini client is shared by every file of the worker
+                client = get_gemini_client()
+
+                # Generate content using the Gemini model
+                res = client.models.generate_content(
+                    model=describe_model,
+                    contents=[
+                        describe_prompt,
+                        types.Part.from_bytes(data=content, mime_type=file_data.type),
+                    ],
+                )
+                description = res.text
+
+                # Cached right away, a retry after a later failure doesn't ask the model again
+                cache_description(
+                    file_data.content_hash, describe_model, describe_prompt_version, description
+                )
 
             db.refresh(file_data)
             # If the file processing was cancelled, exit
@@ -373,15 +828,14 @@ class FileService:
                 return
 
             # Create a new file description and associate it with the file
-            file_data.description = res.text
+            file_data.description = description
 
             # Simulate delay like a real system
             time.sleep(5)
 
             # Update the file status to success
-            self._update_status(
+            self._update_status_sync(
                 db=db,
-                producer=producer,
                 file_data=file_data,
                 message=f'File "{file_data.filename}" is successfully processed',
                 status=FileProcessingStatus.success,
@@ -393,9 +847,8 @@ class FileService:
                 file_data.status = FileProcessingStatus.failed
                 db.add(file_data)
                 db.commit()
-                self._update_status(
+                self._update_status_sync(
                     db=db,
-                    producer=producer,
                     file_data=file_data,
                     message=f'An error occured when proccessing file "{file_data.filename}"',
                     status=FileProcessingStatus.failed,
@@ -403,19 +856,23 @@ class FileService:
                 )
             raise e
 
-    def retry_file(
+    async def retry_file(
         self,
         settings: Settings,
-        db: Session,
-        producer: Producer,
+        db: AsyncSession,
+        producer: ManagedProducer,
         file_id: int,
         user_id: int,
     ) -> UserFile:
         try:
-            self._check_credit(settings=settings, user_id=user_id)
+            await self._check_credit(settings=settings, user_id=user_id)
 
-            statement = select(UserFile).where(UserFile.id == file_id, UserFile.user_id == user_id)
-            result = db.exec(statement)
+            statement = (
+                select(UserFile)
+                .where(UserFile.id == file_id, UserFile.user_id == user_id)
+                .options(selectinload(UserFile.user))
+            )
+            result = await db.exec(statement)
             file_data = result.first()
             if file_data is None:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='File not found')
@@ -429,17 +886,10 @@ class FileService:
                     status_code=status.HTTP_400_BAD_REQUEST, detail='File is being proccessed'
                 )
 
-            file_event = FileUploadedEvent(
-                event_type=EventType.file_upload,
-                timestamp=file_data.created_at,
-                metadata={'version': 1, 'source': settings.server_mode},
-                payload={'file_id': file_data.id},
-            )
-            producer.produce(Topic.files.value, key=str(file_data.id), value=file_event.json())
+            await self._produce_file_event(producer, settings, file_data)
 
-            self._update_status(
+            await self._update_status(
                 db=db,
-                producer=producer,
                 file_data=file_data,
                 message=f'File "{file_data.filename}" is queuing',
                 status=FileProcessingStatus.queuing,
@@ -450,9 +900,8 @@ class FileService:
             raise e
         except Exception as e:
             with contextlib.suppress(Exception):
-                self._update_status(
+                await self._update_status(
                     db=db,
-                    producer=producer,
                     file_data=file_data,
                     message=f'File "{file_data.filename}" was failed to handle',
                     status=FileProcessingStatus.failed,
@@ -466,15 +915,15 @@ class FileService:
 
         return file_data
 
-    def cancel_file(
+    async def cancel_file(
         self,
-        db: Session,
+        db: AsyncSession,
         file_id: int,
         user_id: int,
     ) -> UserFile:
         try:
             statement = select(UserFile).where(UserFile.id == file_id, UserFile.user_id == user_id)
-            result = db.exec(statement)
+            result = await db.exec(statement)
             file_data = result.first()
             if file_data is None:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='File not found')
@@ -490,8 +939,8 @@ class FileService:
 
             file_data.status = FileProcessingStatus.cancelled
             db.add(file_data)
-            db.commit()
-            db.refresh(file_data)
+            await db.commit()
+            await db.refresh(file_data)
 
         except HTTPException as e:
             raise e
@@ -1,65 +1,111 @@
-import asyncio
 import contextlib
+from collections import defaultdict
+from collections.abc import Callable
 
 from fastapi import WebSocket, WebSocketDisconnect
 
-from app.core.cache import get_client, get_sync_client
-from app.core.config import get_settings
+from app.core.cache import get_sync_client
+from app.core.config import Settings, get_settings
 from app.core.logging import logger
+from app.core.notification_hub import notification_hub
 from app.models.user import FileProcessingStatus, User
 from app.schemas.notification import Notification, NotificationCategory, NotificationType
-from app.schemas.stream import BaseEvent, EventType, StatusUpdatedEvent
-from app.utils.mail import send_email_with_sendgrid
+from app.schemas.stream import Event, EventType, StatusUpdatedEvent, decode_event
+from app.utils.mail import EmailDigest, get_email_outbox
 
 
 class NotificationService:
-    def route_notifications(self, msg: str):
-        noti_event = BaseEvent.parse_raw(msg)
-        match noti_event.event_type:
-            case EventType.status_update:
-                self._notify_file_status_updated(msg)
-            case _:
-                raise Exception('No event type matched')
-
-    def _notify_file_status_updated(self, msg: str):
-        fileUploadedEvent = StatusUpdatedEvent.parse_raw(msg)
-        noti = Notification(
-            type=NotificationType.info,
-            category=NotificationCategory.file,
-            message=fileUploadedEvent.payload.message,
-        )
-        if fileUploadedEvent.payload.status == FileProcessingStatus.failed:
-            noti.type = NotificationType.error
+    def __init__(self):
+        # Handlers of each event type, called once per batch with the events of their type
+        self.event_handlers: dict[EventType, Callable[[list[Event]], None]] = {
+            EventType.status_update: self._notify_file_status_updated,
+        }
+        self.email_digest: EmailDigest | None = None
+
+    def close(self):
+        # Sends the emails still waiting for their digest
+        if self.email_digest is not None:
+            self.email_digest.close()
+            self.email_digest = None
+
+    def route_notifications(self, msg: bytes):
+        self.route_notifications_batch([msg])
+
+    def route_notifications_batch(self, msgs: list[bytes]):
+        events: dict[EventType, list[Event]] = defaultdict(list)
+        for msg in msgs:
+            try:
+                noti_event = decode_event(msg)
+                if noti_event.event_type not in self.event_handlers:
+                    raise Exception('No event type matched')
+                events[noti_event.event_type].append(noti_event)
+            except Exception as e:
+                logger.error(f'Error routing notification: {e}')
 
+        for event_type, typed_events in events.items():
+            self.event_handlers[event_type](typed_events)
+
+    def _notify_file_status_updated(self, events: list[StatusUpdatedEvent]):
+        # Push all in-app notifications of the batch in a single round-trip
         with contextlib.suppress(Exception):
             r = get_sync_client()
-            r.publish(channel=f'noti:{fileUploadedEvent.payload.user_id}', message=noti.json())
-
-        if fileUploadedEvent.payload.email is not None and fileUploadedEvent.payload.status in [
-            FileProcessingStatus.success,
-            FileProcessingStatus.failed,
-        ]:
-            settings = get_settings()
-            send_email_with_sendgrid(
-                api_key=settings.sendgrid_api_key,
-                from_email=settings.source_email,
-                to_emails=[fileUploadedEvent.payload.email],
-                subject='Your file processing has finished',
-                content=f'<p>{fileUploadedEvent.payload.message}</p>',
+            pipe = r.pipeline(transaction=False)
+            for event in events:
+                noti = Notification(
+                    type=NotificationType.info,
+                    category=NotificationCategory.file,
+                    message=event.payload.message,
+                    file_id=event.payload.file_id,
+                )
+                if event.payload.status == FileProcessingStatus.failed:
+                    noti.type = NotificationType.error
+
+                pipe.publish(channel=f'noti:{event.payload.user_id}', message=noti.json())
+            pipe.execute()
+
+        settings = get_settings()
+        for event in events:
+            if event.payload.email is not None and event.payload.status in [
+                FileProcessingStatus.success,
+                FileProcessingStatus.failed,
+            ]:
+                if settings.email_digest_window_ms > 0:
+                    self._get_email_digest(settings).add(event.payload.email, event)
+                else:
+                    self._send_status_email(event.payload.email, [event])
+
+    def _get_email_digest(self, settings: Settings):
+        if self.email_digest is None:
+            self.email_digest = EmailDigest(
+                self._send_status_email, settings.email_digest_window_ms
             )
+        return self.email_digest
+
+    def _send_status_email(self, to_email: str, events: list[StatusUpdatedEvent]):
+        # Queued to the outbox, the consumer never waits on SendGrid
+        if len(events) == 1:
+            content = f'<p>{events[0].payload.message}</p>'
+        else:
+            failed_count = sum(
+                event.payload.status == FileProcessingStatus.failed for event in events
+            )
+            messages = ''.join(f'<li>{event.payload.message}</li>' for event in events)
+            content = (
+                f'<p>{len(events)} of your files have finished processing,'
+                f' {failed_count} failed:</p><ul>{messages}</ul>'
+            )
+
+        get_email_outbox().send(
+            to_email=to_email,
+            subject='Your file processing has finished',
+            content=content,
+        )
 
     async def push_notifications(self, websocket: WebSocket, user: User):
         await websocket.accept()
         logger.debug(f'"{user.full_name or "An user"}" has joined')
 
-        async def handler(msg):
-            await websocket.send_text(msg['data'])
-
-        r = get_client()
-        p = r.pubsub()
-
-        await p.subscribe(**{f'noti:{user.id}': handler})
-        task = asyncio.create_task(p.run())
+        connection = notification_hub.register(websocket, user.id)
 
         try:
             while True:
@@ -68,9 +114,7 @@ class NotificationService:
         except WebSocketDisconnect:
             logger.debug(f'"{user.full_name or "An user"}" has left')
         finally:
-            task.cancel()
-            await p.unsubscribe(str(user.id))
-            await p.close()
+            await notification_hub.unregister(connection)
 
 
 notification_service = NotificationService()
@@ -4,26 +4,44 @@ from uuid import uuid4
 
 from fastapi import BackgroundTasks, HTTPException, status
 from sqlalchemy.exc import IntegrityError
-from sqlmodel import Session, not_, select
+from sqlmodel import not_, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
 
+from app.core.auth_cache import (
+    cache_auth_session,
+    get_cached_auth_session,
+    invalidate_auth_session,
+    invalidate_user_sessions,
+)
 from app.core.config import Settings
-from app.core.security import get_password_hash, verify_password
+from app.core.security import check_password, hash_password
 from app.models.user import AuthSession, EmailVerificationStatus, User
 from app.schemas.user import CreateUserData, UpdateUserData
 from app.utils.mail import send_email_with_sendgrid
 
 
 class UserService:
-    def get_user(self, db: Session, username: str) -> User | None:
+    async def get_user(self, db: AsyncSession, username: str) -> User | None:
         statement = select(User).where(User.username == username)
-        results = db.exec(statement)
+        results = await db.exec(statement)
 
         return results.first()
 
-    def get_user_with_auth_session(
-        self, db: Session, username: str, auth_session_id: uuid.UUID
+    async def get_user_with_auth_session(
+        self, db: AsyncSession, username: str, auth_session_id: uuid.UUID
     ) -> tuple[User, AuthSession] | None:
+        cached = await get_cached_auth_session(auth_session_id)
+        if cached is not None:
+            user, auth_session = cached
+            # Ended sessions are invalidated, expiry is checked in case the clock moved past it
+            if (
+                user.username == username
+                and auth_session.expires_date > datetime.now(UTC)
+                and not auth_session.is_ended
+            ):
+                return user, auth_session
+
         statement = (
             select(User, AuthSession)
             .join(AuthSession)
@@ -34,33 +52,39 @@ class UserService:
                 not_(AuthSession.is_ended),
             )
         )
-        results = db.exec(statement)
+        results = await db.exec(statement)
+        user_auth_session = results.first()
 
-        return results.first()
+        if user_auth_session is not None:
+            await cache_auth_session(*user_auth_session)
+
+        return user_auth_session
 
-    def authenticate_user(self, db: Session, username: str, password: str) -> User | None:
-        user = self.get_user(db, username)
+    async def authenticate_user(
+        self, db: AsyncSession, username: str, password: str
+    ) -> User | None:
+        user = await self.get_user(db, username)
 
         if user is None:
             return None
 
-        if not verify_password(password, user.hashed_password):
+        if not await check_password(password, user.hashed_password):
             return None
 
         return user
 
-    def create_user(self, db: Session, user: CreateUserData):
+    async def create_user(self, db: AsyncSession, user: CreateUserData):
         db_user = User(
             **vars(user),
-            hashed_password=get_password_hash(user.password),
+            hashed_password=await hash_password(user.password),
         )
         db.add(db_user)
         try:
-            db.commit()
-            db.refresh(db_user)
+            await db.commit()
+            await db.refresh(db_user)
             return db_user
         except IntegrityError as err:
-            db.rollback()
+            await db.rollback()
 
             err_msg = str(err.orig)
 
@@ -74,7 +98,7 @@ class UserService:
                     status_code=status.HTTP_400_BAD_REQUEST, detail='Email is already registered'
                 ) from err
 
-    def update_user(self, db: Session, user: UpdateUserData, current_user: User):
+    async def update_user(self, db: AsyncSession, user: UpdateUserData, current_user: User):
         if user.username != current_user.username:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -82,7 +106,7 @@ class UserService:
             )
 
         if user.password is not None:
-            current_user.hashed_password = get_password_hash(user.password)
+            current_user.hashed_password = await hash_password(user.password)
             current_user.password_reset_token = None
 
         if user.full_name is not None:
@@ -104,10 +128,11 @@ class UserService:
 
         db.add(current_user)
         try:
-            db.commit()
-            db.refresh(current_user)
+            await db.commit()
+            await db.refresh(current_user)
+            await invalidate_user_sessions(current_user.id)
         except IntegrityError as err:
-            db.rollback()
+            await db.rollback()
 
             err_msg = str(err.orig)
 
@@ -116,8 +141,12 @@ class UserService:
                     status_code=status.HTTP_400_BAD_REQUEST, detail='Email is already registered'
                 ) from err
 
-    def send_verification_email(
-        self, db: Session, settings: Settings, current_user: User, background_tasks: BackgroundTasks
+    async def send_verification_email(
+        self,
+        db: AsyncSession,
+        settings: Settings,
+        current_user: User,
+        background_tasks: BackgroundTasks,
     ):
         if current_user.email is None:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User has no email')
@@ -127,13 +156,16 @@ class UserService:
                 status_code=status.HTTP_400_BAD_REQUEST, detail='User has already been verified'
             )
 
+        # The token isn't cached with the current user
+        db.add(current_user)
+        await db.refresh(current_user, ['email_verification_token'])
         if current_user.email_verification_token is None:
             user_to_update = UpdateUserData(username=current_user.username)
 
             user_to_update.email_verification_token = str(uuid4())
             user_to_update.email_verification_status = EmailVerificationStatus.verifying
 
-            self.update_user(db, user=user_to_update, current_user=current_user)
+            await self.update_user(db, user=user_to_update, current_user=current_user)
 
         verify_link = (
             f'{settings.frontend_url}verify-email?token={current_user.email_verification_token}'
@@ -149,9 +181,9 @@ class UserService:
             content=content,
         )
 
-    def verify_email(self, token: str, db: Session):
+    async def verify_email(self, token: str, db: AsyncSession):
         statement = select(User).where(User.email_verification_token == token)
-        results = db.exec(statement)
+        results = await db.exec(statement)
         user = results.first()
 
         if user is None:
@@ -170,15 +202,15 @@ class UserService:
         user_to_update = UpdateUserData(username=user.username)
         user_to_update.email_verification_status = EmailVerificationStatus.verified
 
-        self.update_user(db, user=user_to_update, current_user=user)
+        await self.update_user(db, user=user_to_update, current_user=user)
 
         return user
 
-    def send_reset_password_email(
-        self, db: Session, settings: Settings, email: str, background_tasks: BackgroundTasks
+    async def send_reset_password_email(
+        self, db: AsyncSession, settings: Settings, email: str, background_tasks: BackgroundTasks
     ):
         statement = select(User).where(User.email == email)
-        results = db.exec(statement)
+        results = await db.exec(statement)
         user = results.first()
 
         if user is None or user.email_verification_status != EmailVerificationStatus.verified:
@@ -187,7 +219,7 @@ class UserService:
 
         user_to_update = UpdateUserData(username=user.username)
         user_to_update.password_reset_token = str(uuid4())
-        self.update_user(db, user=user_to_update, current_user=user)
+        await self.update_user(db, user=user_to_update, current_user=user)
 
         verify_link = f'{settings.frontend_url}reset-password?token={user.password_reset_token}'
         content = f'<p>Click this <a href="{verify_link}">link</a> to reset password for user <b>{user.username}</b>.</p>'  # noqa: E501
@@ -201,20 +233,20 @@ class UserService:
             content=content,
         )
 
-    def reset_password(self, token: str, password: str, db: Session):
+    async def reset_password(self, token: str, password: str, db: AsyncSession):
         statement = select(User).where(User.password_reset_token == token)
-        results = db.exec(statement)
+        results = await db.exec(statement)
         user = results.first()
 
         if user is None:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Token not found')
 
         user_to_update = UpdateUserData(username=user.username, password=password)
-        self.update_user(db, user=user_to_update, current_user=user)
+        await self.update_user(db, user=user_to_update, current_user=user)
 
         return user
 
-    def create_session(self, user: User, expires_date: datetime, db: Session):
+    async def create_session(self, user: User, expires_date: datetime, db: AsyncSession):
         try:
             token_version = uuid4()
             auth_session = AuthSession(
@@ -224,8 +256,8 @@ class UserService:
             )
 
             db.add(auth_session)
-            db.commit()
-            db.refresh(auth_session)
+            await db.commit()
+            await db.refresh(auth_session)
 
             return auth_session
         except Exception as err:
@@ -233,10 +265,10 @@ class UserService:
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail='Failed to create session'
             ) from err
 
-    def update_session(
+    async def update_session(
         self,
         auth_session: AuthSession,
-        db: Session,
+        db: AsyncSession,
         expires_date: datetime | None = None,
         is_ended: bool = False,
     ):
@@ -252,8 +284,9 @@ class UserService:
                 auth_session.token_version = token_version
 
             db.add(auth_session)
-            db.commit()
-            db.refresh(auth_session)
+            await db.commit()
+            await db.refresh(auth_session)
+            await invalidate_auth_session(auth_session.id)
         except Exception as err:
             raise HTTPException(
                 status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail='Failed to update session'
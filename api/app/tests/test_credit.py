@@ -0,0 +1,77 @@
+from datetime import UTC, datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from app.core import credit
+from app.core.credit import consume_credit, load_scripts, peek_credit, release_credit
+
+
+@pytest.fixture
+def mock_redis(mocker: MockerFixture):
+    """Fixture to mock the async Redis client with fresh scripts"""
+    mocker.patch('app.core.credit.consume_credit_script', None)
+    mocker.patch('app.core.credit.peek_credit_script', None)
+    mocker.patch('app.core.credit.release_credit_script', None)
+
+    client = MagicMock()
+    client.register_script.side_effect = lambda script: AsyncMock(script=script)
+    client.script_load = AsyncMock(return_value='sha')
+    mocker.patch('app.core.credit.get_client', return_value=client)
+    return client
+
+
+@pytest.mark.asyncio
+async def test_scripts_are_loaded_once(mock_redis):
+    await load_scripts()
+    credit.peek_credit_script.return_value = [0, -2]
+    await consume_credit(user_id=1, limit=5, period=3600)
+    await peek_credit(user_id=1)
+    await consume_credit(user_id=1, limit=5, period=3600)
+
+    assert mock_redis.register_script.call_count == 3
+    assert mock_redis.script_load.await_count == 3
+    assert credit.consume_credit_script.sha == 'sha'
+
+
+@pytest.mark.asyncio
+async def test_consume_credit(mock_redis):
+    await load_scripts()
+
+    credit.consume_credit_script.return_value = 1
+    assert await consume_credit(user_id=1, limit=5, period=3600)
+    credit.consume_credit_script.assert_awaited_with(keys=['credit:file:1'], args=[5, 3600, 1])
+
+    credit.consume_credit_script.return_value = 0
+    assert not await consume_credit(user_id=1, limit=5, period=3600)
+
+    # Several credits are reserved by a single script call
+    credit.consume_credit_script.return_value = 1
+    assert await consume_credit(user_id=1, limit=5, period=3600, amount=3)
+    credit.consume_credit_script.assert_awaited_with(keys=['credit:file:1'], args=[5, 3600, 3])
+
+
+@pytest.mark.asyncio
+async def test_peek_credit(mock_redis):
+    await load_scripts()
+
+    credit.peek_credit_script.return_value = [0, -2]
+    assert await peek_credit(user_id=1) == (0, None)
+
+    credit.peek_credit_script.return_value = [3, 600]
+    used_credit, credit_timestamp = await peek_credit(user_id=1)
+    expected_timestamp = datetime.now(UTC) + timedelta(seconds=600)
+
+    # Both values come from a single script call
+    credit.peek_credit_script.assert_awaited_with(keys=['credit:file:1'])
+    assert used_credit == 3
+    assert abs(credit_timestamp - expected_timestamp) < timedelta(seconds=5)
+
+
+@pytest.mark.asyncio
+async def test_release_credit(mock_redis):
+    await load_scripts()
+
+    await release_credit(user_id=1, amount=3)
+    credit.release_credit_script.assert_awaited_once_with(keys=['credit:file:1'], args=[3])
@@ -1,27 +1,47 @@
 from datetime import UTC, datetime, timedelta
+from pathlib import Path
 from uuid import uuid4
 
 import jwt
 import pytest
+import pytest_asyncio
 from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import Session, SQLModel, create_engine
-from sqlmodel.pool import StaticPool
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.api.dependencies import get_current_user
 from app.core.config import Settings, get_settings
 from app.models.user import AuthSession, User
 
 
+@pytest.fixture(name='db_path')
+def db_path_fixture(tmp_path: Path):
+    yield tmp_path / 'test.db'
+
+
 @pytest.fixture(name='session')
-def session_fixture():
+def session_fixture(db_path: Path):
+    # Test data is written synchronously and read by the app through an async session,
+    # both engines share the same database file
     engine = create_engine(
-        'sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool
+        f'sqlite:///{db_path}',
+        connect_args={'check_same_thread': False},
+        isolation_level='AUTOCOMMIT',
     )
     SQLModel.metadata.create_all(engine)
     with Session(engine) as session:
         yield session
 
 
+@pytest_asyncio.fixture(name='async_session')
+async def async_session_fixture(db_path: Path, session: Session):
+    engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}')
+    async with AsyncSession(engine, expire_on_commit=False) as async_session:
+        yield async_session
+    await engine.dispose()
+
+
 @pytest.fixture(name='settings')
 def settings_fixture():
     settings = get_settings()
@@ -29,7 +49,7 @@ def settings_fixture():
 
 
 @pytest.mark.asyncio
-async def test_get_current_user(session: Session, settings: Settings):
+async def test_get_current_user(session: Session, async_session: AsyncSession, settings: Settings):
     token_version = uuid4()
     auth_session = AuthSession(
         expires_date=datetime.now(UTC) + timedelta(hours=1),
@@ -52,13 +72,15 @@ async def test_get_current_user(session: Session, settings: Settings):
     encoded_jwt = jwt.encode(
         to_encode, settings.auth_token_secret_key, algorithm=settings.auth_token_algorithm
     )
-    user = await get_current_user(encoded_jwt, session, settings)
+    user = await get_current_user(encoded_jwt, async_session, settings)
 
     assert user[0].username == 'johndoe'
 
 
 @pytest.mark.asyncio
-async def test_get_current_user_not_found(session: Session, settings: Settings):
+async def test_get_current_user_not_found(
+    session: Session, async_session: AsyncSession, settings: Settings
+):
     token_version = uuid4()
     auth_session = AuthSession(
         expires_date=datetime.now(UTC) + timedelta(hours=1),
@@ -83,14 +105,16 @@ async def test_get_current_user_not_found(session: Session, settings: Settings):
     )
 
     with pytest.raises(HTTPException) as excinfo:
-        await get_current_user(encoded_jwt, session, settings)
+        await get_current_user(encoded_jwt, async_session, settings)
 
     assert excinfo.value.status_code == 401
     assert excinfo.value.detail == 'Could not validate credentials'
 
 
 @pytest.mark.asyncio
-async def test_get_current_user_expired_token(session: Session, settings: Settings):
+async def test_get_current_user_expired_token(
+    session: Session, async_session: AsyncSession, settings: Settings
+):
     token_version = uuid4()
     auth_session = AuthSession(
         expires_date=datetime.now(UTC) + timedelta(hours=1),
@@ -115,14 +139,16 @@ async def test_get_current_user_expired_token(session: Session, settings: Settin
     )
 
     with pytest.raises(HTTPException) as excinfo:
-        await get_current_user(encoded_jwt, session, settings)
+        await get_current_user(encoded_jwt, async_session, settings)
 
     assert excinfo.value.status_code == 401
     assert excinfo.value.detail == 'Could not validate credentials'
 
 
 @pytest.mark.asyncio
-async def test_get_current_user_invalid_credentials(session: Session, settings: Settings):
+async def test_get_current_user_invalid_credentials(
+    session: Session, async_session: AsyncSession, settings: Settings
+):
     token_version = uuid4()
     auth_session = AuthSession(
         expires_date=datetime.now(UTC) + timedelta(hours=1),
@@ -146,7 +172,7 @@ async def test_get_current_user_invalid_credentials(session: Session, settings:
     )
 
     with pytest.raises(HTTPException) as excinfo:
-        await get_current_user(encoded_jwt, session, settings)
+        await get_current_user(encoded_jwt, async_session, settings)
 
     assert excinfo.value.status_code == 401
     assert excinfo.value.detail == 'Could not validate credentials'
@@ -0,0 +1,79 @@
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from app.core import describe_cache
+from app.core.config import get_settings
+
+
+@pytest.fixture(name='redis')
+def redis_fixture(mocker: MockerFixture):
+    mocker.patch('app.core.describe_cache.get_description_script', None)
+    mocker.patch('app.core.describe_cache.cache_description_script', None)
+    redis = MagicMock()
+    mocker.patch('app.core.describe_cache.get_sync_client', return_value=redis)
+    yield redis
+
+
+def test_get_cached_description(redis: MagicMock):
+    get_script = MagicMock(return_value='A summary')
+    redis.register_script.side_effect = [get_script, MagicMock()]
+
+    description = describe_cache.get_cached_description('abc', 'gemini-2.0-flash', 1)
+
+    assert description == 'A summary'
+    keys = get_script.call_args.kwargs['keys']
+    assert keys == ['describe:gemini-2.0-flash:1:abc', 'describe:lru', 'describe:stats']
+
+
+def test_get_cached_description_without_redis(redis: MagicMock):
+    redis.register_script.return_value.side_effect = ConnectionError('Redis is down')
+
+    # Redis errors are misses, the file is described by the model
+    assert describe_cache.get_cached_description('abc', 'gemini-2.0-flash', 1) is None
+    assert describe_cache.get_cached_description(None, 'gemini-2.0-flash', 1) is None
+
+
+def test_cache_description(redis: MagicMock, mocker: MockerFixture):
+    settings = get_settings()
+    mocker.patch.object(settings, 'describe_cache_max_entry_size', 10)
+    cache_script = MagicMock(return_value=0)
+    redis.register_script.side_effect = [MagicMock(), cache_script]
+
+    describe_cache.cache_description('abc', 'gemini-2.0-flash', 1, 'A summary')
+    describe_cache.cache_description('abc', 'gemini-2.0-flash', 1, 'A much longer summary')
+    describe_cache.cache_description(None, 'gemini-2.0-flash', 1, 'A summary')
+
+    # Only the description that fits is stored, under the size budget of the whole cache
+    cache_script.assert_called_once()
+    description, _, size = cache_script.call_args.kwargs['args']
+    assert description == 'A summary'
+    assert size == settings.describe_cache_size
+
+
+def test_cache_description_without_description(redis: MagicMock):
+    redis.register_script.side_effect = ConnectionError('Redis is down')
+
+    # Blocked responses have no text, nothing is cached and nothing is raised
+    describe_cache.cache_description('abc', 'gemini-2.0-flash', 1, None)
+    redis.register_script.assert_not_called()
+
+
+def test_cache_description_without_redis(redis: MagicMock):
+    redis.register_script.side_effect = ConnectionError('Redis is down')
+
+    # Caching never fails the processing of the file
+    describe_cache.cache_description('abc', 'gemini-2.0-flash', 1, 'A summary')
+
+
+def test_describe_cache_stats(redis: MagicMock):
+    redis.pipeline.return_value.execute.return_value = [{'hits': '3', 'misses': '1'}, '42', 2]
+
+    assert describe_cache.get_describe_cache_stats() == {
+        'hits': 3,
+        'misses': 1,
+        'hit_ratio': 0.75,
+        'size': 42,
+        'entries': 2,
+    }
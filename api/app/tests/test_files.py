@@ -0,0 +1,936 @@
+import asyncio
+import hashlib
+import io
+import threading
+import time
+import tracemalloc
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from tempfile import SpooledTemporaryFile
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+import pytest_asyncio
+from fastapi import BackgroundTasks, HTTPException, UploadFile
+from fastapi.testclient import TestClient
+from pytest_mock import MockerFixture
+from sqlalchemy import Insert, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.datastructures import Headers
+
+from app.api.dependencies import get_user_only
+from app.core.config import DownloadMode, ServerMode, Settings, get_settings
+from app.core.database import get_async_session
+from app.core.stream import ManagedProducer
+from app.main import app
+from app.models.outbox import OutboxEvent
+from app.models.user import File as UserFile
+from app.models.user import FileProcessingStatus, User
+from app.schemas.file import SortBy, SortOrder
+from app.schemas.stream import FileUploadedEvent
+from app.services.file_service import file_service
+from app.utils import upload
+
+
+class FakeBlob:
+    def __init__(self, bucket: 'FakeBucket', name: str, chunk_size: int | None = None):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = chunk_size
+
+    def upload_from_file(self, file_obj, content_type=None, **kwargs):
+        if self.name in self.bucket.failing_objects:
+            raise ConnectionError('Upload failed')
+
+        # Mimic a resumable upload, only one chunk is held in memory at a time
+        size = 0
+        while chunk := file_obj.read(self.chunk_size or -1):
+            size += len(chunk)
+        self.bucket.objects[self.name] = size
+
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        self.bucket.objects[self.name] = len(data)
+
+    def open(self, mode='rb', chunk_size=None, **kwargs):
+        self.bucket.reads.append((self.name, chunk_size))
+        return io.BytesIO(self.bucket.contents[self.name])
+
+
+class FakeBucket:
+    def __init__(self):
+        self.objects: dict[str, int] = {}
+        self.contents: dict[str, bytes] = {}
+        self.reads: list[tuple[str, int | None]] = []
+        self.failing_objects: set[str] = set()
+
+    def blob(self, name: str, chunk_size: int | None = None):
+        return FakeBlob(self, name, chunk_size)
+
+
+@pytest.fixture(name='db_path')
+def db_path_fixture(tmp_path: Path):
+    yield tmp_path / 'test.db'
+
+
+@pytest.fixture(name='session')
+def session_fixture(db_path: Path):
+    # Test data is written synchronously and read by the app through an async session,
+    # both engines share the same database file
+    engine = create_engine(
+        f'sqlite:///{db_path}',
+        connect_args={'check_same_thread': False},
+        isolation_level='AUTOCOMMIT',
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name='settings')
+def settings_fixture():
+    settings = get_settings()
+    yield settings
+
+
+@pytest.fixture(name='bucket')
+def bucket_fixture(mocker: MockerFixture):
+    bucket = FakeBucket()
+    mocker.patch('app.utils.upload.storage_client', None)
+    mocker.patch.dict('app.utils.upload.buckets', clear=True)
+    mocker.patch('app.utils.upload.google.auth.default', return_value=(MagicMock(), 'project'))
+    storage_client = mocker.patch('app.utils.upload.storage.Client')
+    storage_client.return_value.bucket.return_value = bucket
+    yield bucket
+
+
+@pytest_asyncio.fixture(name='worker')
+async def worker_fixture(db_path: Path, session: Session, mocker: MockerFixture):
+    # Skip the simulated delay and run the background task against the test database
+    engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}')
+    async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    mocker.patch('app.services.file_service.asyncio.sleep', new=AsyncMock())
+    mocker.patch('app.services.file_service.async_session_maker', async_session_maker)
+    mocker.patch(
+        'app.services.file_service.get_producer', return_value=MagicMock(spec=ManagedProducer)
+    )
+    yield
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture(name='async_session')
+async def async_session_fixture(db_path: Path, session: Session, mocker: MockerFixture):
+    mocker.patch('app.services.file_service.peek_credit', new=AsyncMock(return_value=(0, None)))
+    engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}')
+    async with AsyncSession(engine, expire_on_commit=False) as async_session:
+        yield async_session
+    await engine.dispose()
+
+
+def create_files(session: Session, count: int, size: int) -> list[UserFile]:
+    user = User(username='johndoe', hashed_password='abc')
+    files = [
+        UserFile(
+            filename=f'file-{i}.bin',
+            status=FileProcessingStatus.pending,
+            size=size,
+            type='application/octet-stream',
+            url=f'http://cdn.example.com/file-{i}.bin',
+            created_at=datetime.now(UTC),
+            object_path=f'1/{i}/file-{i}.bin',
+            user=user,
+        )
+        for i in range(count)
+    ]
+    session.add_all(files)
+    session.commit()
+    for file in files:
+        session.refresh(file)
+    return files
+
+
+def create_upload(data: bytes, filename: str = 'copy.bin'):
+    return UploadFile(
+        file=io.BytesIO(data),
+        size=len(data),
+        filename=filename,
+        headers=Headers({'content-type': 'application/octet-stream'}),
+    )
+
+
+def mark_processed(session: Session, file: UserFile, data: bytes, description: str):
+    file.status = FileProcessingStatus.success
+    file.content_hash = hashlib.sha256(data).hexdigest()
+    file.description = description
+    session.add(file)
+    session.commit()
+
+
+def create_spooled_file(size: int, chunk_size: int = 64 * 1024):
+    # Same as the spooled files of multipart forms, rolled over to disk after 1MB
+    spooled_file = SpooledTemporaryFile(max_size=1024 * 1024)  # noqa: SIM115
+    chunk = b'x' * chunk_size
+    for _ in range(size // chunk_size):
+        spooled_file.write(chunk)
+    spooled_file.seek(0)
+    return spooled_file
+
+
+@pytest.mark.asyncio
+async def test_upload_files_streaming_memory_ceiling(
+    session: Session,
+    settings: Settings,
+    bucket: FakeBucket,
+    worker: None,
+    mocker: MockerFixture,
+):
+    chunk_size = 256 * 1024
+    file_size = 5 * 1024 * 1024
+    file_count = 20
+    mocker.patch.object(settings, 'upload_chunk_size', chunk_size)
+
+    files = create_files(session, file_count, file_size)
+    sources = [create_spooled_file(file_size) for _ in files]
+
+    tracemalloc.start()
+    try:
+        await asyncio.gather(
+            *[
+                file_service._upload_file(file.id, source)
+                for file, source in zip(files, sources, strict=True)
+            ]
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # Every file is uploaded completely
+    assert len(bucket.objects) == file_count
+    assert all(size == file_size for size in bucket.objects.values())
+    assert all(source.closed for source in sources)
+
+    # At most one chunk per upload is held in memory, far below the 100MB of payloads
+    assert peak < file_count * chunk_size * 2
+
+    statuses = session.exec(select(UserFile.status)).all()
+    assert all(status == FileProcessingStatus.queuing for status in statuses)
+
+
+@pytest.mark.asyncio
+async def test_upload_file_from_memory(session: Session, bucket: FakeBucket, worker: None):
+    files = create_files(session, 1, 1024)
+
+    await file_service._upload_file(files[0].id, b'x' * 1024)
+
+    assert bucket.objects == {files[0].object_path: 1024}
+    session.refresh(files[0])
+    assert files[0].status == FileProcessingStatus.queuing
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('sort_by', list(SortBy))
+@pytest.mark.parametrize('sort_order', list(SortOrder))
+async def test_list_files_with_cursor(
+    session: Session,
+    async_session: AsyncSession,
+    sort_by: SortBy,
+    sort_order: SortOrder,
+):
+    files = create_files(session, 7, 1024)
+    # Duplicated sort keys have to be ordered by id to not skip or repeat files
+    created_at = datetime.now(UTC)
+    for i, file in enumerate(files):
+        file.filename = f'file-{i % 3}.bin'
+        file.status = [FileProcessingStatus.pending, FileProcessingStatus.success][i % 2]
+        file.created_at = created_at - timedelta(minutes=i // 2)
+        session.add(file)
+    session.commit()
+
+    expected, count, *_ = await file_service.list_files(
+        db=async_session, user_id=1, page_size=50, sort_by=sort_by, sort_order=sort_order
+    )
+    assert count == 7
+
+    listed: list[UserFile] = []
+    cursor = None
+    while True:
+        page, count, cursor, *_ = await file_service.list_files(
+            db=async_session,
+            user_id=1,
+            page_size=3,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            cursor=cursor,
+            include_count=False,
+        )
+        assert count is None
+        listed.extend(page)
+        if cursor is None:
+            break
+
+    assert [file.id for file in listed] == [file.id for file in expected]
+
+
+def test_list_files_route_with_cursor(db_path: Path, session: Session, mocker: MockerFixture):
+    files = create_files(session, 3, 1024)
+    engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}', poolclass=NullPool)
+    async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def get_async_session_override():
+        async with async_session_maker() as async_session:
+            yield async_session
+
+    app.dependency_overrides[get_async_session] = get_async_session_override
+    app.dependency_overrides[get_user_only] = lambda: files[0].user
+    mocker.patch('app.services.file_service.peek_credit', new=AsyncMock(return_value=(0, None)))
+    try:
+        client = TestClient(app)
+        first_page = client.get('/files/', params={'page_size': 2}).json()
+        next_page = client.get(
+            '/files/', params={'page_size': 2, 'cursor': first_page['next_cursor']}
+        ).json()
+    finally:
+        app.dependency_overrides.clear()
+
+    # A seek page has no page number
+    assert first_page['page'] == 1
+    assert next_page['page'] is None
+    assert [file['id'] for file in next_page['results']] == [files[2].id]
+
+
+@pytest.mark.asyncio
+async def test_list_files_with_invalid_cursor(session: Session, async_session: AsyncSession):
+    create_files(session, 4, 1024)
+    _, _, cursor, *_ = await file_service.list_files(
+        db=async_session, user_id=1, page_size=2, sort_by=SortBy.name
+    )
+
+    with pytest.raises(HTTPException) as exc_info:
+        await file_service.list_files(db=async_session, user_id=1, cursor='not-a-cursor')
+    assert exc_info.value.status_code == 400
+
+    # The cursor was created for another ordering
+    with pytest.raises(HTTPException) as exc_info:
+        await file_service.list_files(
+            db=async_session, user_id=1, sort_by=SortBy.created_at, cursor=cursor
+        )
+    assert exc_info.value.status_code == 400
+
+
+def test_process_files_reuses_clients(session: Session, settings: Settings, mocker: MockerFixture):
+    files = create_files(session, 2, 1024)
+    mocker.patch.object(settings, 'download_mode', DownloadMode.cdn)
+    mocker.patch('app.services.file_service.time.sleep')
+    mocker.patch('app.services.file_service.get_session', side_effect=lambda: iter([session]))
+    mocker.patch(
+        'app.services.file_service.get_producer', return_value=MagicMock(spec=ManagedProducer)
+    )
+    mocker.patch('app.services.file_service.get_cached_description', return_value=None)
+    mocker.patch('app.services.file_service.cache_description')
+    mocker.patch('app.utils.clients.gemini_client', None)
+    mocker.patch('app.utils.clients.http_session', None)
+    gemini_client = mocker.patch('app.utils.clients.genai.Client')
+    gemini_client.return_value.models.generate_content.return_value.text = 'A summary'
+    http_session = mocker.patch('app.utils.clients.requests.Session')
+    http_session.return_value.get.return_value.content = b'x' * 1024
+
+    for file in files:
+        file_service.process_file(
+            FileUploadedEvent(
+                timestamp=datetime.now(UTC),
+                metadata={'version': 1, 'source': ServerMode.api_server},
+                payload={'file_id': file.id},
+            )
+            .model_dump_json()
+            .encode()
+        )
+
+    # Both files are processed with the same clients, downloads have a timeout
+    gemini_client.assert_called_once()
+    http_session.assert_called_once()
+    assert all('timeout' in call.kwargs for call in http_session.return_value.get.call_args_list)
+    for file in files:
+        session.refresh(file)
+        assert file.status == FileProcessingStatus.success
+        assert file.description == 'A summary'
+
+
+@pytest.mark.asyncio
+async def test_upload_file_copy_of_processed_file(
+    session: Session,
+    async_session: AsyncSession,
+    settings: Settings,
+    mocker: MockerFixture,
+):
+    data = b'x' * 1024
+    files = create_files(session, 1, len(data))
+    mark_processed(session, files[0], data, 'A summary')
+    consume_credit = mocker.patch('app.services.file_service.consume_credit', new=AsyncMock())
+    background_tasks = BackgroundTasks()
+
+    file = await file_service.upload_file(
+        user_id=1,
+        settings=settings,
+        db=async_session,
+        background_tasks=background_tasks,
+        file=create_upload(data),
+    )
+
+    # The copy is finished at once, it shares the blob and isn't charged
+    assert file.status == FileProcessingStatus.success
+    assert file.description == 'A summary'
+    assert file.object_path == files[0].object_path
+    assert file.content_hash == files[0].content_hash
+    assert not background_tasks.tasks
+    consume_credit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_upload_file_new_content(
+    session: Session,
+    async_session: AsyncSession,
+    settings: Settings,
+    mocker: MockerFixture,
+):
+    files = create_files(session, 1, 1024)
+    mark_processed(session, files[0], b'x' * 1024, 'A summary')
+    mocker.patch('app.services.file_service.consume_credit', new=AsyncMock(return_value=True))
+    background_tasks = BackgroundTasks()
+
+    data = b'y' * 1024
+    file = await file_service.upload_file(
+        user_id=1,
+        settings=settings,
+        db=async_session,
+        background_tasks=background_tasks,
+        file=create_upload(data),
+    )
+
+    assert file.status == FileProcessingStatus.pending
+    assert file.content_hash == hashlib.sha256(data).hexdigest()
+    assert file.object_path != files[0].object_path
+    assert len(background_tasks.tasks) == 1
+
+
+@pytest.mark.asyncio
+async def test_upload_file_failure_leaves_form_file_to_the_request(
+    session: Session,
+    async_session: AsyncSession,
+    settings: Settings,
+    mocker: MockerFixture,
+):
+    create_files(session, 1, 1024)
+    mocker.patch('app.services.file_service.consume_credit', new=AsyncMock(return_value=True))
+    mocker.patch.object(
+        file_service, '_update_status', side_effect=Exception('Database unavailable')
+    )
+    background_tasks = BackgroundTasks()
+    upload = create_upload(b'y' * 1024)
+    form_file = upload.file
+
+    with pytest.raises(HTTPException) as exc_info:
+        await file_service.upload_file(
+            user_id=1,
+            settings=settings,
+            db=async_session,
+            background_tasks=background_tasks,
+            file=upload,
+        )
+
+    # Background tasks don't run after an error, the form file is closed with the request
+    assert exc_info.value.status_code == 500
+    assert not background_tasks.tasks
+    assert upload.file is form_file
+
+
+def test_process_file_reuses_processed_description(session: Session, mocker: MockerFixture):
+    data = b'x' * 1024
+    processed, copy = create_files(session, 2, len(data))
+    mark_processed(session, processed, data, 'A summary')
+    copy.content_hash = processed.content_hash
+    session.add(copy)
+    session.commit()
+    mocker.patch('app.services.file_service.time.sleep')
+    mocker.patch('app.services.file_service.get_session', side_effect=lambda: iter([session]))
+    mocker.patch(
+        'app.services.file_service.get_producer', return_value=MagicMock(spec=ManagedProducer)
+    )
+    mocker.patch('app.services.file_service.get_cached_description', return_value=None)
+    get_gemini_client = mocker.patch('app.services.file_service.get_gemini_client')
+    get_http_session = mocker.patch('app.services.file_service.get_http_session')
+
+    file_service.process_file(
+        FileUploadedEvent(
+            timestamp=datetime.now(UTC),
+            metadata={'version': 1, 'source': ServerMode.api_server},
+            payload={'file_id': copy.id},
+        )
+        .model_dump_json()
+        .encode()
+    )
+
+    # Neither downloaded nor sent to the model
+    get_http_session.assert_not_called()
+    get_gemini_client.assert_not_called()
+    session.refresh(copy)
+    assert copy.status == FileProcessingStatus.success
+    assert copy.description == 'A summary'
+
+
+def test_process_file_with_cached_description(session: Session, mocker: MockerFixture):
+    data = b'x' * 1024
+    files = create_files(session, 2, len(data))
+    for file in files:
+        file.content_hash = hashlib.sha256(data).hexdigest()
+        session.add(file)
+    session.commit()
+    mocker.patch('app.services.file_service.time.sleep')
+    mocker.patch('app.services.file_service.get_session', side_effect=lambda: iter([session]))
+    cache: dict[tuple, str] = {}
+    mocker.patch(
+        'app.services.file_service.get_cached_description',
+        side_effect=lambda *key: cache.get(key),
+    )
+    mocker.patch(
+        'app.services.file_service.cache_description',
+        side_effect=lambda *key_and_description: cache.setdefault(
+            key_and_description[:-1], key_and_description[-1]
+        ),
+    )
+    get_gemini_client = mocker.patch('app.services.file_service.get_gemini_client')
+    get_gemini_client.return_value.models.generate_content.return_value.text = 'A summary'
+    mocker.patch('app.services.file_service.download_blob', return_value=data)
+
+    # The first attempt fails after the model answered
+    failures = [Exception('Database unavailable')]
+
+    def add_outbox_event(db, topic, value, key, ordering_key):
+        if key.endswith(',success') and failures:
+            raise failures.pop()
+
+    mocker.patch('app.services.file_service.add_outbox_event', side_effect=add_outbox_event)
+    event = FileUploadedEvent(
+        timestamp=datetime.now(UTC),
+        metadata={'version': 1, 'source': ServerMode.api_server},
+        payload={'file_id': files[0].id},
+    )
+    with pytest.raises(Exception, match='Database unavailable'):
+        file_service.process_file(event.model_dump_json().encode())
+
+    # Its retry and the other file are described from the cache
+    file_service.process_file(event.model_dump_json().encode())
+    event.payload.file_id = files[1].id
+    file_service.process_file(event.model_dump_json().encode())
+
+    get_gemini_client.return_value.models.generate_content.assert_called_once()
+    assert list(cache) == [(files[0].content_hash, 'gemini-2.0-flash', 1)]
+    for file in files:
+        session.refresh(file)
+        assert file.status == FileProcessingStatus.success
+        assert file.description == 'A summary'
+
+
+def test_process_file_with_blocked_response(session: Session, mocker: MockerFixture):
+    data = b'x' * 1024
+    (file,) = create_files(session, 1, len(data))
+    file.content_hash = hashlib.sha256(data).hexdigest()
+    session.add(file)
+    session.commit()
+    mocker.patch('app.services.file_service.time.sleep')
+    mocker.patch('app.services.file_service.get_session', side_effect=lambda: iter([session]))
+    mocker.patch('app.services.file_service.get_cached_description', return_value=None)
+    get_gemini_client = mocker.patch('app.services.file_service.get_gemini_client')
+    get_gemini_client.return_value.models.generate_content.return_value.text = None
+    mocker.patch('app.services.file_service.download_blob', return_value=data)
+    event = FileUploadedEvent(
+        timestamp=datetime.now(UTC),
+        metadata={'version': 1, 'source': ServerMode.api_server},
+        payload={'file_id': file.id},
+    )
+
+    file_service.process_file(event.model_dump_json().encode())
+
+    # The model gave no description, the file is still processed
+    session.refresh(file)
+    assert file.status == FileProcessingStatus.success
+    assert file.description is None
+
+
+@pytest.mark.asyncio
+async def test_delete_file_keeps_shared_blob(
+    session: Session,
+    async_session: AsyncSession,
+    settings: Settings,
+):
+    data = b'x' * 1024
+    files = create_files(session, 2, len(data))
+    for file in files:
+        mark_processed(session, file, data, 'A summary')
+        file.object_path = files[0].object_path
+        session.add(file)
+    session.commit()
+
+    background_tasks = BackgroundTasks()
+    await file_service.delete_file(
+        db=async_session,
+        settings=settings,
+        background_tasks=background_tasks,
+        user_id=1,
+        file_id=files[0].id,
+    )
+    assert not background_tasks.tasks
+
+    # The blob goes with its last file
+    await file_service.delete_file(
+        db=async_session,
+        settings=settings,
+        background_tasks=background_tasks,
+        user_id=1,
+        file_id=files[1].id,
+    )
+    assert len(background_tasks.tasks) == 1
+
+
+def test_process_file_from_bucket(
+    session: Session, settings: Settings, bucket: FakeBucket, mocker: MockerFixture
+):
+    files = create_files(session, 1, 1024)
+    bucket.contents[files[0].object_path] = b'x' * 1024
+    mocker.patch('app.services.file_service.time.sleep')
+    mocker.patch('app.services.file_service.get_session', side_effect=lambda: iter([session]))
+    mocker.patch(
+        'app.services.file_service.get_producer', return_value=MagicMock(spec=ManagedProducer)
+    )
+    mocker.patch('app.services.file_service.get_cached_description', return_value=None)
+    mocker.patch('app.services.file_service.cache_description')
+    get_gemini_client = mocker.patch('app.services.file_service.get_gemini_client')
+    get_gemini_client.return_value.models.generate_content.return_value.text = 'A summary'
+    get_http_session = mocker.patch('app.services.file_service.get_http_session')
+
+    file_service.process_file(
+        FileUploadedEvent(
+            timestamp=datetime.now(UTC),
+            metadata={'version': 1, 'source': ServerMode.api_server},
+            payload={'file_id': files[0].id},
+        )
+        .model_dump_json()
+        .encode()
+    )
+
+    # The object is read in chunks from the bucket, not from the CDN
+    get_http_session.assert_not_called()
+    assert bucket.reads == [(files[0].object_path, settings.download_chunk_size)]
+    contents = get_gemini_client.return_value.models.generate_content.call_args.kwargs['contents']
+    assert contents[1].inline_data.data == b'x' * 1024
+    session.refresh(files[0])
+    assert files[0].status == FileProcessingStatus.success
+
+
+def test_download_blob_reuses_buffer(bucket: FakeBucket, mocker: MockerFixture):
+    mocker.patch.object(upload, 'download_buffers', threading.local())
+    bucket.contents = {'large': bytes(range(256)) * 40, 'small': b'abc'}
+
+    assert upload.download_blob('bucket', 'large', 10240, 1024, 20480) == bytes(range(256)) * 40
+    buffer = upload.download_buffers.buffer
+    assert upload.download_blob('bucket', 'small', 10240, 1024, 20480) == b'abc'
+
+    # The buffer grown for the large blob is used for the next ones, it never exceeds
+    # the limit by more than the byte telling that a blob is too large
+    assert upload.download_buffers.buffer is buffer
+    assert len(buffer) == 10241
+
+    with pytest.raises(ValueError):
+        upload.download_blob('bucket', 'large', 10000, 1024, 20480)
+
+
+def test_download_blob_releases_large_buffer(bucket: FakeBucket, mocker: MockerFixture):
+    mocker.patch.object(upload, 'download_buffers', threading.local())
+    bucket.contents = {'large': bytes(range(256)) * 40, 'small': b'abc'}
+
+    assert upload.download_blob('bucket', 'small', 10240, 1024, 4096) == b'abc'
+    buffer = upload.download_buffers.buffer
+    assert upload.download_blob('bucket', 'large', 10240, 1024, 4096) == bytes(range(256)) * 40
+
+    # The buffer grown past the cap isn't kept by the thread, the next download starts small
+    assert getattr(upload.download_buffers, 'buffer', None) is None
+    assert upload.download_blob('bucket', 'small', 10240, 1024, 4096) == b'abc'
+    assert upload.download_buffers.buffer is not buffer
+    assert len(upload.download_buffers.buffer) == 1024
+
+
+@pytest.mark.asyncio
+async def test_upload_files(
+    session: Session,
+    async_session: AsyncSession,
+    settings: Settings,
+    mocker: MockerFixture,
+):
+    processed = b'x' * 1024
+    files = create_files(session, 1, len(processed))
+    mark_processed(session, files[0], processed, 'A summary')
+    consume_credit = mocker.patch(
+        'app.services.file_service.consume_credit', new=AsyncMock(return_value=True)
+    )
+    background_tasks = BackgroundTasks()
+
+    # A single statement inserts every row, in one round-trip on PostgreSQL
+    inserts: list[object] = []
+
+    def count_inserts(orm_execute_state):
+        if orm_execute_state.is_insert:
+            inserts.append(orm_execute_state.statement)
+
+    event.listen(async_session.sync_session, 'do_orm_execute', count_inserts)
+    try:
+        uploaded = await file_service.upload_files(
+            user_id=1,
+            settings=settings,
+            db=async_session,
+            background_tasks=background_tasks,
+            files=[
+                create_upload(b'a' * 1024, 'a.bin'),
+                create_upload(processed, 'copy.bin'),
+                create_upload(b'b' * 1024, 'b.bin'),
+            ],
+        )
+    finally:
+        event.remove(async_session.sync_session, 'do_orm_execute', count_inserts)
+
+    # One credit reservation for the new files
+    consume_credit.assert_awaited_once_with(
+        user_id=1, limit=settings.credit_limit, period=settings.credit_period, amount=2
+    )
+    assert len(inserts) == 1
+    assert [file.status for file in uploaded] == [
+        FileProcessingStatus.pending,
+        FileProcessingStatus.success,
+        FileProcessingStatus.pending,
+    ]
+    assert uploaded[1].object_path == files[0].object_path
+
+    # The new files are uploaded by a single background task
+    (task,) = background_tasks.tasks
+    assert [file_id for file_id, _ in task.args[0]] == [uploaded[0].id, uploaded[2].id]
+    assert len(session.exec(select(OutboxEvent)).all()) == 3
+
+
+@pytest.mark.asyncio
+async def test_upload_files_without_enough_credit(
+    session: Session,
+    async_session: AsyncSession,
+    settings: Settings,
+    mocker: MockerFixture,
+):
+    create_files(session, 1, 1024)
+    mocker.patch('app.services.file_service.consume_credit', new=AsyncMock(return_value=False))
+
+    with pytest.raises(HTTPException) as exc_info:
+        await file_service.upload_files(
+            user_id=1,
+            settings=settings,
+            db=async_session,
+            background_tasks=BackgroundTasks(),
+            files=[create_upload(b'a' * 1024, 'a.bin'), create_upload(b'b' * 1024, 'b.bin')],
+        )
+
+    # None of the files is accepted
+    assert exc_info.value.status_code == 429
+    assert len(session.exec(select(UserFile)).all()) == 1
+
+
+@pytest.mark.asyncio
+async def test_upload_files_releases_credit_on_failure(
+    session: Session,
+    async_session: AsyncSession,
+    settings: Settings,
+    mocker: MockerFixture,
+):
+    create_files(session, 1, 1024)
+    mocker.patch('app.services.file_service.consume_credit', new=AsyncMock(return_value=True))
+    release_credit = mocker.patch('app.services.file_service.release_credit', new=AsyncMock())
+    exec_statement = async_session.exec
+
+    async def exec_failing_insert(statement, *args, **kwargs):
+        if isinstance(statement, Insert):
+            raise OperationalError(str(statement), {}, Exception('Database unavailable'))
+        return await exec_statement(statement, *args, **kwargs)
+
+    mocker.patch.object(async_session, 'exec', side_effect=exec_failing_insert)
+    files = [create_upload(b'a' * 1024, 'a.bin'), create_upload(b'b' * 1024, 'b.bin')]
+    sources = [file.file for file in files]
+
+    with pytest.raises(HTTPException) as exc_info:
+        await file_service.upload_files(
+            user_id=1,
+            settings=settings,
+            db=async_session,
+            background_tasks=BackgroundTasks(),
+            files=files,
+        )
+
+    # The credits reserved for the batch are given back, the taken form files are closed
+    assert exc_info.value.status_code == 500
+    release_credit.assert_awaited_once_with(user_id=1, amount=2)
+    assert all(source.closed for source in sources)
+
+
+@pytest.mark.asyncio
+async def test_upload_files_commits_nothing_when_a_file_cannot_be_read(
+    session: Session,
+    async_session: AsyncSession,
+    settings: Settings,
+    mocker: MockerFixture,
+):
+    create_files(session, 1, 1024)
+    mocker.patch('app.services.file_service.consume_credit', new=AsyncMock(return_value=True))
+    release_credit = mocker.patch('app.services.file_service.release_credit', new=AsyncMock())
+    source = create_spooled_file(1024, chunk_size=256)
+    mocker.patch.object(
+        file_service,
+        '_take_upload_source',
+        side_effect=[source, OSError('Client disconnected')],
+    )
+
+    with pytest.raises(HTTPException) as exc_info:
+        await file_service.upload_files(
+            user_id=1,
+            settings=settings,
+            db=async_session,
+            background_tasks=BackgroundTasks(),
+            files=[create_upload(b'a' * 1024, 'a.bin'), create_upload(b'b' * 1024, 'b.bin')],
+        )
+
+    # No row is left pending without a source to upload it from
+    assert exc_info.value.status_code == 500
+    assert len(session.exec(select(UserFile)).all()) == 1
+    release_credit.assert_awaited_once_with(user_id=1, amount=2)
+    assert source.closed
+
+
+@pytest.mark.asyncio
+async def test_upload_files_in_background(
+    session: Session, bucket: FakeBucket, worker: None, mocker: MockerFixture
+):
+    files = create_files(session, 3, 1024)
+    files[1].status = FileProcessingStatus.cancelled
+    session.add(files[1])
+    session.commit()
+    bucket.failing_objects.add(files[2].object_path)
+    producer = MagicMock(spec=ManagedProducer)
+    mocker.patch('app.services.file_service.get_producer', return_value=producer)
+    sources = [create_spooled_file(1024, chunk_size=256) for _ in files]
+
+    await file_service._upload_files(
+        [(file.id, source) for file, source in zip(files, sources, strict=True)]
+    )
+
+    assert set(bucket.objects) == {files[0].object_path, files[1].object_path}
+    assert all(source.closed for source in sources)
+    # Only the files that have been uploaded are sent to the file workers
+    produced = [call.kwargs['key'] for call in producer.produce_async.call_args_list]
+    assert produced == [str(files[0].id), str(files[1].id)]
+    for file in files:
+        session.refresh(file)
+    assert [file.status for file in files] == [
+        FileProcessingStatus.queuing,
+        FileProcessingStatus.cancelled,
+        FileProcessingStatus.failed,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_upload_files_bounds_concurrent_uploads(
+    session: Session,
+    settings: Settings,
+    bucket: FakeBucket,
+    worker: None,
+    mocker: MockerFixture,
+):
+    mocker.patch.object(settings, 'storage_pool_size', 2)
+    files = create_files(session, 6, 1024)
+    mocker.patch(
+        'app.services.file_service.get_producer', return_value=MagicMock(spec=ManagedProducer)
+    )
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+    upload_from_file = FakeBlob.upload_from_file
+
+    def slow_upload_from_file(blob, file_obj, **kwargs):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.05)
+        upload_from_file(blob, file_obj, **kwargs)
+        with lock:
+            running -= 1
+
+    mocker.patch.object(FakeBlob, 'upload_from_file', slow_upload_from_file)
+
+    await file_service._upload_files(
+        [(file.id, create_spooled_file(1024, chunk_size=256)) for file in files]
+    )
+
+    # No more uploads at once than connections in the pool of the storage client
+    assert len(bucket.objects) == 6
+    assert max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_upload_files_skips_deleted_files(
+    session: Session, bucket: FakeBucket, worker: None, mocker: MockerFixture
+):
+    files = create_files(session, 2, 1024)
+    session.delete(files[1])
+    session.commit()
+    producer = MagicMock(spec=ManagedProducer)
+    mocker.patch('app.services.file_service.get_producer', return_value=producer)
+    sources = [create_spooled_file(1024, chunk_size=256) for _ in files]
+
+    await file_service._upload_files(
+        [(file.id, source) for file, source in zip(files, sources, strict=True)]
+    )
+
+    # The file deleted before the task ran doesn't fail the rest of the batch
+    assert set(bucket.objects) == {files[0].object_path}
+    assert all(source.closed for source in sources)
+    session.refresh(files[0])
+    assert files[0].status == FileProcessingStatus.queuing
+
+
+def test_upload_batch_route(db_path: Path, session: Session, mocker: MockerFixture):
+    files = create_files(session, 1, 1024)
+    engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}', poolclass=NullPool)
+    async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def get_async_session_override():
+        async with async_session_maker() as async_session:
+            yield async_session
+
+    app.dependency_overrides[get_async_session] = get_async_session_override
+    app.dependency_overrides[get_user_only] = lambda: files[0].user
+    mocker.patch('app.services.file_service.consume_credit', new=AsyncMock(return_value=True))
+    upload_files = mocker.patch.object(file_service, '_upload_files', new=AsyncMock())
+    try:
+        response = TestClient(app).post(
+            '/files/upload-batch',
+            files=[
+                ('files', ('a.bin', b'a' * 1024, 'application/octet-stream')),
+                ('files', ('empty.bin', b'', 'application/octet-stream')),
+                ('files', ('b.bin', b'b' * 1024, 'application/octet-stream')),
+            ],
+        )
+    finally:
+        app.dependency_overrides.clear()
+
+    # Invalid files are reported one by one, the others are uploaded
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert [result['filename'] for result in results] == ['a.bin', 'empty.bin', 'b.bin']
+    assert results[1] == {'filename': 'empty.bin', 'file': None, 'error': 'File is empty'}
+    assert [results[i]['file']['status'] for i in [0, 2]] == ['pending', 'pending']
+    upload_files.assert_awaited_once()
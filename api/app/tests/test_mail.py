@@ -1,8 +1,63 @@
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import MagicMock
 
 import pytest
 
-from app.utils.mail import send_email_with_sendgrid
+from app.utils.mail import EmailOutbox, send_email_with_sendgrid
+
+
+class FakeSendGridServer(ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeSendGridHandler)
+        self.requests: list[tuple[str, dict]] = []
+        self.statuses: list[int] = []
+        self.unblocked = threading.Event()
+        self.unblocked.set()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class FakeSendGridHandler(BaseHTTPRequestHandler):
+    server: FakeSendGridServer
+
+    def do_POST(self):
+        self.server.unblocked.wait(5)
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append((self.headers['Authorization'], body))
+
+        status = self.server.statuses.pop(0) if self.server.statuses else 202
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(name='server')
+def server_fixture():
+    server = FakeSendGridServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.unblocked.set()
+    server.shutdown()
+    server.server_close()
+
+
+def create_outbox(server: FakeSendGridServer, **kwargs):
+    return EmailOutbox(
+        api_key='key',
+        from_email='noreply@example.com',
+        host=server.url,
+        **{'batch_window_ms': 100, 'retry_backoff_ms': 10, **kwargs},
+    )
 
 
 @pytest.fixture
@@ -53,3 +108,85 @@ def test_send_email_failure(mock_sendgrid_client, mock_logger):
 
     # Verify failure log message
     mock_logger.warn.assert_called_with('Email to recipient@example.com was unable to send')
+
+
+def test_outbox_merges_emails_per_recipient(server: FakeSendGridServer):
+    outbox = create_outbox(server)
+
+    for i in range(3):
+        assert outbox.send('a@example.com', 'File processed', f'<p>File {i}</p>')
+    assert outbox.send('b@example.com', 'File processed', '<p>File 3</p>')
+    outbox.close()
+
+    # One request per recipient, through the same authenticated client
+    bodies = {body['personalizations'][0]['to'][0]['email']: body for _, body in server.requests}
+    assert len(server.requests) == 2
+    assert all(authorization == 'Bearer key' for authorization, _ in server.requests)
+    assert bodies['a@example.com']['content'][0]['value'] == (
+        '<p>File 0</p><p>File 1</p><p>File 2</p>'
+    )
+    assert bodies['b@example.com']['content'][0]['value'] == '<p>File 3</p>'
+    assert outbox.sent_count == 2
+
+
+def test_outbox_retries_with_backoff(server: FakeSendGridServer):
+    server.statuses = [503, 429, 202]
+    outbox = create_outbox(server, max_retries=3)
+
+    outbox.send('a@example.com', 'File processed', '<p>File</p>')
+    outbox.close()
+
+    assert len(server.requests) == 3
+    assert (outbox.sent_count, outbox.failed_count) == (1, 0)
+
+
+def test_outbox_gives_up_on_client_errors(server: FakeSendGridServer):
+    server.statuses = [400]
+    outbox = create_outbox(server, max_retries=3)
+
+    outbox.send('a@example.com', 'File processed', '<p>File</p>')
+    outbox.close()
+
+    assert len(server.requests) == 1
+    assert (outbox.sent_count, outbox.failed_count) == (0, 1)
+
+
+def test_outbox_drops_emails_when_full(server: FakeSendGridServer):
+    server.unblocked.clear()
+    outbox = create_outbox(server, workers=1, queue_size=1)
+
+    # 2 batches are waiting on the blocked server, the dispatcher waits for a free worker
+    for i in range(3):
+        assert outbox.send(f'{i}@example.com', 'File processed', '<p>File</p>')
+        time.sleep(0.02)
+    time.sleep(0.3)
+
+    # Sending never waits, the email that doesn't fit in the queue is dropped
+    start = time.monotonic()
+    assert outbox.send('3@example.com', 'File processed', '<p>File</p>')
+    assert not outbox.send('4@example.com', 'File processed', '<p>File</p>')
+    assert time.monotonic() - start < 0.1
+
+    server.unblocked.set()
+    outbox.close()
+    assert len(server.requests) == 4
+    assert outbox.dropped_count == 1
+
+
+def test_outbox_counts_drops_from_many_threads(server: FakeSendGridServer, mock_logger, mocker):
+    outbox = create_outbox(server)
+    mocker.patch.object(outbox.queue, 'put_nowait', side_effect=queue.Full)
+
+    def send_emails():
+        for _ in range(1000):
+            outbox.send('johndoe@example.com', 'File processed', '<p>File</p>')
+
+    threads = [threading.Thread(target=send_emails) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    outbox.close()
+
+    # No drop is lost by threads counting at the same time
+    assert outbox.dropped_count == 8000
@@ -0,0 +1,299 @@
+import asyncio
+from datetime import UTC, datetime
+from unittest.mock import MagicMock
+
+import pytest
+from fastapi import status
+from pytest_mock import MockerFixture
+
+from app.core.config import ServerMode, get_settings
+from app.core.notification_hub import NotificationHub
+from app.models.user import FileProcessingStatus
+from app.schemas.notification import Notification, NotificationCategory, NotificationType
+from app.schemas.stream import (
+    EventType,
+    FileUploadedEvent,
+    StatusUpdatedEvent,
+    decode_event,
+    encode_event,
+    parse_event,
+)
+from app.services.notification_service import notification_service
+
+
+class FakeWebSocket:
+    def __init__(self, blocked: bool = False):
+        self.sent: list[str] = []
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+        self.close_code: int | None = None
+
+    async def send_text(self, message: str):
+        await self.unblocked.wait()
+        self.sent.append(message)
+
+    async def close(self, code: int):
+        self.close_code = code
+
+
+class FakePubSub:
+    def __init__(self):
+        self.patterns: list[str] = []
+        self.messages: asyncio.Queue[dict] = asyncio.Queue()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def psubscribe(self, *patterns: str):
+        self.patterns.extend(patterns)
+
+    async def listen(self):
+        while True:
+            yield await self.messages.get()
+
+
+async def wait_for(condition, timeout: float = 5.0):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+def create_status_event(user_id: int, status: FileProcessingStatus, email: str | None = None):
+    return StatusUpdatedEvent(
+        event_type=EventType.status_update,
+        timestamp=datetime.now(UTC),
+        metadata={'version': 1, 'source': ServerMode.file_worker},
+        payload={
+            'user_id': user_id,
+            'status': status,
+            'message': f'File is {status.value}',
+            'email': email,
+        },
+    ).model_dump_json()
+
+
+def create_file_uploaded_event(file_id: int):
+    return FileUploadedEvent(
+        timestamp=datetime.now(UTC),
+        metadata={'version': 1, 'source': ServerMode.api_server},
+        payload={'file_id': file_id},
+    ).model_dump_json()
+
+
+@pytest.fixture
+def mock_redis(mocker: MockerFixture):
+    """Fixture to mock the sync Redis client"""
+    client = MagicMock()
+    mocker.patch('app.services.notification_service.get_sync_client', return_value=client)
+    return client
+
+
+@pytest.fixture
+def mock_send_email(mocker: MockerFixture):
+    """Fixture to mock the email outbox"""
+    outbox = mocker.patch('app.services.notification_service.get_email_outbox').return_value
+    return outbox.send
+
+
+def test_route_notifications_batch(mock_redis, mock_send_email):
+    notification_service.route_notifications_batch(
+        [
+            create_status_event(1, FileProcessingStatus.processing, 'a@example.com'),
+            create_status_event(2, FileProcessingStatus.success, 'b@example.com'),
+            'not an event',
+            create_file_uploaded_event(4),
+            create_status_event(3, FileProcessingStatus.failed),
+        ]
+    )
+
+    # All notifications are published through one pipeline, skipping invalid and unhandled
+    # messages
+    pipe = mock_redis.pipeline.return_value
+    assert [call.kwargs['channel'] for call in pipe.publish.call_args_list] == [
+        'noti:1',
+        'noti:2',
+        'noti:3',
+    ]
+    pipe.execute.assert_called_once()
+
+    # Emails are only sent for finished files of users with an email
+    mock_send_email.assert_called_once()
+    assert mock_send_email.call_args.kwargs['to_email'] == 'b@example.com'
+
+
+def test_route_notifications_digest(mock_redis, mock_send_email, mocker: MockerFixture):
+    mocker.patch.object(get_settings(), 'email_digest_window_ms', 60000)
+
+    notification_service.route_notifications_batch(
+        [
+            create_status_event(1, FileProcessingStatus.success, 'a@example.com'),
+            create_status_event(1, FileProcessingStatus.failed, 'a@example.com'),
+            create_status_event(2, FileProcessingStatus.success, 'b@example.com'),
+        ]
+    )
+    notification_service.route_notifications_batch(
+        [create_status_event(1, FileProcessingStatus.success, 'a@example.com')]
+    )
+
+    # In-app notifications are still pushed right away, emails wait for the window
+    assert mock_redis.pipeline.return_value.execute.call_count == 2
+    mock_send_email.assert_not_called()
+
+    notification_service.close()
+
+    emails = {call.kwargs['to_email']: call.kwargs for call in mock_send_email.call_args_list}
+    assert mock_send_email.call_count == 2
+    assert emails['a@example.com']['content'].startswith(
+        '<p>3 of your files have finished processing, 1 failed:</p>'
+    )
+    assert emails['b@example.com']['content'] == '<p>File is success</p>'
+
+
+def test_parse_event():
+    status_event = parse_event(create_status_event(1, FileProcessingStatus.success))
+    assert isinstance(status_event, StatusUpdatedEvent)
+    assert status_event.payload.status == FileProcessingStatus.success
+
+    file_event = parse_event(create_file_uploaded_event(2))
+    assert isinstance(file_event, FileUploadedEvent)
+    assert file_event.payload.file_id == 2
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_encode_event(version: int):
+    events = [
+        StatusUpdatedEvent.model_validate_json(
+            create_status_event(1, FileProcessingStatus.success, 'a@example.com')
+        ),
+        FileUploadedEvent.model_validate_json(create_file_uploaded_event(2)),
+    ]
+    for event in events:
+        event.metadata.version = version
+        assert decode_event(encode_event(event)) == event
+
+
+def test_compact_event_is_smaller():
+    event = StatusUpdatedEvent.model_validate_json(
+        create_status_event(1, FileProcessingStatus.success, 'a@example.com')
+    )
+    json_value = encode_event(event)
+    event.metadata.version = 2
+    compact_value = encode_event(event)
+
+    assert len(compact_value) < len(json_value) / 2
+    # JSON is still accepted once consumers read the compact encoding
+    assert decode_event(json_value).metadata.version == 1
+
+
+def test_route_notifications_to_registered_handlers(mocker: MockerFixture):
+    handler = MagicMock()
+    mocker.patch.dict(notification_service.event_handlers, {EventType.file_upload: handler})
+
+    notification_service.route_notifications_batch(
+        [create_file_uploaded_event(1), create_file_uploaded_event(2)]
+    )
+
+    # One call per event type with every event of the batch, each parsed once
+    handler.assert_called_once()
+    assert [event.payload.file_id for event in handler.call_args.args[0]] == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_hub_uses_one_subscription(mocker: MockerFixture):
+    pubsub = FakePubSub()
+    client = MagicMock()
+    client.pubsub.return_value = pubsub
+    mocker.patch('app.core.notification_hub.get_client', return_value=client)
+
+    hub = NotificationHub()
+    websockets = [FakeWebSocket() for _ in range(3)]
+    connections = [
+        hub.register(websocket, user_id)
+        for websocket, user_id in zip(websockets, [1, 1, 2], strict=True)
+    ]
+
+    await wait_for(lambda: pubsub.patterns == ['noti:*'])
+    await pubsub.messages.put({'type': 'pmessage', 'channel': 'noti:1', 'data': 'hello'})
+    await wait_for(lambda: websockets[0].sent and websockets[1].sent)
+
+    # Every socket of the user gets the message, other users don't
+    assert [websocket.sent for websocket in websockets] == [['hello'], ['hello'], []]
+    assert client.pubsub.call_count == 1
+
+    for connection in connections:
+        await hub.unregister(connection)
+    await hub.stop()
+    assert hub.connections == {}
+
+
+def create_notification(file_id: int, status: FileProcessingStatus):
+    return Notification(
+        type=NotificationType.info,
+        category=NotificationCategory.file,
+        message=f'File is {status.value}',
+        file_id=file_id,
+    ).model_dump_json()
+
+
+@pytest.mark.asyncio
+async def test_hub_slow_socket_does_not_block_others(mocker: MockerFixture):
+    mocker.patch.object(get_settings(), 'notification_queue_size', 2)
+    hub = NotificationHub()
+    mocker.patch.object(hub, 'start')
+
+    slow_websocket = FakeWebSocket(blocked=True)
+    websocket = FakeWebSocket()
+    slow_connection = hub.register(slow_websocket, 1)
+    connection = hub.register(websocket, 1)
+
+    messages = [
+        create_notification(1, FileProcessingStatus.processing),
+        create_notification(2, FileProcessingStatus.processing),
+        create_notification(3, FileProcessingStatus.processing),
+        create_notification(2, FileProcessingStatus.success),
+    ]
+    for message in messages:
+        hub.dispatch('noti:1', message)
+        await asyncio.sleep(0.01)
+    await wait_for(lambda: len(websocket.sent) == 4)
+
+    # The first message is in flight, the queue is full and the latest status of file 2
+    # replaced the queued one
+    assert slow_websocket.sent == []
+    assert list(slow_connection.queue) == [messages[2], messages[3]]
+    assert hub.stats() == {'connections': 2, 'dropped': 0, 'coalesced': 1}
+
+    slow_websocket.unblocked.set()
+    await wait_for(lambda: len(slow_websocket.sent) == 3)
+    assert slow_websocket.sent == [messages[0], messages[2], messages[3]]
+
+    await hub.unregister(slow_connection)
+    await hub.unregister(connection)
+
+
+@pytest.mark.asyncio
+async def test_hub_disconnects_slow_socket(mocker: MockerFixture):
+    mocker.patch.object(get_settings(), 'notification_queue_size', 2)
+    hub = NotificationHub()
+    mocker.patch.object(hub, 'start')
+
+    slow_websocket = FakeWebSocket(blocked=True)
+    slow_connection = hub.register(slow_websocket, 1)
+
+    for file_id in range(4):
+        hub.dispatch('noti:1', create_notification(file_id, FileProcessingStatus.processing))
+        await asyncio.sleep(0.01)
+
+    # Nothing to coalesce, the queued messages are dropped and the client disconnected
+    await wait_for(lambda: slow_websocket.close_code is not None)
+    assert slow_websocket.close_code == status.WS_1013_TRY_AGAIN_LATER
+    assert len(slow_connection.queue) == 0
+
+    hub.dispatch('noti:1', create_notification(5, FileProcessingStatus.processing))
+    await hub.unregister(slow_connection)
+    assert hub.stats() == {'connections': 0, 'dropped': 4, 'coalesced': 0}
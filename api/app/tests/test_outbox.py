@@ -0,0 +1,187 @@
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+
+import pytest
+import pytest_asyncio
+from pytest_mock import MockerFixture
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import get_settings
+from app.core.outbox import add_outbox_event, get_relay_thread, notify_outbox, relay_outbox_batch
+from app.models.outbox import OutboxEvent
+from app.models.user import File as UserFile
+from app.models.user import FileProcessingStatus, User
+from app.schemas.stream import decode_event
+from app.services.file_service import file_service
+
+
+class FakeProducer:
+    def __init__(self):
+        self.messages: list[tuple[str, bytes, str | None]] = []
+        self.failing_keys: set[str] = set()
+        # Still in the local queue, never reported
+        self.queued_keys: set[str] = set()
+
+    def produce(self, topic: str, value: bytes, key: str | None = None, on_delivery=None):
+        # Reported right away, like the polling thread of the managed producer would
+        if key in self.queued_keys:
+            return
+        if key in self.failing_keys:
+            on_delivery('Broker down', None)
+        else:
+            self.messages.append((topic, value, key))
+            on_delivery(None, None)
+
+
+@pytest.fixture(name='db_path')
+def db_path_fixture(tmp_path: Path):
+    yield tmp_path / 'test.db'
+
+
+@pytest.fixture(name='engine')
+def engine_fixture(db_path: Path):
+    engine = create_engine(
+        f'sqlite:///{db_path}',
+        connect_args={'check_same_thread': False},
+        isolation_level='AUTOCOMMIT',
+    )
+    SQLModel.metadata.create_all(engine)
+    yield engine
+
+
+@pytest.fixture(name='session')
+def session_fixture(engine):
+    with Session(engine) as session:
+        yield session
+
+
+@pytest_asyncio.fixture(name='async_session')
+async def async_session_fixture(db_path: Path, session: Session):
+    engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}')
+    async with AsyncSession(engine, expire_on_commit=False) as async_session:
+        yield async_session
+    await engine.dispose()
+
+
+def add_events(session: Session, count: int):
+    for i in range(count):
+        add_outbox_event(session, 'notifications', value=f'{i}'.encode(), key=f'{i}')
+    session.commit()
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail('Timed out waiting for the relay')
+        time.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_update_status_writes_outbox_event(session: Session, async_session: AsyncSession):
+    user = User(username='johndoe', hashed_password='abc', email='johndoe@example.com')
+    file = UserFile(
+        filename='file.txt',
+        status=FileProcessingStatus.pending,
+        size=1024,
+        type='text/plain',
+        url='http://cdn.example.com/file.txt',
+        created_at=datetime.now(UTC),
+        object_path='1/file.txt',
+        user=user,
+    )
+    session.add(file)
+    session.commit()
+
+    file_data = (await async_session.exec(select(UserFile))).one()
+    await async_session.refresh(file_data, ['user'])
+    await file_service._update_status(
+        db=async_session,
+        settings=get_settings(),
+        file_data=file_data,
+        message='File "file.txt" is queuing',
+        status=FileProcessingStatus.queuing,
+    )
+
+    # The status and its event are committed together, Kafka isn't called
+    session.refresh(file)
+    assert file.status == FileProcessingStatus.queuing
+    (event,) = session.exec(select(OutboxEvent)).all()
+    assert event.topic == 'notifications'
+    assert event.ordering_key == f'file:{file.id}'
+    assert event.key == f'{user.id},{file.id},queuing'
+    assert decode_event(event.value).payload.status == FileProcessingStatus.queuing
+
+
+def test_relay_outbox_batch(session: Session):
+    add_events(session, 5)
+    producer = FakeProducer()
+    producer.failing_keys.add('1')
+
+    assert relay_outbox_batch(session, producer, batch_size=3, timeout=1) == 2
+    assert relay_outbox_batch(session, producer, batch_size=3, timeout=1) == 2
+
+    # Events are sent in order, the undelivered one is kept for a later batch
+    assert [key for _, _, key in producer.messages] == ['0', '2', '3', '4']
+    assert [event.key for event in session.exec(select(OutboxEvent)).all()] == ['1']
+
+    producer.failing_keys.clear()
+    assert relay_outbox_batch(session, producer, batch_size=3, timeout=1) == 1
+    assert relay_outbox_batch(session, producer, batch_size=3, timeout=1) == 0
+    assert session.exec(select(OutboxEvent)).all() == []
+
+
+def test_relay_outbox_batch_keeps_the_order_of_a_key(session: Session):
+    for key, ordering_key in [('a0', 'a'), ('a1', 'a'), ('b0', 'b'), ('a2', 'a')]:
+        add_outbox_event(session, 'notifications', value=b'', key=key, ordering_key=ordering_key)
+    session.commit()
+    producer = FakeProducer()
+    producer.failing_keys.add('a1')
+
+    assert relay_outbox_batch(session, producer, batch_size=10, timeout=1) == 2
+    assert relay_outbox_batch(session, producer, batch_size=10, timeout=1) == 0
+    assert relay_outbox_batch(session, producer, batch_size=10, timeout=1) == 0
+
+    # The failed event isn't overtaken by the next event of its key
+    assert [key for _, _, key in producer.messages] == ['a0', 'b0']
+
+    producer.failing_keys.clear()
+    assert relay_outbox_batch(session, producer, batch_size=10, timeout=1) == 1
+    assert relay_outbox_batch(session, producer, batch_size=10, timeout=1) == 1
+    assert [key for _, _, key in producer.messages] == ['a0', 'b0', 'a1', 'a2']
+
+
+def test_relay_outbox_batch_waits_for_its_own_events(session: Session):
+    add_events(session, 3)
+    producer = FakeProducer()
+    producer.queued_keys.add('2')
+
+    # The producer isn't flushed, the batch gives up on its unreported event after the timeout
+    started = time.monotonic()
+    assert relay_outbox_batch(session, producer, batch_size=3, timeout=0.1) == 2
+    assert time.monotonic() - started < 1
+    assert [event.key for event in session.exec(select(OutboxEvent)).all()] == ['2']
+
+
+def test_relay_thread(session: Session, engine, db_path: Path, mocker: MockerFixture):
+    producer = FakeProducer()
+    mocker.patch('app.core.outbox.engine', engine)
+    mocker.patch('app.core.outbox.get_producer', return_value=producer)
+    start_relaying, stop_relaying = get_relay_thread(
+        batch_size=2, poll_interval_ms=60000, timeout=1
+    )
+    start_relaying()
+
+    try:
+        # Committed events are sent without waiting for the next poll, in batches
+        with Session(create_engine(f'sqlite:///{db_path}')) as transaction_session:
+            add_events(transaction_session, 5)
+        notify_outbox()
+        wait_for(lambda: len(producer.messages) == 5)
+    finally:
+        stop_relaying()
+
+    assert session.exec(select(OutboxEvent)).all() == []
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from pytest_mock import MockerFixture
+
+from app.core import security
+from app.core.config import Settings, get_settings
+from app.core.security import check_password, hash_password
+
+
+@pytest.fixture(name='settings')
+def settings_fixture():
+    settings = get_settings()
+    yield settings
+
+
+@pytest.mark.asyncio
+async def test_hash_password_does_not_block_event_loop():
+    gaps: list[float] = []
+    done = asyncio.Event()
+
+    async def tick():
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    async def hash_in_pool():
+        hashed_password = await hash_password('secret')
+        assert await check_password('secret', hashed_password)
+        done.set()
+
+    await asyncio.gather(tick(), hash_in_pool())
+
+    # Each bcrypt call takes hundreds of milliseconds, the loop kept ticking meanwhile
+    assert max(gaps) < 0.1
+
+
+@pytest.mark.asyncio
+async def test_password_tasks_run_in_password_threads():
+    thread_name = await security.run_password_task(lambda: threading.current_thread().name)
+    assert thread_name.startswith('password')
+
+
+@pytest.mark.asyncio
+async def test_password_tasks_rejected_when_saturated(settings: Settings, mocker: MockerFixture):
+    mocker.patch.object(settings, 'password_hash_pool_size', 1)
+    mocker.patch.object(settings, 'password_hash_queue_size', 1)
+    mocker.patch.object(settings, 'password_hash_retry_after', 3)
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_hash():
+        started.set()
+        release.wait(5)
+
+    running = asyncio.create_task(security.run_password_task(slow_hash))
+    queued = asyncio.create_task(security.run_password_task(slow_hash))
+    await asyncio.to_thread(started.wait, 5)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await hash_password('secret')
+    assert exc_info.value.status_code == 503
+    assert exc_info.value.headers == {'Retry-After': '3'}
+
+    release.set()
+    await asyncio.gather(running, queued)
+    assert security.password_tasks == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_password_task_is_counted_until_done(
+    settings: Settings, mocker: MockerFixture
+):
+    mocker.patch.object(settings, 'password_hash_pool_size', 1)
+    mocker.patch.object(settings, 'password_hash_queue_size', 0)
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_hash():
+        started.set()
+        release.wait(5)
+
+    # The client of the first request disconnects, its hash keeps running
+    running = asyncio.create_task(security.run_password_task(slow_hash))
+    await asyncio.to_thread(started.wait, 5)
+    running.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await running
+
+    with pytest.raises(HTTPException) as exc_info:
+        await hash_password('secret')
+    assert exc_info.value.status_code == 503
+
+    # The slot is given back once the hash is done
+    release.set()
+    for _ in range(500):
+        if security.password_tasks == 0:
+            break
+        await asyncio.sleep(0.01)
+    assert security.password_tasks == 0
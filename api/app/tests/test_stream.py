@@ -0,0 +1,316 @@
+import threading
+import time
+from collections import deque
+
+import pytest
+from confluent_kafka import TopicPartition
+from pytest_mock import MockerFixture
+
+from app.core.config import get_settings
+from app.core.stream import ManagedProducer, get_consume_thread
+
+
+class FakeMessage:
+    def __init__(self, topic: str, partition: int, offset: int, value: str):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._value = value
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return None
+
+    def value(self):
+        return self._value.encode('utf-8')
+
+    def error(self):
+        return None
+
+
+class FakeConsumer:
+    def __init__(self, messages: list[FakeMessage]):
+        self.messages = deque(messages)
+        self.commits: list[tuple[str, int, int]] = []
+        self.commit_calls: list[bool] = []
+        self.closed = False
+        self.on_revoke = None
+        # Partitions to revoke on the next consume, like a rebalance would
+        self.revoking: list[TopicPartition] = []
+        self.commits_on_revoke: list[tuple[str, int, int]] | None = None
+
+    def subscribe(self, topics: list[str], on_revoke=None):
+        self.on_revoke = on_revoke
+
+    def consume(self, num_messages: int, timeout: float):
+        if self.revoking:
+            revoked = {(tp.topic, tp.partition) for tp in self.revoking}
+            self.on_revoke(self, self.revoking)
+            self.commits_on_revoke = list(self.commits)
+            self.messages = deque(
+                msg for msg in self.messages if (msg.topic(), msg.partition()) not in revoked
+            )
+            self.revoking = []
+
+        msgs = []
+        while self.messages and len(msgs) < num_messages:
+            msgs.append(self.messages.popleft())
+        if not msgs:
+            time.sleep(0.01)
+        return msgs
+
+    def commit(self, offsets: list[TopicPartition], asynchronous: bool = True):
+        self.commit_calls.append(asynchronous)
+        for offset in offsets:
+            self.commits.append((offset.topic, offset.partition, offset.offset))
+
+    def close(self):
+        self.closed = True
+
+
+class FakeProducer:
+    def __init__(self, conf: dict, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.queue: list[tuple[FakeMessage, object]] = []
+        self.failing_topics: set[str] = set()
+
+    def produce(self, topic: str, value: str, key: str | None = None, on_delivery=None):
+        if len(self.queue) >= self.queue_size:
+            raise BufferError('Local: Queue full')
+        self.queue.append((FakeMessage(topic, 0, 0, value), on_delivery))
+
+    def poll(self, timeout: float):
+        # Deliver queued messages, calling back from the polling thread
+        while self.queue:
+            msg, on_delivery = self.queue.pop(0)
+            err = 'Broker down' if msg.topic() in self.failing_topics else None
+            on_delivery(err, msg)
+        time.sleep(min(timeout, 0.01))
+        return 0
+
+    def flush(self, timeout: float):
+        self.poll(0)
+        return 0
+
+
+def create_messages(partitions: int, count: int):
+    return [
+        FakeMessage('files', partition, offset, f'{partition}:{offset}')
+        for offset in range(count)
+        for partition in range(partitions)
+    ]
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail('Timed out waiting for the consumer')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def mock_consumer(mocker: MockerFixture):
+    """Fixture to mock the Kafka Consumer with in-memory messages"""
+
+    def create_consumer(messages: list[FakeMessage]):
+        consumer = FakeConsumer(messages)
+        mocker.patch('app.core.stream.Consumer', return_value=consumer)
+        return consumer
+
+    return create_consumer
+
+
+def test_consume_messages_concurrently(mock_consumer):
+    consumer = mock_consumer(create_messages(partitions=4, count=1))
+    # Only passes if the 4 messages are processed at the same time
+    barrier = threading.Barrier(4, timeout=5)
+
+    start_consuming, stop_consuming = get_consume_thread(
+        ['files'], process_message=lambda _: barrier.wait(), concurrency=4
+    )
+    start_consuming()
+    wait_for(lambda: len(consumer.commits) == 4)
+    stop_consuming()
+
+    assert not barrier.broken
+    assert consumer.closed
+
+
+def test_consume_messages_in_partition_order(mock_consumer):
+    consumer = mock_consumer(create_messages(partitions=2, count=5))
+    processed_messages: list[str] = []
+
+    def process_message(msg: bytes):
+        time.sleep(0.01)
+        processed_messages.append(msg.decode('utf-8'))
+
+    start_consuming, stop_consuming = get_consume_thread(
+        ['files'], process_message=process_message, concurrency=4
+    )
+    start_consuming()
+    wait_for(lambda: len(consumer.commits) == 10)
+    stop_consuming()
+
+    for partition in range(2):
+        messages = [msg for msg in processed_messages if msg.startswith(f'{partition}:')]
+        assert messages == [f'{partition}:{offset}' for offset in range(5)]
+
+        # Offsets are committed once each message is processed, in order
+        offsets = [offset for _, p, offset in consumer.commits if p == partition]
+        assert offsets == list(range(1, 6))
+
+
+def test_consume_failed_message_is_committed(mock_consumer):
+    consumer = mock_consumer(create_messages(partitions=1, count=2))
+
+    def process_message(msg: bytes):
+        raise Exception('Processing error')
+
+    start_consuming, stop_consuming = get_consume_thread(['files'], process_message=process_message)
+    start_consuming()
+    wait_for(lambda: len(consumer.commits) == 2)
+    stop_consuming()
+
+    assert consumer.commits == [('files', 0, 1), ('files', 0, 2)]
+
+
+def test_consume_commits_offsets_in_batches(mock_consumer):
+    consumer = mock_consumer(create_messages(partitions=2, count=5))
+    processed_messages: list[bytes] = []
+
+    start_consuming, stop_consuming = get_consume_thread(
+        ['files'],
+        process_message=processed_messages.append,
+        commit_batch_size=4,
+        commit_interval_ms=60000,
+    )
+    start_consuming()
+    wait_for(lambda: len(processed_messages) == 10)
+    stop_consuming()
+
+    # Two asynchronous batches of 4 messages, then a final synchronous commit on stop
+    assert consumer.commit_calls == [True, True, False]
+    assert consumer.commits[-2:] == [('files', 0, 5), ('files', 1, 5)]
+
+
+def test_consume_revoked_partition_commits_its_offsets(mock_consumer):
+    consumer = mock_consumer(create_messages(partitions=2, count=3))
+    processed_messages: list[str] = []
+    release = threading.Event()
+
+    def process_message(msg: bytes):
+        if msg.startswith(b'0:'):
+            release.wait(timeout=5)
+        processed_messages.append(msg.decode('utf-8'))
+
+    start_consuming, stop_consuming = get_consume_thread(
+        ['files'],
+        process_message=process_message,
+        concurrency=4,
+        commit_batch_size=100,
+        commit_interval_ms=60000,
+    )
+    start_consuming()
+    wait_for(lambda: '1:2' in processed_messages and not consumer.messages)
+
+    # Partition 0 is revoked while its first message is still being processed
+    consumer.revoking = [TopicPartition('files', 0)]
+    threading.Timer(0.2, release.set).start()
+    wait_for(lambda: consumer.commits_on_revoke is not None)
+    stop_consuming()
+
+    # Its processed messages are committed synchronously before the partition is given away,
+    # the ones waiting behind the running message are left to the new owner
+    assert consumer.commit_calls[0] is False
+    assert ('files', 1, 3) in consumer.commits_on_revoke
+    assert ('files', 0, 1) in consumer.commits_on_revoke
+    assert [msg for msg in processed_messages if msg.startswith('0:')] == ['0:0']
+    assert [offset for _, p, offset in consumer.commits if p == 0] == [1]
+
+
+def test_consume_messages_in_batches(mock_consumer):
+    consumer = mock_consumer(create_messages(partitions=2, count=5))
+    batches: list[list[bytes]] = []
+
+    start_consuming, stop_consuming = get_consume_thread(
+        ['notifications'], process_batch=batches.append, batch_size=4
+    )
+    start_consuming()
+    wait_for(lambda: sum(len(batch) for batch in batches) == 10)
+    stop_consuming()
+
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    # Values are passed as they were produced, the handlers decode them
+    assert batches[0] == [b'0:0', b'1:0', b'0:1', b'1:1']
+    assert {partition: offset for _, partition, offset in consumer.commits} == {0: 5, 1: 5}
+
+
+def test_consume_thread_requires_one_handler():
+    with pytest.raises(ValueError):
+        get_consume_thread(['files'])
+
+
+@pytest.fixture
+def mock_producer(mocker: MockerFixture):
+    """Fixture to mock the Kafka Producer with an in-memory queue"""
+    fake_producer = FakeProducer({}, queue_size=2)
+    mocker.patch('app.core.stream.Producer', return_value=fake_producer)
+    return fake_producer
+
+
+def test_managed_producer_delivery_reports(mock_producer):
+    mock_producer.failing_topics.add('files')
+    producer = ManagedProducer({})
+
+    for _ in range(5):
+        producer.produce('notifications', value='{}', key='1')
+    producer.produce('files', value='{}', key='1')
+    producer.close()
+
+    # The full queue is drained by polling instead of raising BufferError
+    assert producer.stats() == {
+        'notifications': {'delivered': 5, 'failed': 0},
+        'files': {'delivered': 0, 'failed': 1},
+    }
+
+
+def test_managed_producer_gives_up_on_full_queue(mock_producer, mocker: MockerFixture):
+    mocker.patch.object(get_settings(), 'producer_queue_full_timeout', 0.05)
+    mocker.patch.object(mock_producer, 'poll', return_value=0)
+    producer = ManagedProducer({})
+
+    producer.produce('notifications', value='{}', key='1')
+    producer.produce('notifications', value='{}', key='2')
+    # Nothing is delivered, the message is refused after a bounded wait
+    with pytest.raises(BufferError):
+        producer.produce('notifications', value='{}', key='3')
+    producer._stop_event.set()
+
+
+@pytest.mark.asyncio
+async def test_managed_producer_waits_off_the_event_loop(mock_producer, mocker: MockerFixture):
+    # Only the retry polls the queue, so the second message is the one that waits
+    mocker.patch.object(ManagedProducer, '_poll_loop')
+    run_in_threadpool = mocker.patch(
+        'app.core.stream.run_in_threadpool', side_effect=lambda func, *args: func(*args)
+    )
+    mock_producer.queue_size = 1
+    producer = ManagedProducer({})
+
+    await producer.produce_async('notifications', value='{}', key='1')
+    run_in_threadpool.assert_not_called()
+    await producer.produce_async('notifications', value='{}', key='2')
+    producer.close()
+
+    # Only the produce that hit the full queue is moved to a thread
+    run_in_threadpool.assert_called_once()
+    assert producer.stats() == {'notifications': {'delivered': 2, 'failed': 0}}
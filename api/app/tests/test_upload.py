@@ -0,0 +1,61 @@
+import threading
+from io import BytesIO
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from app.core.config import get_settings
+from app.utils import upload
+from app.utils.upload import close_storage_client, delete_blob, upload_blob, upload_blob_from_memory
+
+
+@pytest.fixture
+def mock_storage_client(mocker: MockerFixture):
+    """Fixture to mock storage.Client with an empty client pool"""
+    mocker.patch('app.utils.upload.storage_client', None)
+    mocker.patch.dict('app.utils.upload.buckets', clear=True)
+    mocker.patch('app.utils.upload.google.auth.default', return_value=(MagicMock(), 'project'))
+    return mocker.patch('app.utils.upload.storage.Client')
+
+
+def test_storage_client_is_shared(mock_storage_client):
+    upload_blob('bucket', BytesIO(b'abc'), 'a.txt')
+    upload_blob_from_memory('bucket', b'abc', 'b.txt')
+    delete_blob('bucket', 'a.txt')
+
+    # The client and the bucket handle are created only once
+    mock_storage_client.assert_called_once()
+    mock_storage_client.return_value.bucket.assert_called_once_with('bucket')
+
+    # Connections are pooled on the HTTP session given to the client
+    adapter = mock_storage_client.call_args.kwargs['_http'].get_adapter('https://storage.com')
+    assert adapter._pool_maxsize == get_settings().storage_pool_size
+
+
+def test_storage_client_is_created_once_by_concurrent_threads(mock_storage_client):
+    barrier = threading.Barrier(8)
+
+    def upload():
+        barrier.wait()
+        upload_blob_from_memory('bucket', b'abc', 'a.txt')
+
+    threads = [threading.Thread(target=upload) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    mock_storage_client.assert_called_once()
+    mock_storage_client.return_value.bucket.assert_called_once_with('bucket')
+
+
+def test_close_storage_client(mock_storage_client):
+    upload_blob_from_memory('bucket', b'abc', 'a.txt')
+    client = mock_storage_client.return_value
+
+    close_storage_client()
+
+    client.close.assert_called_once()
+    assert upload.storage_client is None
+    assert upload.buckets == {}
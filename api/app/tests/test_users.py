@@ -1,24 +1,93 @@
+import json
 from datetime import UTC, datetime, timedelta
+from pathlib import Path
 from uuid import uuid4
 
 import jwt
 import pytest
+from cachetools import TLRUCache
 from fastapi.testclient import TestClient
 from pytest_mock import MockerFixture
-from sqlmodel import Session, SQLModel, create_engine
-from sqlmodel.pool import StaticPool
+from sqlalchemy import Engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app.core import auth_cache
 from app.core.config import Settings, get_settings
-from app.core.database import get_session
+from app.core.database import get_async_session
 from app.main import app
 from app.models.user import AuthSession, EmailVerificationStatus, User
 from app.utils.mail import send_email_with_sendgrid
 
 
+class FakeRedis:
+    def __init__(self):
+        self.values: dict[str, str | set[str]] = {}
+        self.get_count = 0
+        self.published: list[tuple[str, str]] = []
+
+    async def get(self, key: str):
+        self.get_count += 1
+        return self.values.get(key)
+
+    async def publish(self, channel: str, message: str):
+        self.published.append((channel, message))
+
+    async def set(self, key: str, value: str, ex: int | None = None):
+        self.values[key] = value
+
+    async def sadd(self, key: str, *members: str):
+        self.values.setdefault(key, set()).update(members)
+
+    async def expire(self, key: str, seconds: int):
+        pass
+
+    async def smembers(self, key: str):
+        return self.values.get(key, set())
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def pipeline(self, transaction: bool = True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def __getattr__(self, name: str):
+        return lambda *args, **kwargs: self.commands.append(
+            getattr(self.redis, name)(*args, **kwargs)
+        )
+
+    async def execute(self):
+        return [await command for command in self.commands]
+
+
+@pytest.fixture(name='db_path')
+def db_path_fixture(tmp_path: Path):
+    yield tmp_path / 'test.db'
+
+
 @pytest.fixture(name='session')
-def session_fixture():
+def session_fixture(db_path: Path):
+    # Test data is written synchronously and read by the app through an async session,
+    # both engines share the same database file
     engine = create_engine(
-        'sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool
+        f'sqlite:///{db_path}',
+        connect_args={'check_same_thread': False},
+        isolation_level='AUTOCOMMIT',
     )
     SQLModel.metadata.create_all(engine)
     with Session(engine) as session:
@@ -32,16 +101,59 @@ def settings_fixture():
 
 
 @pytest.fixture(name='client')
-def client_fixture(session: Session):
-    def get_session_override():
-        return session
+def client_fixture(db_path: Path, session: Session):
+    # Each request of the test client runs in its own event loop, so connections aren't pooled
+    engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}', poolclass=NullPool)
+    async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def get_async_session_override():
+        async with async_session_maker() as async_session:
+            yield async_session
 
-    app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_async_session] = get_async_session_override
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
 
 
+@pytest.fixture(name='redis')
+def redis_fixture(mocker: MockerFixture):
+    redis = FakeRedis()
+    mocker.patch('app.core.auth_cache.get_client', return_value=redis)
+    mocker.patch(
+        'app.core.auth_cache.local_cache',
+        TLRUCache(maxsize=100, ttu=lambda _key, value, now: now + value[2]),
+    )
+    yield redis
+
+
+@pytest.fixture(name='auth_headers')
+def auth_headers_fixture(session: Session, settings: Settings):
+    auth_session = AuthSession(
+        expires_date=datetime.now(UTC) + timedelta(hours=1),
+        token_version=uuid4(),
+    )
+    user = User(
+        username='johndoe',
+        hashed_password='$2b$12$AHQ9qSw9./9eosG4RuH3W.hsSUUPS5yUHocSMna7oswoWOfirTWkS',
+        full_name='John Doe',
+        auth_sessions=[auth_session],
+    )
+    session.add(user)
+    session.commit()
+    session.refresh(auth_session)
+
+    to_encode = {
+        'sub': 'johndoe',
+        'session_id': str(auth_session.id),
+        'exp': datetime.now(UTC) + timedelta(minutes=15),
+    }
+    encoded_jwt = jwt.encode(
+        to_encode, settings.auth_token_secret_key, algorithm=settings.auth_token_algorithm
+    )
+    yield {'Authorization': f'Bearer {encoded_jwt}'}
+
+
 def test_login_for_access_token(session: Session, client: TestClient):
     session.add(
         User(
@@ -1006,3 +1118,136 @@ def test_reset_password_passwords_not_match(
     assert response.status_code == 422
     assert user.password_reset_token == str(mock_token)
     assert user.hashed_password == '$2b$12$AHQ9qSw9./9eosG4RuH3W.hsSUUPS5yUHocSMna7oswoWOfirTWkS'
+
+
+def count_statements(client: TestClient, url: str, headers: dict):
+    statements: list[str] = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', count_statement)
+    try:
+        response = client.get(url, headers=headers)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count_statement)
+
+    return response, len(statements)
+
+
+def test_get_current_user_from_local_cache(
+    client: TestClient, redis: FakeRedis, auth_headers: dict
+):
+    response = client.get('/users/info', headers=auth_headers)
+    assert response.status_code == 200
+    assert redis.get_count == 1
+
+    # The token is resolved in memory, without Redis or a single query
+    response, statement_count = count_statements(client, '/users/info', auth_headers)
+    assert response.status_code == 200
+    assert response.json()['username'] == 'johndoe'
+    assert statement_count == 0
+    assert redis.get_count == 1
+
+
+def test_get_current_user_from_redis_cache(
+    client: TestClient, redis: FakeRedis, auth_headers: dict
+):
+    assert client.get('/users/info', headers=auth_headers).status_code == 200
+
+    # Another api server only has the Redis cache
+    auth_cache.local_cache.clear()
+    response, statement_count = count_statements(client, '/users/info', auth_headers)
+    assert response.status_code == 200
+    assert statement_count == 0
+    assert redis.get_count == 2
+
+
+def test_invalidation_from_other_process_evicts_local_cache(
+    session: Session, client: TestClient, redis: FakeRedis, auth_headers: dict
+):
+    assert client.get('/users/info', headers=auth_headers).status_code == 200
+
+    # Another api server ended the session and published the invalidation
+    auth_session = session.exec(select(AuthSession)).one()
+    auth_session.is_ended = True
+    session.add(auth_session)
+    session.commit()
+    redis.values.clear()
+    auth_cache.handle_invalidation(
+        json.dumps({'user_id': None, 'auth_session_id': str(auth_session.id)})
+    )
+
+    response = client.get('/users/info', headers=auth_headers)
+    assert response.status_code == 401
+
+
+def test_logout_invalidates_cached_session(
+    client: TestClient, redis: FakeRedis, auth_headers: dict
+):
+    assert client.get('/users/info', headers=auth_headers).status_code == 200
+
+    response = client.delete('/users/logout', headers=auth_headers)
+    assert response.status_code == 200
+    assert [channel for channel, _ in redis.published] == [auth_cache.invalidation_channel]
+
+    response = client.get('/users/info', headers=auth_headers)
+    assert response.status_code == 401
+
+
+def test_update_user_invalidates_cached_session(
+    client: TestClient, redis: FakeRedis, auth_headers: dict
+):
+    assert client.get('/users/info', headers=auth_headers).status_code == 200
+
+    request_data = {'username': 'johndoe', 'full_name': 'John Doeeeee'}
+    response = client.patch('/users/update', data=request_data, headers=auth_headers)
+    assert response.status_code == 200
+    assert redis.values == {}
+
+    response = client.get('/users/info', headers=auth_headers)
+    assert response.json()['full_name'] == 'John Doeeeee'
+
+
+def test_cached_user_has_no_credentials(
+    session: Session, client: TestClient, redis: FakeRedis, auth_headers: dict
+):
+    user = session.exec(select(User)).one()
+    user.password_reset_token = str(uuid4())
+    user.email_verification_token = str(uuid4())
+    session.add(user)
+    session.commit()
+
+    assert client.get('/users/info', headers=auth_headers).status_code == 200
+
+    (cached,) = [value for value in redis.values.values() if isinstance(value, str)]
+    user_data = json.loads(cached)['user']
+    assert user_data['username'] == 'johndoe'
+    assert auth_cache.private_user_fields.isdisjoint(user_data)
+    assert user.hashed_password not in cached
+    assert user.password_reset_token not in cached
+    assert user.email_verification_token not in cached
+    for user_data, _, _ in auth_cache.local_cache.values():
+        assert auth_cache.private_user_fields.isdisjoint(user_data)
+
+
+def test_send_verification_email_with_cached_user(
+    session: Session,
+    mocker: MockerFixture,
+    client: TestClient,
+    redis: FakeRedis,
+    auth_headers: dict,
+):
+    mock_add_task = mocker.patch('app.services.user_service.BackgroundTasks.add_task')
+    user = session.exec(select(User)).one()
+    user.email = 'johndoe@example.com'
+    user.email_verification_token = str(uuid4())
+    session.add(user)
+    session.commit()
+    assert client.get('/users/info', headers=auth_headers).status_code == 200
+
+    # The token of the cached user is loaded from the database, not replaced
+    response = client.post('/users/verify-email', headers=auth_headers)
+    assert response.status_code == 200
+    session.refresh(user)
+    assert user.email_verification_token in mock_add_task.call_args.kwargs['content']
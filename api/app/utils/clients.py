@@ -0,0 +1,58 @@
+import threading
+
+import requests
+from google import genai
+from google.genai import types
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.core.config import get_settings
+
+gemini_client: genai.Client | None = None
+http_session: requests.Session | None = None
+
+# Shared by the threads of the file worker, only one client of each is created
+clients_lock = threading.Lock()
+
+
+def get_gemini_client():
+    global gemini_client
+    with clients_lock:
+        if gemini_client is None:
+            settings = get_settings()
+            gemini_client = genai.Client(
+                api_key=settings.gemini_api_key,
+                http_options=types.HttpOptions(timeout=settings.gemini_timeout_ms),
+            )
+    return gemini_client
+
+
+def get_http_session():
+    global http_session
+    with clients_lock:
+        if http_session is None:
+            settings = get_settings()
+            http_session = requests.Session()
+            # Keep-alive connections, idempotent requests are retried on gateway errors
+            adapter = HTTPAdapter(
+                pool_connections=settings.http_pool_size,
+                pool_maxsize=settings.http_pool_size,
+                max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504]),
+            )
+            http_session.mount('https://', adapter)
+            http_session.mount('http://', adapter)
+    return http_session
+
+
+def get_http_timeout():
+    settings = get_settings()
+    return settings.http_connect_timeout, settings.http_read_timeout
+
+
+def close_worker_clients():
+    global gemini_client, http_session
+    with clients_lock:
+        if http_session is not None:
+            http_session.close()
+        http_session = None
+        gemini_client = None
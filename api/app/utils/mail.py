@@ -1,6 +1,15 @@
+import queue
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Email, Mail, To
 
+from app.core.config import get_settings
 from app.core.logging import logger
 
 
@@ -22,3 +31,202 @@ def send_email_with_sendgrid(
     except Exception as e:
         logger.error(e)
         logger.warn(f'Email to {", ".join(to_emails)} was unable to send')
+
+
+class EmailOutbox:
+    """Sends emails from background threads so callers never wait on SendGrid.
+
+    Emails to the same recipient with the same subject queued within a batch window are
+    merged into one email. Sends are retried with exponential backoff on network errors,
+    429 and 5xx responses.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        from_email: str,
+        host: str = 'https://api.sendgrid.com',
+        workers: int = 4,
+        queue_size: int = 1000,
+        batch_window_ms: int = 1000,
+        max_retries: int = 3,
+        retry_backoff_ms: int = 500,
+        timeout: float = 10,
+    ):
+        self.from_email = from_email
+        self.url = f'{host.rstrip("/")}/v3/mail/send'
+        self.batch_window = batch_window_ms / 1000
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff_ms / 1000
+        self.timeout = timeout
+
+        # One pooled HTTP client shared by all the workers
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {api_key}'
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.queue: queue.Queue[tuple[str, str, str]] = queue.Queue(maxsize=queue_size)
+        # Bounds the batches waiting for a worker, the rest waits in the queue
+        self.slots = threading.BoundedSemaphore(workers * 2)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='email')
+        self.stopped = threading.Event()
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+        self.counts_lock = threading.Lock()
+        self.sent_count = 0
+        self.failed_count = 0
+        self.dropped_count = 0
+
+    def send(self, to_email: str, subject: str, content: str) -> bool:
+        try:
+            self.queue.put_nowait((to_email, subject, content))
+            return True
+        except queue.Full:
+            with self.counts_lock:
+                self.dropped_count += 1
+            logger.warning(f'Email outbox is full, email to {to_email} is dropped')
+            return False
+
+    def _dispatch(self):
+        while not self.stopped.is_set() or not self.queue.empty():
+            try:
+                first_email = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            # Collect everything queued within the window, grouped by recipient and subject
+            batches: dict[tuple[str, str], list[str]] = {}
+            email = first_email
+            deadline = time.monotonic() + self.batch_window
+            while True:
+                to_email, subject, content = email
+                batches.setdefault((to_email, subject), []).append(content)
+
+                timeout = deadline - time.monotonic()
+                try:
+                    if self.stopped.is_set():
+                        # Closing, everything left is sent right away
+                        email = self.queue.get_nowait()
+                    elif timeout > 0:
+                        email = self.queue.get(timeout=timeout)
+                    else:
+                        break
+                except queue.Empty:
+                    break
+
+            for (to_email, subject), contents in batches.items():
+                self.slots.acquire()
+                self.executor.submit(self._send_batch, to_email, subject, contents)
+
+    def _send_batch(self, to_email: str, subject: str, contents: list[str]):
+        try:
+            message = Mail(
+                from_email=Email(self.from_email),
+                to_emails=[To(to_email)],
+                subject=subject,
+                html_content=''.join(contents),
+            )
+            self._post(message.get())
+            with self.counts_lock:
+                self.sent_count += 1
+            logger.info(f'Email to {to_email} has been sent successfully')
+        except Exception as e:
+            with self.counts_lock:
+                self.failed_count += 1
+            logger.error(e)
+            logger.warning(f'Email to {to_email} was unable to send')
+        finally:
+            self.slots.release()
+
+    def _post(self, body: dict):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(self.url, json=body, timeout=self.timeout)
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return
+                error = Exception(f'SendGrid responded with {response.status_code}')
+            except requests.ConnectionError as e:
+                error = e
+            except requests.Timeout as e:
+                error = e
+
+            if attempt < self.max_retries:
+                time.sleep(self.retry_backoff * 2**attempt)
+
+        raise error
+
+    def close(self):
+        # Sends what's already queued before returning
+        self.stopped.set()
+        self.dispatcher.join()
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+
+class EmailDigest:
+    """Collects items per recipient and hands them over together once per window"""
+
+    def __init__(self, send_digest: Callable[[str, list], None], window_ms: int):
+        self.send_digest = send_digest
+        self.window = window_ms / 1000
+        self.items: dict[str, list] = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self._run, daemon=True)
+        self.flusher.start()
+
+    def add(self, to_email: str, item):
+        with self.lock:
+            self.items.setdefault(to_email, []).append(item)
+
+    def flush(self):
+        with self.lock:
+            items, self.items = self.items, {}
+
+        for to_email, recipient_items in items.items():
+            try:
+                self.send_digest(to_email, recipient_items)
+            except Exception as e:
+                logger.error(f'Failed to send digest to {to_email}: {e}')
+
+    def _run(self):
+        while not self.stopped.wait(self.window):
+            self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.flusher.join()
+        self.flush()
+
+
+outbox: EmailOutbox | None = None
+outbox_lock = threading.Lock()
+
+
+def get_email_outbox():
+    global outbox
+    with outbox_lock:
+        if outbox is None:
+            settings = get_settings()
+            outbox = EmailOutbox(
+                api_key=settings.sendgrid_api_key,
+                from_email=settings.source_email,
+                host=settings.sendgrid_host,
+                workers=settings.email_workers,
+                queue_size=settings.email_queue_size,
+                batch_window_ms=settings.email_batch_window_ms,
+                max_retries=settings.email_max_retries,
+                retry_backoff_ms=settings.email_retry_backoff_ms,
+            )
+    return outbox
+
+
+def close_email_outbox():
+    global outbox
+    if outbox is not None:
+        outbox.close()
+        outbox = None
@@ -1,12 +1,72 @@
+import threading
 from typing import BinaryIO
 
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
+from requests.adapters import HTTPAdapter
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+storage_client: storage.Client | None = None
+buckets: dict[str, storage.Bucket] = {}
+# Uploads run in many worker threads at once, only one client is created
+storage_lock = threading.Lock()
+# One download buffer per thread of the file worker, reused for every file
+download_buffers = threading.local()
+
+
+def create_http_session():
+    credentials, _ = google.auth.default(scopes=storage.Client.SCOPE)
+    http_session = AuthorizedSession(credentials)
+    # Keep connections alive and share them between uploads and deletes
+    adapter = HTTPAdapter(
+        pool_connections=settings.storage_pool_size,
+        pool_maxsize=settings.storage_pool_size,
+    )
+    http_session.mount('https://', adapter)
+    return credentials, http_session
+
+
+def get_storage_client():
+    global storage_client
+    if storage_client is None:
+        with storage_lock:
+            if storage_client is None:
+                credentials, http_session = create_http_session()
+                storage_client = storage.Client(credentials=credentials, _http=http_session)
+    return storage_client
+
+
+def get_bucket(bucket_name: str):
+    bucket = buckets.get(bucket_name)
+    if bucket is None:
+        client = get_storage_client()
+        with storage_lock:
+            bucket = buckets.get(bucket_name)
+            if bucket is None:
+                bucket = client.bucket(bucket_name)
+                buckets[bucket_name] = bucket
+    return bucket
+
+
+def close_storage_client():
+    global storage_client
+    with storage_lock:
+        if storage_client is not None:
+            storage_client.close()
+            storage_client = None
+        buckets.clear()
 
 
 def upload_blob(
     bucket_name: str,
     source_file: BinaryIO,
     destination_blob_name: str,
+    content_type: str | None = None,
+    chunk_size: int | None = None,
 ):
     """Uploads a file to the bucket."""
     # The ID of your GCS bucket
@@ -15,10 +75,13 @@ def upload_blob(
     # source_file_name = "local/path/to/file"
     # The ID of your GCS object
     # destination_blob_name = "storage-object-name"
+    # The size of each chunk of a resumable upload (must be a multiple of 256KB)
+    # chunk_size = 1024 * 1024
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(destination_blob_name)
+    bucket = get_bucket(bucket_name)
+    # With a chunk size, the file is sent through a resumable upload, reading only
+    # one chunk at a time instead of loading the whole file into memory
+    blob = bucket.blob(destination_blob_name, chunk_size=chunk_size)
 
     # Optional: set a generation-match precondition to avoid potential race conditions
     # and data corruptions. The request to upload is aborted if the object's
@@ -27,7 +90,11 @@ def upload_blob(
     # If the destination object already exists in your bucket, set instead a
     # generation-match precondition using its generation number.
     generation_match_precondition = 0
-    blob.upload_from_file(source_file, if_generation_match=generation_match_precondition)
+    blob.upload_from_file(
+        source_file,
+        content_type=content_type,
+        if_generation_match=generation_match_precondition,
+    )
 
 
 def upload_blob_from_memory(
@@ -47,8 +114,7 @@ def upload_blob_from_memory(
     # The ID of your GCS object
     # destination_blob_name = "storage-object-name"
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
+    bucket = get_bucket(bucket_name)
     blob = bucket.blob(destination_blob_name)
 
     blob.upload_from_string(contents, content_type=content_type)
@@ -59,9 +125,7 @@ def delete_blob(bucket_name: str, blob_name: str):
     # bucket_name = "your-bucket-name"
     # blob_name = "your-object-name"
 
-    storage_client = storage.Client()
-
-    bucket = storage_client.bucket(bucket_name)
+    bucket = get_bucket(bucket_name)
     blob = bucket.blob(blob_name)
     generation_match_precondition = None
 
@@ -72,3 +136,46 @@ def delete_blob(bucket_name: str, blob_name: str):
     generation_match_precondition = blob.generation
 
     blob.delete(if_generation_match=generation_match_precondition)
+
+
+def download_blob(
+    bucket_name: str,
+    blob_name: str,
+    max_size: int,
+    chunk_size: int,
+    max_buffer_size: int,
+) -> bytes:
+    """Downloads a blob chunk by chunk, failing once it's larger than max_size.
+
+    The buffer of the thread is kept for the next downloads while it's no larger than
+    max_buffer_size, a buffer grown past it for a large blob is released.
+    """
+    buffer: bytearray | None = getattr(download_buffers, 'buffer', None)
+    if buffer is None:
+        buffer = download_buffers.buffer = bytearray(chunk_size)
+
+    bucket = get_bucket(bucket_name)
+    blob = bucket.blob(blob_name, chunk_size=chunk_size)
+
+    size = 0
+    try:
+        with blob.open('rb', chunk_size=chunk_size) as reader:
+            while True:
+                if size == len(buffer):
+                    # One byte over the limit is enough to know that the blob is too large
+                    buffer.extend(bytes(min(len(buffer), max_size + 1 - size)))
+
+                with memoryview(buffer)[size:] as view:
+                    read = reader.readinto(view)
+                if not read:
+                    break
+
+                size += read
+                if size > max_size:
+                    raise ValueError(f'Blob "{blob_name}" is larger than {max_size} bytes')
+
+        with memoryview(buffer)[:size] as view:
+            return bytes(view)
+    finally:
+        if len(buffer) > max_buffer_size:
+            del download_buffers.buffer
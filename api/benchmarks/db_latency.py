@@ -0,0 +1,76 @@
+"""Compares request latency of sync and async database sessions under concurrent load.
+
+Each simulated request runs one query that takes `--query-ms` on the database server,
+the same way an `async def` route would. With the sync session, every query blocks the
+event loop, so requests are served one after another. With the async session, the waits
+overlap on a single loop.
+
+Run it from the `api/` directory against the database configured in `.env`:
+
+    python -m benchmarks.db_latency --requests 200 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.core.database import async_engine, async_session_maker, engine
+
+
+def percentile(values: list[float], q: int):
+    return statistics.quantiles(values, n=100)[q - 1]
+
+
+async def sync_request(query: str):
+    # What the routes did before, synchronous I/O inside an async def
+    with Session(engine) as session:
+        session.exec(text(query))
+
+
+async def async_request(query: str):
+    async with async_session_maker() as session:
+        await session.exec(text(query))
+
+
+async def run(mode: str, requests: int, concurrency: int, query_ms: int):
+    request = sync_request if mode == 'sync' else async_request
+    query = f'SELECT pg_sleep({query_ms / 1000})'
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def timed_request():
+        async with semaphore:
+            start = time.perf_counter()
+            await request(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[timed_request() for _ in range(requests)])
+    elapsed = time.perf_counter() - start
+
+    print(
+        f'{mode:>5}: {requests / elapsed:8.1f} req/s, '
+        f'p50 {percentile(latencies, 50):8.1f} ms, '
+        f'p99 {percentile(latencies, 99):8.1f} ms'
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--query-ms', type=int, default=20)
+    args = parser.parse_args()
+
+    for mode in ['sync', 'async']:
+        await run(mode, args.requests, args.concurrency, args.query_ms)
+
+    await async_engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,66 @@
+"""Compares the size and the encoding/decoding cost of the event versions.
+
+For each event type, encodes and decodes the same event with every version of
+`app.schemas.stream` and prints the message size and the time per operation. It doesn't
+need any service, run it from the `api/` directory:
+
+    python -m benchmarks.event_serialization --iterations 100000
+"""
+
+import argparse
+import timeit
+from datetime import UTC, datetime
+
+from app.core.config import ServerMode
+from app.models.user import FileProcessingStatus
+from app.schemas.stream import (
+    FileUploadedEvent,
+    StatusUpdatedEvent,
+    compact_version,
+    decode_event,
+    encode_event,
+    json_version,
+)
+
+
+def create_events(version: int):
+    metadata = {'version': version, 'source': ServerMode.file_worker}
+    return [
+        FileUploadedEvent(
+            timestamp=datetime.now(UTC),
+            metadata=metadata,
+            payload={'file_id': 123456},
+        ),
+        StatusUpdatedEvent(
+            timestamp=datetime.now(UTC),
+            metadata=metadata,
+            payload={
+                'user_id': 4321,
+                'file_id': 123456,
+                'status': FileProcessingStatus.success,
+                'message': 'Your file "holiday-photo.jpg" has been processed',
+                'email': 'johndoe@example.com',
+            },
+        ),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    for version, name in [(json_version, 'json'), (compact_version, 'msgpack')]:
+        for event in create_events(version):
+            value = encode_event(event)
+            encode_time = timeit.timeit(lambda e=event: encode_event(e), number=args.iterations)
+            decode_time = timeit.timeit(lambda v=value: decode_event(v), number=args.iterations)
+            print(
+                f'{type(event).__name__:>18} {name:>8}: {len(value):4d} bytes, '
+                f'encode {encode_time / args.iterations * 1e6:6.2f} us, '
+                f'decode {decode_time / args.iterations * 1e6:6.2f} us'
+            )
+
+
+if __name__ == '__main__':
+    main()
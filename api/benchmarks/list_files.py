@@ -0,0 +1,174 @@
+"""Measures list_files with and without the files(user_id, sort key, id) indexes.
+
+Seeds `--rows` files spread over `--users` users once, then for each phase drops or creates
+the indexes declared on the `File` model, prints the query plan of the first page for every
+sort option and the p50/p99 latency of `list_files` on the first page, a deep offset page
+and the same position reached with a cursor.
+
+Run it from the `api/` directory against the database configured in `.env`:
+
+    python -m benchmarks.list_files --rows 1000000 --users 20
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+from app.core.database import async_engine, async_session_maker, engine
+from app.models.user import File as UserFile
+from app.models.user import User
+from app.schemas.file import SortBy, SortOrder
+from app.services import file_service as file_service_module
+from app.services.file_service import file_service
+
+seed_query = """
+INSERT INTO files (filename, status, size, type, url, created_at, object_path, user_id)
+SELECT
+    'file-' || md5(i::text) || '.txt',
+    (ARRAY['pending', 'queuing', 'processing', 'success', 'failed'])[1 + i % 5]
+        ::fileprocessingstatus,
+    1024,
+    'text/plain',
+    'http://cdn.example.com/' || i || '.txt',
+    now() - (i || ' seconds')::interval,
+    i || '.txt',
+    :first_user_id + i % :users
+FROM generate_series(1, :rows) AS i
+"""
+
+
+async def skip_credit(user_id: int):
+    # Only the database is measured, the credit lookup goes to Redis
+    return 0, None
+
+
+def percentile(values: list[float], q: int):
+    return statistics.quantiles(values, n=100)[q - 1]
+
+
+def seed(rows: int, users: int) -> int:
+    with Session(engine) as session:
+        existing = session.exec(select(User).where(User.username == 'benchmark-0')).first()
+        if existing is not None:
+            print(f'Reusing seeded files of user {existing.id}')
+            return existing.id
+
+        seeded_users = [
+            User(username=f'benchmark-{i}', hashed_password='benchmark') for i in range(users)
+        ]
+        session.add_all(seeded_users)
+        session.commit()
+        first_user_id = min(user.id for user in seeded_users)
+
+        start = time.perf_counter()
+        session.exec(
+            text(seed_query),
+            params={'first_user_id': first_user_id, 'users': users, 'rows': rows},
+        )
+        session.commit()
+        print(f'Seeded {rows} files in {time.perf_counter() - start:.1f}s')
+        return first_user_id
+
+
+def set_indexes(enabled: bool):
+    with engine.begin() as connection:
+        for index in UserFile.__table__.indexes:
+            if enabled:
+                index.create(connection, checkfirst=True)
+            else:
+                index.drop(connection, checkfirst=True)
+        connection.execute(text('ANALYZE files'))
+
+
+def explain(user_id: int, sort_by: SortBy):
+    sort = {
+        SortBy.created_at: 'created_at',
+        SortBy.name: 'filename',
+        SortBy.status: 'status',
+    }[sort_by]
+    query = (
+        f'EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM files WHERE user_id = :user_id '
+        f'ORDER BY {sort}, id LIMIT 21'
+    )
+    with Session(engine) as session:
+        plan = session.exec(text(query), params={'user_id': user_id}).all()
+    print(f'\n  {sort_by.value}:')
+    for (line,) in plan:
+        print(f'    {line}')
+
+
+async def measure(name: str, iterations: int, **kwargs):
+    latencies: list[float] = []
+    for _ in range(iterations):
+        async with async_session_maker() as session:
+            start = time.perf_counter()
+            await file_service.list_files(db=session, **kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    print(
+        f'  {name:<24} p50 {percentile(latencies, 50):8.1f} ms, '
+        f'p99 {percentile(latencies, 99):8.1f} ms'
+    )
+
+
+async def run(user_id: int, iterations: int, deep_page: int):
+    page_size = 20
+    for sort_by in SortBy:
+        explain(user_id, sort_by)
+
+    # The cursor of the row right before the deep page
+    async with async_session_maker() as session:
+        files, *_ = await file_service.list_files(
+            db=session,
+            user_id=user_id,
+            page=deep_page - 1,
+            page_size=page_size,
+            include_count=False,
+        )
+    cursor = file_service._encode_cursor(files[-1], SortBy.created_at, SortOrder.asc)
+
+    print()
+    common = {'user_id': user_id, 'page_size': page_size, 'sort_by': SortBy.created_at}
+    await measure('page 1', iterations, **common)
+    await measure(f'page {deep_page}', iterations, page=deep_page, **common)
+    await measure(
+        f'page {deep_page} without count',
+        iterations,
+        page=deep_page,
+        include_count=False,
+        **common,
+    )
+    await measure(
+        f'cursor at page {deep_page}',
+        iterations,
+        cursor=cursor,
+        include_count=False,
+        **common,
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--deep-page', type=int, default=1000)
+    args = parser.parse_args()
+
+    file_service_module.peek_credit = skip_credit
+    user_id = seed(args.rows, args.users)
+
+    for enabled in [False, True]:
+        print(f'\n=== {"with" if enabled else "without"} indexes ===')
+        set_indexes(enabled)
+        await run(user_id, args.iterations, args.deep_page)
+
+    await async_engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
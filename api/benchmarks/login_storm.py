@@ -0,0 +1,82 @@
+"""Checks that a login storm doesn't slow down the other endpoints of an api server.
+
+Measures the latency of the health endpoint alone, then while `--concurrency` clients log
+in as fast as they can. Password hashing runs in a bounded pool, so the health latency
+should stay flat and logins beyond the queue limit are answered with 503.
+
+Start an api server, then run it from the `api/` directory:
+
+    python -m benchmarks.login_storm --url http://localhost:8000/api/v1 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections import Counter
+
+import httpx
+
+username = 'benchmark-login'
+password = 'benchmark-password'
+
+
+def percentile(values: list[float], q: int):
+    return statistics.quantiles(values, n=100)[q - 1]
+
+
+async def sample_health(client: httpx.AsyncClient, url: str, duration: float):
+    latencies: list[float] = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await client.get(f'{url}/')
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+    return latencies
+
+
+async def login_until(client: httpx.AsyncClient, url: str, deadline: float, statuses: Counter):
+    while time.perf_counter() < deadline:
+        response = await client.post(
+            f'{url}/users/login', data={'username': username, 'password': password}
+        )
+        statuses[response.status_code] += 1
+        if response.status_code == 503:
+            await asyncio.sleep(float(response.headers.get('Retry-After', 1)))
+
+
+def report(name: str, latencies: list[float]):
+    print(
+        f'{name:>8}: health p50 {percentile(latencies, 50):7.1f} ms, '
+        f'p99 {percentile(latencies, 99):7.1f} ms, max {max(latencies):7.1f} ms'
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8000/api/v1')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        # Fails with 400 once the user exists
+        await client.post(
+            f'{args.url}/users/register',
+            data={'username': username, 'password': password, 'password_repeat': password},
+        )
+
+        report('idle', await sample_health(client, args.url, args.duration))
+
+        statuses: Counter = Counter()
+        deadline = time.perf_counter() + args.duration
+        storm = [login_until(client, args.url, deadline, statuses) for _ in range(args.concurrency)]
+        latencies, *_ = await asyncio.gather(sample_health(client, args.url, args.duration), *storm)
+        report('storm', latencies)
+        print(f'  logins: {dict(statuses)}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""Compares uploading files one request at a time with a single upload-batch request.
+
+Uploads `--files` files of `--size` random bytes with one `POST /files/upload` per file,
+sequentially then concurrently, and with one `POST /files/upload-batch`, then prints the
+wall time and the time per file of each phase. Every file is charged a credit, so start
+the api server with a credit limit that covers the 3 phases, e.g. `CREDIT_LIMIT=1000`.
+
+Start an api server, then run it from the `api/` directory:
+
+    python -m benchmarks.upload_batch --url http://localhost:8000/api/v1 --files 50
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+username = 'benchmark-upload'
+password = 'benchmark-password'
+
+
+def create_files(count: int, size: int):
+    # Random contents, copies of processed files would skip the pipeline
+    return [(f'benchmark-{i}.bin', os.urandom(size)) for i in range(count)]
+
+
+def as_form_file(filename: str, content: bytes):
+    return (filename, content, 'application/octet-stream')
+
+
+def report(name: str, elapsed: float, count: int, statuses: list[int]):
+    failed = sum(status != 200 for status in statuses)
+    print(
+        f'{name:>12}: {elapsed * 1000:8.1f} ms, {elapsed / count * 1000:6.1f} ms per file, '
+        f'{failed} failed'
+    )
+
+
+async def upload_one(client: httpx.AsyncClient, url: str, filename: str, content: bytes):
+    response = await client.post(
+        f'{url}/files/upload', files={'file': as_form_file(filename, content)}
+    )
+    return response.status_code
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8000/api/v1')
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.files)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        # Fails with 400 once the user exists
+        await client.post(
+            f'{args.url}/users/register',
+            data={'username': username, 'password': password, 'password_repeat': password},
+        )
+        response = await client.post(
+            f'{args.url}/users/login', data={'username': username, 'password': password}
+        )
+        response.raise_for_status()
+        client.headers['Authorization'] = f'Bearer {response.json()["access_token"]}'
+
+        files = create_files(args.files, args.size)
+        start = time.perf_counter()
+        statuses = [await upload_one(client, args.url, *file) for file in files]
+        report('sequential', time.perf_counter() - start, args.files, statuses)
+
+        files = create_files(args.files, args.size)
+        start = time.perf_counter()
+        statuses = await asyncio.gather(*[upload_one(client, args.url, *file) for file in files])
+        report('concurrent', time.perf_counter() - start, args.files, statuses)
+
+        files = create_files(args.files, args.size)
+        start = time.perf_counter()
+        response = await client.post(
+            f'{args.url}/files/upload-batch',
+            files=[('files', as_form_file(*file)) for file in files],
+        )
+        elapsed = time.perf_counter() - start
+        statuses = [response.status_code] * args.files
+        if response.status_code == 200:
+            statuses = [200 if result['file'] else 400 for result in response.json()['results']]
+        report('batch', elapsed, args.files, statuses)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())